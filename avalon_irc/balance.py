@@ -0,0 +1,185 @@
+"""Vectorized balance analysis of game plans and role configurations.
+
+Simulates many games under random play at once with NumPy: every game is a
+row of the state arrays and all games advance one team proposal per step.
+Requires numpy (pip3 install avalon-irc[balance]).
+
+    python3 -m avalon_irc.balance --players 7 --games 1000000 mordred oberon
+
+Random play is the model of simulator.RandomPolicy: random teams, every
+player accepts a team with accept_probability, evil players on a quest
+play fail with fail_probability and the Assassin kills a random player.
+check_against_engine() compares the results to the Simulator.
+"""
+
+import collections
+import math
+import time
+
+import numpy as np
+
+from .game import AvalonGame
+from .simulator import Simulator, RandomPolicy
+
+
+# Reasons for the end of a game
+Quests, Rejections, Assassination = range(3)
+
+
+class BalanceReport(collections.namedtuple("BalanceReport", "games evil_wins evil_wins_by_reason good_wins_by_reason role_wins role_games elapsed")):
+    @property
+    def evil_win_rate(self):
+        return self.evil_wins / self.games
+
+    @property
+    def games_per_second(self):
+        return self.games / self.elapsed if self.elapsed > 0 else float("inf")
+
+    def __str__(self):
+        lines = ["{} games, Evil won {:.2%} ({:.0f} games/s)".format(self.games, self.evil_win_rate, self.games_per_second)]
+        lines.append("Evil wins by three failed quests: {:.2%}, five rejected teams: {:.2%}, assassination: {:.2%}".format(
+            *[self.evil_wins_by_reason[r] / self.games for r in (Quests, Rejections, Assassination)]))
+        for role, games in self.role_games.items():
+            lines.append("{:<30} won {:.2%}".format(role.long_name, self.role_wins[role] / games))
+        return "\n".join(lines)
+
+
+def role_setup(player_count, game_args):
+    """Return the role classes for the configuration, or raise ValueError if
+    the game cannot be started with it."""
+    plan = AvalonGame.plan_roles(player_count, game_args)
+    if plan.role_classes is None:
+        raise ValueError(plan.reason)
+    return plan.role_classes
+
+
+def simulate_batch(rng, player_count, role_classes, games, accept_probability, fail_probability):
+    """Play games in lockstep, one team proposal per step. Return arrays of
+    seat -> role index per game, True if Evil won, and the reason the game
+    ended."""
+    plan = AvalonGame.game_plans[player_count]
+    team_sizes = np.array([q.team_size for q in plan])
+    fails_required = np.array([q.fails_required for q in plan])
+    assassin_role = [role.is_assassin for role in role_classes].index(True)
+    merlin_role = [role.is_merlin for role in role_classes].index(True)
+
+    # Random permutation of the roles for every game
+    roles = np.argsort(rng.random((games, player_count)), axis=1)
+
+    quest = np.zeros(games, dtype=np.int8)
+    successes = np.zeros(games, dtype=np.int8)
+    fails = np.zeros(games, dtype=np.int8)
+    failed_votes = np.zeros(games, dtype=np.int8)
+    evil_won = np.zeros(games, dtype=bool)
+    reason = np.zeros(games, dtype=np.int8)
+    active = np.arange(games)
+
+    evil_count = AvalonGame.game_plans_evil_count[player_count]
+    good_count = player_count - evil_count
+
+    while len(active):
+        n = len(active)
+        accepted = rng.binomial(player_count, accept_probability, n) * 2 > player_count
+
+        rejected = active[~accepted]
+        failed_votes[rejected] += 1
+        lost = rejected[failed_votes[rejected] >= 5]
+        evil_won[lost] = True
+        reason[lost] = Rejections
+
+        on_quest = active[accepted]
+        failed_votes[on_quest] = 0
+        # A random team of team_size players holds a hypergeometric number of evil players.
+        evil_on_team = rng.hypergeometric(evil_count, good_count, team_sizes[quest[on_quest]])
+        fail_votes = rng.binomial(evil_on_team, fail_probability)
+        quest_failed = fail_votes >= fails_required[quest[on_quest]]
+        fails[on_quest] += quest_failed
+        successes[on_quest] += ~quest_failed
+        quest[on_quest] += 1
+
+        failed_three = on_quest[fails[on_quest] >= 3]
+        evil_won[failed_three] = True
+        reason[failed_three] = Quests
+
+        succeeded_three = on_quest[successes[on_quest] >= 3]
+        assassin_seat = np.argmax(roles[succeeded_three] == assassin_role, axis=1)
+        merlin_seat = np.argmax(roles[succeeded_three] == merlin_role, axis=1)
+        target = rng.integers(0, player_count - 1, len(succeeded_three))
+        target += target >= assassin_seat
+        evil_won[succeeded_three] = target == merlin_seat
+        reason[succeeded_three] = Assassination
+
+        still_active = np.ones(games, dtype=bool)
+        still_active[lost] = False
+        still_active[failed_three] = False
+        still_active[succeeded_three] = False
+        active = active[still_active[active]]
+
+    return roles, evil_won, reason
+
+
+def simulate(player_count, game_args, games, accept_probability=0.5, fail_probability=0.5, seed=None, batch_size=100000):
+    role_classes = role_setup(player_count, game_args)
+    rng = np.random.default_rng(seed)
+    evil_wins = 0
+    evil_wins_by_reason = collections.Counter()
+    good_wins_by_reason = collections.Counter()
+    role_wins = collections.Counter()
+    role_games = collections.Counter()
+    start = time.perf_counter()
+    for batch_start in range(0, games, batch_size):
+        batch = min(batch_size, games - batch_start)
+        roles, evil_won, reason = simulate_batch(rng, player_count, role_classes, batch, accept_probability, fail_probability)
+        batch_evil_wins = int(evil_won.sum())
+        evil_wins += batch_evil_wins
+        for r in (Quests, Rejections, Assassination):
+            evil_wins_by_reason[r] += int((evil_won & (reason == r)).sum())
+            good_wins_by_reason[r] += int((~evil_won & (reason == r)).sum())
+        for role in role_classes:
+            role_games[role] += batch
+            role_wins[role] += batch_evil_wins if role.evil else batch - batch_evil_wins
+    elapsed = time.perf_counter() - start
+    return BalanceReport(games, evil_wins, evil_wins_by_reason, good_wins_by_reason, role_wins, role_games, elapsed)
+
+
+def check_against_engine(player_count, game_args, games, accept_probability=0.5, fail_probability=0.5, seed=0):
+    """Play games with the object-based Simulator and 10 times as many with
+    simulate(). Return both Evil win rates and the z-score of the difference."""
+    sim = Simulator(RandomPolicy(accept_probability, fail_probability), seed=seed)
+    engine = sim.run(games, player_count, game_args)
+    vectorized = simulate(player_count, game_args, games * 10, accept_probability, fail_probability, seed=seed)
+    p1 = engine.evil_win_rate
+    p2 = vectorized.evil_win_rate
+    p = (engine.evil_wins + vectorized.evil_wins) / (engine.games + vectorized.games)
+    stderr = math.sqrt(p * (1 - p) * (1 / engine.games + 1 / vectorized.games))
+    return p1, p2, (p1 - p2) / stderr if stderr > 0 else 0.0
+
+
+def main():
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description="Estimate win rates under random play.")
+    parser.add_argument("--games", type=int, default=1000000)
+    parser.add_argument("--players", type=int, default=5, choices=sorted(AvalonGame.game_plans))
+    parser.add_argument("--accept-probability", type=float, default=0.5)
+    parser.add_argument("--fail-probability", type=float, default=0.5)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--check", type=int, metavar="GAMES", default=0,
+        help="also compare with GAMES games of the object-based simulator")
+    parser.add_argument("game_args", nargs="*", metavar="game_arg", help=", ".join(AvalonGame.valid_game_args))
+    args = parser.parse_args()
+
+    try:
+        print(simulate(args.players, args.game_args, args.games, args.accept_probability, args.fail_probability, args.seed))
+        if args.check:
+            engine_rate, vectorized_rate, z = check_against_engine(args.players, args.game_args, args.check,
+                args.accept_probability, args.fail_probability, args.seed or 0)
+            print("Check: Simulator {:.2%}, vectorized {:.2%}, z = {:.2f}".format(engine_rate, vectorized_rate, z))
+    except ValueError as e:
+        print("Error: {}".format(e))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""Measure the per-message dispatch cost of AvalonBot with many active games.
+
+Run with `python3 -m avalon_irc.benchmark.bench_dispatch`. The cost per
+message should stay flat from 1 to 1000 games. The other columns are the
+cost with metrics enabled, which times every game handler, and with
+tracing to a file in the temporary directory.
+"""
+
+import os
+import random
+import tempfile
+import time
+
+from ..bot import AvalonBot
+
+
+class QuietBot(AvalonBot):
+    """AvalonBot that drops outgoing messages instead of sending them."""
+
+    def send_pubmsg(self, channel, msg):
+        pass
+
+    def send_privmsg(self, nick, msg):
+        pass
+
+    def send_privmsgs(self, messages):
+        pass
+
+
+def setup_bot(game_count, tmpdir, metrics_port=None, trace_filename=None):
+    channels = ["#avalon{}".format(i) for i in range(game_count)]
+    bot = QuietBot(channels, "Avalon", "localhost", highscore_filename=os.path.join(tmpdir, "highscore.db"),
+        game_log_dir=os.path.join(tmpdir, "games"), history_dir=os.path.join(tmpdir, "history"),
+        metrics_port=metrics_port, trace_filename=trace_filename)
+    players = []
+    for channel in channels:
+        for i in range(5):
+            nick = "{}_p{}".format(channel[1:], i)
+            bot.loop.run_until_complete(bot.process_pubmsg(nick, channel, "!join"))
+            players.append(nick)
+        bot.loop.run_until_complete(bot.process_pubmsg(players[-1], channel, "!start"))
+    return bot, channels, players
+
+
+def bench(game_count, message_count=20000, metrics=False, tracing=False):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        bot, channels, players = setup_bot(game_count, tmpdir, 0 if metrics else None,
+            os.path.join(tmpdir, "traces.jsonl") if tracing else None)
+        rng = random.Random(0)
+        nicks = [rng.choice(players) for i in range(message_count)]
+
+        async def run():
+            for i, nick in enumerate(nicks):
+                if i % 2:
+                    await bot.process_privmsg(nick, "identify")
+                else:
+                    await bot.process_pubmsg(nick, "#" + nick.split("_")[0], "hello")
+
+        start = time.perf_counter()
+        bot.loop.run_until_complete(run())
+        elapsed = time.perf_counter() - start
+        bot.close_files()
+        bot.loop.close()
+    return elapsed / message_count
+
+
+def main():
+    print("{:>6} {:>14} {:>14} {:>14}".format("games", "us/message", "with metrics", "with tracing"))
+    for game_count in (1, 10, 100, 1000):
+        print("{:>6} {:>14.2f} {:>14.2f} {:>14.2f}".format(game_count, bench(game_count) * 1e6,
+            bench(game_count, metrics=True) * 1e6, bench(game_count, tracing=True) * 1e6))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""Microbenchmark of the AvalonGame handlers over simulated games.
+
+Run with `python3 -m avalon_irc.benchmark.bench_game`. Games are recorded
+with the Simulator first, then only the replay of their handler calls is
+timed, so the cost of the player policies is not included.
+"""
+
+import collections
+import random
+import time
+
+from ..game import AvalonGame
+from ..simulator import Simulator, SimulationBot, SilentAvalonGame, RandomPolicy
+
+
+def record(games, player_count, game_args=(), seed=0):
+    """Return a list of (rng state, actions) for games played by random players."""
+    sim = Simulator(RandomPolicy(), seed=seed)
+    transcripts = []
+    for i in range(games):
+        state = sim.rng.getstate()
+        actions = []
+        sim.play(player_count, game_args, actions)
+        transcripts.append((state, actions))
+    return transcripts
+
+
+def replay(transcripts, game_class):
+    """Replay transcripts, return the elapsed seconds."""
+    bot = SimulationBot()
+    rng = random.Random()
+    start = time.perf_counter()
+    for state, actions in transcripts:
+        rng.setstate(state)
+        game = game_class(bot, rng=rng)
+        for name, args in actions:
+            getattr(game, name)(*args)
+    return time.perf_counter() - start
+
+
+def replay_per_handler(transcripts, game_class):
+    """Replay transcripts, return handler name -> [calls, total seconds]."""
+    bot = SimulationBot()
+    rng = random.Random()
+    timings = collections.defaultdict(lambda: [0, 0.0])
+    perf_counter = time.perf_counter
+    for state, actions in transcripts:
+        rng.setstate(state)
+        game = game_class(bot, rng=rng)
+        for name, args in actions:
+            handler = getattr(game, name)
+            start = perf_counter()
+            handler(*args)
+            elapsed = perf_counter() - start
+            t = timings[name]
+            t[0] += 1
+            t[1] += elapsed
+    return timings
+
+
+def main():
+    games = 2000
+    for player_count, game_args in ((5, []), (10, ["percival", "morgana", "mordred", "oberon"])):
+        transcripts = record(games, player_count, game_args)
+        print("{} players {}".format(player_count, " ".join(game_args)))
+        for game_class in (AvalonGame, SilentAvalonGame):
+            elapsed = replay(transcripts, game_class)
+            print("  {:<18} {:>10.0f} games/s".format(game_class.__name__, games / elapsed))
+        for name, (calls, total) in sorted(replay_per_handler(transcripts, AvalonGame).items()):
+            print("  {:<22} {:>8.2f} us/call".format(name, total / calls * 1e6))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""Benchmark of GameHistory: appending games and !stats queries.
+
+    python3 -m avalon_irc.benchmark.bench_history [--games N] [--players N]
+
+Appends games of random players to a new history in a temporary directory
+and times player_stats() for the most and the least active player. A query
+follows the seat rows of one player, so its time depends on the games of
+that player, not on the size of the history.
+"""
+
+import collections
+import random
+import tempfile
+import time
+
+from ..history import GameHistory
+from ..simulator import Simulator, RandomPolicy, SilentAvalonGame
+
+
+def simulated_games(count, seed=0):
+    """Return count finished games with the nicks P0 ... P9."""
+    finished = []
+
+    class RecordingGame(SilentAvalonGame):
+        def end_game(self, winner):
+            SilentAvalonGame.end_game(self, winner)
+            finished.append(self)
+
+    sim = Simulator(RandomPolicy(), seed=seed)
+    sim.game_class = RecordingGame
+    rng = random.Random(seed)
+    for i in range(count):
+        sim.play(rng.randint(5, 10))
+    return finished
+
+
+def time_query(history, nick, repeat=20):
+    """Return the best seconds of player_stats(nick) out of repeat runs."""
+    best = float("inf")
+    for i in range(repeat):
+        start = time.perf_counter()
+        history.player_stats(nick)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def run(game_count, player_count, seed=0):
+    # Games are simulated once and appended again with other players, the
+    # history does not care.
+    games = simulated_games(min(game_count, 1000), seed)
+    rng = random.Random(seed)
+    # Some players play much more often than others.
+    pool = ["nick{}".format(i) for i in range(player_count)]
+    weights = [1 / (i + 1) for i in range(player_count)]
+    games_played = collections.Counter()
+    with tempfile.TemporaryDirectory() as directory:
+        history = GameHistory(directory)
+        start = time.perf_counter()
+        for i in range(game_count):
+            game = games[i % len(games)]
+            players = set()
+            while len(players) < len(game.players):
+                players.update(rng.choices(pool, weights, k=len(game.players) - len(players)))
+            game.players = list(players)
+            games_played.update(game.players)
+            history.append(game)
+        append_seconds = (time.perf_counter() - start) / game_count
+        most, least = games_played.most_common()[0][0], games_played.most_common()[-1][0]
+        results = {
+            "append": append_seconds,
+            "stats of {} ({} games)".format(most, games_played[most]): time_query(history, most),
+            "stats of {} ({} games)".format(least, games_played[least]): time_query(history, least),
+        }
+        history.close()
+    return results
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Time appends to the game history and !stats queries.")
+    parser.add_argument("--games", type=int, default=100000)
+    parser.add_argument("--players", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print("{} games of {} players".format(args.games, args.players))
+    for name, seconds in run(args.games, args.players, args.seed).items():
+        print("{:<40} {:>10.3f} ms".format(name, seconds * 1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,280 @@
+"""End-to-end load test of AvalonBot over a local IRC server.
+
+    python3 -m avalon_irc.benchmark.bench_load --tables 40 --players 5 --games 3
+
+Starts ircserver.IRCServer on localhost, runs AvalonBot in a child
+process, and connects tables x players simulated players, one IRC
+connection each, that play complete games: !join, !start, !team, votes
+via /msg and !kill. The time from every command to the bot's response is
+recorded. The report contains latency percentiles, message rates and the
+CPU time and peak memory of the bot process, read from /proc. With --max-p99-ms the exit
+status is 1 if the 99th percentile latency is higher, for use as a
+release gate.
+
+The bot's outbound rate limit is raised to --rate lines per second, the
+real limit would dominate the measured latency.
+"""
+
+import asyncio
+import multiprocessing
+import os
+import random
+import re
+import signal
+import sys
+import tempfile
+import time
+
+from ..bot import AvalonBot
+from ..outbound import OutboundQueue
+from .ircserver import IRCServer
+
+
+BOT_NICK = "Avalon"
+
+leader_re = re.compile(r"For quest \d/5, (\S+) now selects a team of (\d+) players")
+team_re = re.compile(r"has chosen the following team: ([^.]*)\.")
+quest_re = re.compile(r"Team ([^:]*): you have been accepted for the quest")
+registered_re = re.compile(r"Players registered: ((?:[^ ,]+, )*[^ ,.]+)")
+assassination_re = re.compile(r"the Assassin can turn still turn the game around")
+game_over_re = re.compile(r"(Good|Evil) wins! Evil players were")
+
+
+class LoadTestBot(AvalonBot):
+    def __init__(self, *args, rate, **kwargs):
+        AvalonBot.__init__(self, *args, **kwargs)
+        self.outbound = OutboundQueue(self.connection.privmsg, self.nickname, rate=rate, burst=rate)
+        self.outbound.hold()
+
+
+def run_bot(port, channels, rate, directory):
+    """Child process: run the bot until SIGINT."""
+    bot = LoadTestBot(channels, BOT_NICK, "127.0.0.1", port, rate=rate,
+        highscore_filename=os.path.join(directory, "highscore.db"),
+        game_log_dir=os.path.join(directory, "games"), history_dir=os.path.join(directory, "history"))
+    bot.run()
+
+
+def process_usage(pid):
+    """Return the CPU seconds and the peak RSS in KiB of process pid."""
+    with open("/proc/{}/stat".format(pid)) as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    cpu_seconds = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    max_rss = 0
+    with open("/proc/{}/status".format(pid)) as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                max_rss = int(line.split()[1])
+    return cpu_seconds, max_rss
+
+
+class Player:
+    """One simulated player with its own IRC connection."""
+
+    def __init__(self, table, nick, rng):
+        self.table = table
+        self.nick = nick
+        self.rng = rng
+        self.evil = False
+        self.assassin = False
+        self.expected = [] # (compiled regex, time the command was sent)
+        self.writer = None
+
+    async def connect(self, port):
+        reader, self.writer = await asyncio.open_connection("127.0.0.1", port)
+        self.send_line("NICK {}".format(self.nick))
+        self.send_line("USER {} 0 * :{}".format(self.nick, self.nick))
+        self.send_line("JOIN {}".format(self.table.channel))
+        return reader
+
+    def send_line(self, line):
+        self.writer.write(line.encode("utf-8") + b"\r\n")
+
+    def command(self, target, text, response):
+        """Send text to target and expect a message from the bot matching response."""
+        self.expected.append((re.compile(response), time.perf_counter()))
+        self.table.stats.commands += 1
+        self.send_line("PRIVMSG {} :{}".format(target, text))
+
+    def check_response(self, text):
+        now = time.perf_counter()
+        for i, (regex, sent_at) in enumerate(self.expected):
+            if regex.search(text):
+                self.table.stats.latencies.append(now - sent_at)
+                del self.expected[i]
+                return
+
+    async def read_loop(self, reader):
+        while True:
+            line = await reader.readline()
+            if not line:
+                return
+            line = line.decode("utf-8", "replace").rstrip("\r\n")
+            if not line.startswith(":" + BOT_NICK + "!"):
+                continue
+            parts = line.split(" ", 3)
+            if len(parts) < 4 or parts[1] != "PRIVMSG":
+                continue
+            target, text = parts[2], parts[3][1:]
+            self.check_response(text)
+            if target.lower() == self.table.channel.lower():
+                if self is self.table.players[0]:
+                    self.table.stats.bot_lines += 1
+                self.table.handle_pubmsg(self, text)
+            else:
+                self.table.stats.bot_lines += 1
+                self.handle_privmsg(text)
+
+    def handle_privmsg(self, text):
+        if text.startswith("You are "):
+            self.evil = "evil player" in text
+            self.assassin = text.startswith("You are the Assassin")
+
+
+class Table:
+    """The players of one channel. Plays games until `games` are finished."""
+
+    def __init__(self, stats, channel, nicks, games, rng):
+        self.stats = stats
+        self.channel = channel
+        self.players = [Player(self, nick, random.Random(rng.random())) for nick in nicks]
+        self.by_nick = {player.nick: player for player in self.players}
+        self.games_left = games
+        self.done = asyncio.Event()
+
+    def join_all(self):
+        for player in self.players:
+            player.command(self.channel, "!join", r"Players registered: .*\b{}\b".format(re.escape(player.nick)))
+
+    def handle_pubmsg(self, player, text):
+        """Called for every player that receives the channel message text. Only
+        the player concerned acts."""
+        for m in registered_re.finditer(text):
+            if player is self.players[0] and len(m.group(1).split(", ")) == len(self.players):
+                player.command(self.channel, "!start", r"The game has started!")
+        for m in leader_re.finditer(text):
+            if m.group(1) == player.nick:
+                team = player.rng.sample(sorted(self.by_nick), int(m.group(2)))
+                player.command(self.channel, "!team " + " ".join(team),
+                    r"{} has chosen the following team".format(re.escape(player.nick)))
+        if team_re.search(text):
+            player.command(BOT_NICK, "accept" if player.rng.random() < 0.7 else "reject", r"^Vote cast\.$")
+        for m in quest_re.finditer(text):
+            if player.nick in m.group(1).split(", "):
+                fail = player.evil and player.rng.random() < 0.5
+                player.command(BOT_NICK, "fail" if fail else "success", r"^Vote cast\.$")
+        if assassination_re.search(text) and player.assassin:
+            target = player.rng.choice([nick for nick in self.by_nick if nick != player.nick])
+            player.command(self.channel, "!kill " + target, r"The Assassin (has killed Merlin|was unsuccessful)")
+        if game_over_re.search(text) and player is self.players[0]:
+            self.stats.games += 1
+            self.games_left -= 1
+            if self.games_left > 0:
+                self.join_all()
+            else:
+                self.done.set()
+
+
+class LoadStats:
+    def __init__(self):
+        self.latencies = []
+        self.commands = 0
+        self.bot_lines = 0
+        self.games = 0
+
+    def percentile(self, p):
+        latencies = sorted(self.latencies)
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] if latencies else float("nan")
+
+
+async def wait_for(condition, timeout, interval=0.01):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise TimeoutError()
+        await asyncio.sleep(interval)
+
+
+async def load_test(tables=40, players=5, games=3, rate=10000, seed=0, timeout=300):
+    """Run the load test, return (LoadStats, elapsed seconds, bot CPU seconds
+    during the games, bot peak RSS in KiB)."""
+    server = IRCServer()
+    port = await server.start()
+    channels = ["#load{}".format(i) for i in range(tables)]
+    rng = random.Random(seed)
+    stats = LoadStats()
+    ctx = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as directory:
+        process = ctx.Process(target=run_bot, args=(port, channels, rate, directory))
+        process.start()
+        table_list = []
+        tasks = []
+        try:
+            await wait_for(lambda: all(BOT_NICK in server.members(channel) for channel in channels), 30)
+
+            table_list = [Table(stats, channel, ["t{}p{}".format(i, j) for j in range(players)], games, rng)
+                for i, channel in enumerate(channels)]
+            for table in table_list:
+                for player in table.players:
+                    reader = await player.connect(port)
+                    tasks.append(asyncio.ensure_future(player.read_loop(reader)))
+            await wait_for(lambda: all(len(server.members(table.channel)) == players + 1 for table in table_list), 30)
+
+            cpu_before, max_rss = process_usage(process.pid)
+            start = time.perf_counter()
+            for table in table_list:
+                table.join_all()
+            await asyncio.wait_for(asyncio.gather(*[table.done.wait() for table in table_list]), timeout)
+            elapsed = time.perf_counter() - start
+            # The private responses to the last votes can arrive after the
+            # channel message that ended the game.
+            try:
+                await wait_for(lambda: not any(player.expected for table in table_list for player in table.players), 5)
+            except TimeoutError:
+                pass
+            cpu_after, max_rss = process_usage(process.pid)
+        finally:
+            os.kill(process.pid, signal.SIGINT)
+            process.join(10)
+            if process.is_alive():
+                process.kill()
+            for task in tasks:
+                task.cancel()
+            for table in table_list:
+                for player in table.players:
+                    player.writer.close()
+            try:
+                await wait_for(lambda: not server.clients, 5)
+            finally:
+                await server.close()
+    return stats, elapsed, cpu_after - cpu_before, max_rss
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Load test AvalonBot over a local IRC server.")
+    parser.add_argument("--tables", type=int, default=40)
+    parser.add_argument("--players", type=int, default=5, help="players per table")
+    parser.add_argument("--games", type=int, default=3, help="games per table")
+    parser.add_argument("--rate", type=int, default=10000, help="outbound lines per second of the bot")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--max-p99-ms", type=float, default=None, help="exit with status 1 above this latency")
+    args = parser.parse_args()
+
+    stats, elapsed, cpu_seconds, max_rss = asyncio.run(load_test(args.tables, args.players, args.games,
+        args.rate, args.seed, args.timeout))
+    p99_ms = stats.percentile(0.99) * 1000
+    print("{} players at {} tables played {} games in {:.2f} s".format(args.tables * args.players, args.tables, stats.games, elapsed))
+    print("Latency (ms): p50 {:.2f}, p90 {:.2f}, p99 {:.2f}, max {:.2f} over {} responses".format(
+        stats.percentile(0.5) * 1000, stats.percentile(0.9) * 1000, p99_ms, stats.percentile(1) * 1000, len(stats.latencies)))
+    print("Messages: {:.0f} commands/s, {:.0f} bot lines/s".format(stats.commands / elapsed, stats.bot_lines / elapsed))
+    print("Bot: {:.2f} s CPU ({:.0%} of one core), peak RSS {:.1f} MiB".format(cpu_seconds, cpu_seconds / elapsed, max_rss / 1024))
+    if args.max_p99_ms is not None and p99_ms > args.max_p99_ms:
+        print("Error: p99 latency {:.2f} ms exceeds {:.2f} ms.".format(p99_ms, args.max_p99_ms))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+"""Replay benchmark of AvalonGame over transcripts.
+
+    python3 -m avalon_irc.benchmark.bench_replay [transcript ...] [--save FILE] [--compare FILE]
+
+Replays transcripts recorded by AvalonBot (transcript_filename=...) and a
+synthetic suite, one game per configuration of 5 to 10 players and every
+combination of game arguments, at full speed against AvalonGame. Reports
+the time and the peak memory allocated per call of every command. Results
+can be saved as JSON and compared with a baseline saved by an earlier
+version.
+"""
+
+import collections
+import json
+import random
+import time
+import tracemalloc
+
+from ..game import AvalonGame
+from ..simulator import Simulator, SimulationBot, RandomPolicy
+from ..tournament import all_game_args
+from .. import transcript
+
+
+def synthetic_events(games_per_config=20, seed=0, channel="#bench"):
+    """Return transcript events of random games in every valid configuration."""
+    rng = random.Random(seed)
+    sim = Simulator(RandomPolicy(), format_messages=True)
+    events = []
+    for player_count in sorted(AvalonGame.game_plans):
+        for game_args in all_game_args():
+            if AvalonGame.plan_roles(player_count, game_args).role_classes is None:
+                continue
+            for i in range(games_per_config):
+                game_seed = rng.getrandbits(32)
+                sim.rng.seed(game_seed)
+                actions = []
+                sim.play(player_count, game_args, actions)
+                events.append([0, "g", channel, game_seed])
+                for name, args in actions:
+                    events.append(action_event(channel, name, args))
+    return events
+
+
+def action_event(channel, name, args):
+    """Return the message event that makes AvalonGame call handler name with args."""
+    nick = args[0]
+    if name == "handle_join":
+        return [0, "p", channel, nick, "!join"]
+    if name == "handle_start":
+        return [0, "p", channel, nick, "!start {}".format(args[1]).strip()]
+    if name == "handle_team":
+        return [0, "p", channel, nick, "!team {}".format(args[1])]
+    if name == "handle_kill":
+        return [0, "p", channel, nick, "!kill {}".format(args[1])]
+    if name == "handle_accept_reject":
+        return [0, "m", nick, "accept" if args[1] else "reject"]
+    if name == "handle_success_fail":
+        return [0, "m", nick, "fail" if args[1] else "success"]
+    raise ValueError("Unknown handler {}".format(name))
+
+
+def command_name(msg, public):
+    if public:
+        return msg.split(" ", 1)[0].lower() if msg.startswith("!") else "(chat)"
+    return msg.lower()
+
+
+class Replay:
+    """Routes transcript events to AvalonGames the way AvalonBot does."""
+
+    def __init__(self):
+        self.bot = SimulationBot()
+        self.games = {} # channel -> AvalonGame
+        self.player_games = {} # nick -> AvalonGame
+
+    def commands(self, events):
+        """Apply game creations and yield (command name, bound handler, args)
+        for the messages, in order. The caller must call the handler before
+        advancing the generator."""
+        for event in events:
+            kind = event[1]
+            if kind == "g":
+                channel = event[2].lower()
+                old_game = self.games.get(channel)
+                if old_game:
+                    for player in old_game.players:
+                        if self.player_games.get(player) is old_game:
+                            del self.player_games[player]
+                self.games[channel] = AvalonGame(self.bot, rng=random.Random(event[3]))
+            elif kind == "p":
+                channel, nick, msg = event[2].lower(), event[3], event[4]
+                game = self.games.get(channel)
+                if game is None:
+                    continue
+                other_game = self.player_games.get(nick)
+                if other_game and (other_game is not game) and msg.lower().split(" ")[0] == "!join":
+                    continue
+                yield command_name(msg, True), game.handle_pubmsg, (nick, msg)
+                if nick in game.players:
+                    self.player_games[nick] = game
+                elif self.player_games.get(nick) is game:
+                    del self.player_games[nick]
+            elif kind == "m":
+                nick, msg = event[2], event[3]
+                game = self.player_games.get(nick)
+                if game is not None:
+                    yield command_name(msg, False), game.handle_privmsg, (nick, msg)
+            elif kind == "x":
+                # Reminders only send a message and start the deadline, which
+                # is recorded when it fires.
+                game = self.games.get(event[2].lower())
+                if game is not None and event[3] == "handle_deadline":
+                    yield "(deadline)", game.handle_deadline, ()
+
+
+def time_handlers(events, repeat=3):
+    """Return command name -> [calls, seconds per call], best of repeat runs."""
+    best = {}
+    perf_counter = time.perf_counter
+    for i in range(repeat):
+        timings = collections.defaultdict(lambda: [0, 0.0])
+        for name, handler, args in Replay().commands(events):
+            start = perf_counter()
+            handler(*args)
+            elapsed = perf_counter() - start
+            t = timings[name]
+            t[0] += 1
+            t[1] += elapsed
+        for name, (calls, total) in timings.items():
+            if not name in best or total / calls < best[name][1]:
+                best[name] = [calls, total / calls]
+    return best
+
+
+def trace_allocations(events):
+    """Return command name -> mean peak bytes allocated per call."""
+    allocated = collections.defaultdict(lambda: [0, 0])
+    tracemalloc.start()
+    try:
+        for name, handler, args in Replay().commands(events):
+            before = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            handler(*args)
+            a = allocated[name]
+            a[0] += 1
+            a[1] += tracemalloc.get_traced_memory()[1] - before
+    finally:
+        tracemalloc.stop()
+    return {name: total / calls for name, (calls, total) in allocated.items()}
+
+
+def run(events, label=""):
+    timings = time_handlers(events)
+    allocations = trace_allocations(events)
+    return {
+        "label": label,
+        "handlers": {name: {"calls": calls, "us_per_call": seconds * 1e6, "bytes_per_call": allocations[name]}
+            for name, (calls, seconds) in sorted(timings.items())},
+    }
+
+
+def report(results, baseline=None):
+    lines = ["{:<12} {:>8} {:>10} {:>12}".format("command", "calls", "us/call", "bytes/call")]
+    for name, r in results["handlers"].items():
+        line = "{:<12} {:>8} {:>10.2f} {:>12.0f}".format(name, r["calls"], r["us_per_call"], r["bytes_per_call"])
+        old = baseline["handlers"].get(name) if baseline else None
+        if old:
+            line += "  {:+7.1%} time {:+7.1%} bytes vs {}".format(
+                r["us_per_call"] / old["us_per_call"] - 1,
+                r["bytes_per_call"] / old["bytes_per_call"] - 1 if old["bytes_per_call"] else 0.0,
+                baseline["label"] or "baseline")
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Replay transcripts against AvalonGame and time every command.")
+    parser.add_argument("transcripts", nargs="*", help="recorded transcripts, default: synthetic suite only")
+    parser.add_argument("--games", type=int, default=20, help="synthetic games per configuration")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--label", default="", help="name of this version in saved results")
+    parser.add_argument("--save", metavar="FILE", help="save results as JSON")
+    parser.add_argument("--compare", metavar="FILE", help="compare with results saved earlier")
+    args = parser.parse_args()
+
+    suites = [("synthetic", synthetic_events(args.games, args.seed))]
+    for filename in args.transcripts:
+        suites.append((filename, transcript.load(filename)))
+
+    baselines = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baselines = json.load(f)
+
+    saved = {}
+    for name, events in suites:
+        results = run(events, args.label)
+        saved[name] = results
+        print("{} ({} events)".format(name, len(events)))
+        print(report(results, baselines.get(name)))
+        print()
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(saved, f, indent=1)
+
+
+if __name__ == "__main__":
+    main()
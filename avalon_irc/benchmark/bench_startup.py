@@ -0,0 +1,85 @@
+"""Startup benchmark: cold import of the game engine and of the CLI.
+
+    python3 -m avalon_irc.benchmark.bench_startup [--runs N]
+
+Every command runs in a fresh interpreter, the time of `python -c pass` is
+subtracted so that only the cost of our imports remains. The game engine
+and `avalon-irc --help` must not load the IRC client or asyncio, their
+budgets are enforced by test_startup.py. Importing avalon_irc.bot, which
+does load them, is reported for comparison.
+"""
+
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# The directory containing the avalon_irc package, the commands run there.
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# name -> python arguments
+COMMANDS = {
+    "baseline": ["-c", "pass"],
+    "import game": ["-c", "import avalon_irc.game"],
+    "cli --help": ["-m", "avalon_irc.cli", "--help"],
+    "import bot": ["-c", "import avalon_irc.bot"],
+}
+
+# Milliseconds above the baseline, generous enough for slow CI machines.
+BUDGETS_MS = {
+    "import game": 100,
+    "cli --help": 100,
+}
+
+# Modules the lightweight commands must not import.
+HEAVY_MODULES = ["irc", "asyncio"]
+
+
+def time_command(args, runs=5):
+    """Return the median wall time in seconds of running python with args."""
+    times = []
+    for i in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable] + args, check=True, stdout=subprocess.DEVNULL, cwd=ROOT)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def loaded_modules(args):
+    """Return the names of the modules loaded after running python with args."""
+    code = "import runpy, sys\n"
+    if args[0] == "-c":
+        code += args[1] + "\n"
+    else:
+        code += "sys.argv = [{!r}] + {!r}\n".format(args[1], args[2:])
+        code += "try:\n    runpy.run_module({!r}, run_name='__main__')\nexcept SystemExit:\n    pass\n".format(args[1])
+    code += "print(' '.join(sys.modules))\n"
+    output = subprocess.run([sys.executable, "-c", code], check=True, capture_output=True, text=True,
+        cwd=ROOT).stdout
+    return set(output.split("\n")[-2].split())
+
+
+def run(runs=5):
+    """Return name -> milliseconds above the baseline."""
+    baseline = time_command(COMMANDS["baseline"], runs)
+    return {name: (time_command(args, runs) - baseline) * 1000
+        for name, args in COMMANDS.items() if name != "baseline"}
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Time cold imports of the game engine and the CLI.")
+    parser.add_argument("--runs", type=int, default=10, help="runs per command, the median is reported")
+    args = parser.parse_args()
+
+    print("{:<12} {:>8} {:>8}  {}".format("command", "ms", "budget", "heavy modules"))
+    for name, ms in run(args.runs).items():
+        heavy = [m for m in HEAVY_MODULES if m in loaded_modules(COMMANDS[name])]
+        budget = BUDGETS_MS.get(name)
+        print("{:<12} {:>8.1f} {:>8}  {}".format(name, ms, budget or "-", ", ".join(heavy) or "-"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""Benchmark of the status lines of AvalonGame against building them anew.
+
+    python3 -m avalon_irc.benchmark.bench_status [--calls N]
+
+AvalonGame.quest_overview_str() and roles_str() look up lines shared by all
+games with the same configuration. The functions below are the formatting
+they replaced, which rebuilt the lines on every call. Both are timed on
+started games of 5 to 10 players in every state of the quests.
+"""
+
+import itertools
+import random
+import time
+
+from ..game import AvalonGame
+from ..simulator import SimulationBot
+from ..tournament import all_game_args
+
+
+def uncached_quest_overview_str(game):
+    overview_str=""
+    for idx in range(5):
+        if idx>0:
+            overview_str+=" | "
+        quest_result="undecided"
+        if game.current_quest > idx:
+            if game.quest_results[idx]:
+                quest_result="succeeded"
+            else:
+                quest_result="failed"
+        fails_required = game.game_plan[idx].fails_required
+        team_size = game.game_plan[idx].team_size
+        overview_str+="Quest {} (team of {}{}): {}".format(
+            idx+1,
+            team_size,
+            ", two fail votes required to fail" if fails_required == 2 else "",
+            quest_result
+        )
+    return overview_str
+
+
+def uncached_roles_str(game):
+    count_evil={}
+    count_good={}
+    for role in game.roles:
+        cur_count=(count_evil if role.evil else count_good)
+        if role.long_name in cur_count:
+            cur_count[role.long_name]+=1
+        else:
+            cur_count[role.long_name]=1
+
+    evil_roles=[]
+    for role, count in count_evil.items():
+        if count==1:
+            evil_roles.append(role)
+        else:
+            evil_roles.append("{}x {}".format(count, role))
+    good_roles=[]
+    for role, count in count_good.items():
+        if count==1:
+            good_roles.append(role)
+        else:
+            good_roles.append("{}x {}".format(count, role))
+
+    return "Good role cards in play: {}. Evil role cards in play: {}.".format(
+        ", ".join(good_roles),
+        ", ".join(evil_roles)
+    )
+
+
+def started_games(seed=0):
+    """Return a started game for every valid configuration of 5 to 10 players."""
+    bot = SimulationBot()
+    games = []
+    for player_count in sorted(AvalonGame.game_plans):
+        for game_args in all_game_args():
+            if AvalonGame.plan_roles(player_count, game_args).role_classes is None:
+                continue
+            game = AvalonGame(bot, rng=random.Random(seed))
+            for i in range(player_count):
+                game.handle_join("p{}".format(i))
+            game.handle_start("p0", " ".join(game_args))
+            games.append(game)
+    return games
+
+
+def quest_states():
+    """Return every list of quest results a running or finished game can have."""
+    states = [[]]
+    for n in range(1, 6):
+        for results in itertools.product([True, False], repeat=n):
+            if results.count(True) <= 3 and results.count(False) <= 3:
+                states.append(list(results))
+    return states
+
+
+def time_calls(func, games, calls):
+    """Return the mean seconds per call of func(game), cycling over games."""
+    rounds = max(1, calls // len(games))
+    start = time.perf_counter()
+    for i in range(rounds):
+        for game in games:
+            func(game)
+    return (time.perf_counter() - start) / (rounds * len(games))
+
+
+def run(calls=200000):
+    """Return line name -> (uncached seconds per call, cached seconds per call)."""
+    games = started_games()
+    overview_games = []
+    for player_count in sorted(AvalonGame.game_plans):
+        for quest_results in quest_states():
+            game = AvalonGame(SimulationBot())
+            game.players = ["p{}".format(i) for i in range(player_count)]
+            game.quest_results = quest_results
+            overview_games.append(game)
+    return {
+        "quest overview": (time_calls(uncached_quest_overview_str, overview_games, calls),
+            time_calls(AvalonGame.quest_overview_str, overview_games, calls)),
+        "roles in play": (time_calls(uncached_roles_str, games, calls),
+            time_calls(AvalonGame.roles_str, games, calls)),
+    }
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Time the status lines of AvalonGame with and without caching.")
+    parser.add_argument("--calls", type=int, default=200000)
+    args = parser.parse_args()
+
+    print("{:<16} {:>12} {:>12} {:>8}".format("line", "uncached us", "cached us", "speedup"))
+    for name, (uncached, cached) in run(args.calls).items():
+        print("{:<16} {:>12.3f} {:>12.3f} {:>7.1f}x".format(name, uncached * 1e6, cached * 1e6, uncached / cached))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""Minimal IRC server for local load tests.
+
+Implements just enough of RFC 1459 for AvalonBot and the simulated players
+of bench_load: registration with NICK and USER, PING, JOIN, PART, PRIVMSG
+to channels and nicks, and QUIT. There is no flood protection, so the
+measured latency is the latency of the bot.
+"""
+
+import asyncio
+
+
+class Client:
+    def __init__(self, server, writer):
+        self.server = server
+        self.writer = writer
+        self.nick = None
+        self.user = None
+        self.channels = set()
+
+    @property
+    def prefix(self):
+        return "{}!{}@localhost".format(self.nick, self.user)
+
+    def send(self, line):
+        self.writer.write(line.encode("utf-8") + b"\r\n")
+
+
+class IRCServer:
+    name = "localhost"
+
+    def __init__(self, host="127.0.0.1", port=0):
+        self.host = host
+        self.port = port
+        self.clients = {} # lowercased nick -> Client
+        self.channels = {} # lowercased channel -> set of Client
+        self.lines_received = 0
+        self.server = None
+
+    async def start(self):
+        """Start listening, return the port."""
+        self.server = await asyncio.start_server(self.handle_connection, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self.port
+
+    async def close(self):
+        self.server.close()
+        for client in list(self.clients.values()):
+            client.writer.close()
+        await self.server.wait_closed()
+
+    def members(self, channel):
+        return {client.nick for client in self.channels.get(channel.lower(), ())}
+
+    async def handle_connection(self, reader, writer):
+        client = Client(self, writer)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                self.lines_received += 1
+                self.handle_line(client, line.decode("utf-8", "replace").rstrip("\r\n"))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.quit(client)
+            writer.close()
+
+    def handle_line(self, client, line):
+        if line.startswith(":"):
+            line = line.split(" ", 1)[1] if " " in line else ""
+        if " :" in line:
+            line, trailing = line.split(" :", 1)
+            params = line.split() + [trailing]
+        else:
+            params = line.split()
+        if not params:
+            return
+        command = params.pop(0).upper()
+        handler = getattr(self, "cmd_" + command, None)
+        if handler:
+            handler(client, params)
+
+    def reply(self, client, numeric, text):
+        client.send(":{} {} {} :{}".format(self.name, numeric, client.nick or "*", text))
+
+    def cmd_NICK(self, client, params):
+        nick = params[0]
+        if nick.lower() in self.clients:
+            self.reply(client, "433", "Nickname is already in use.")
+            return
+        if client.nick:
+            del self.clients[client.nick.lower()]
+        client.nick = nick
+        self.clients[nick.lower()] = client
+        self.welcome(client)
+
+    def cmd_USER(self, client, params):
+        client.user = params[0]
+        self.welcome(client)
+
+    def welcome(self, client):
+        if client.nick and client.user:
+            self.reply(client, "001", "Welcome to the local network {}".format(client.prefix))
+
+    def cmd_PING(self, client, params):
+        client.send(":{} PONG {} :{}".format(self.name, self.name, params[0] if params else ""))
+
+    def cmd_JOIN(self, client, params):
+        for channel in params[0].split(","):
+            members = self.channels.setdefault(channel.lower(), set())
+            members.add(client)
+            client.channels.add(channel.lower())
+            for member in members:
+                member.send(":{} JOIN {}".format(client.prefix, channel))
+
+    def cmd_PART(self, client, params):
+        for channel in params[0].split(","):
+            members = self.channels.get(channel.lower(), set())
+            for member in members:
+                member.send(":{} PART {}".format(client.prefix, channel))
+            members.discard(client)
+            client.channels.discard(channel.lower())
+
+    def cmd_PRIVMSG(self, client, params):
+        target, text = params[0], params[-1]
+        line = ":{} PRIVMSG {} :{}".format(client.prefix, target, text)
+        if target[0] in "#&":
+            for member in self.channels.get(target.lower(), ()):
+                if member is not client:
+                    member.send(line)
+        elif target.lower() in self.clients:
+            self.clients[target.lower()].send(line)
+        else:
+            self.reply(client, "401", "No such nick/channel")
+
+    def cmd_QUIT(self, client, params):
+        self.quit(client)
+
+    def quit(self, client):
+        for channel in client.channels:
+            self.channels[channel].discard(client)
+        client.channels = set()
+        if client.nick and self.clients.get(client.nick.lower()) is client:
+            del self.clients[client.nick.lower()]
@@ -1,89 +1,499 @@
 
-import irc.bot
+import asyncio
+import concurrent.futures
+import fnmatch
+import functools
+import os
+import random
+import irc.client
+import irc.client_aio
+import signal
 import string
+import time
+import traceback
 from .game import AvalonGame
+from .gamelog import GameLogStore, SYNC_BATCH
 from .highscore import Highscore
-import textwrap
+from .history import GameHistory
+from .metrics import Metrics, instrumented_game_class
+from .outbound import OutboundQueue
+from .profiler import SamplingProfiler
+from .timers import TimerWheel
+from .tracing import Tracer, traced_game_class
+from .transcript import TranscriptRecorder
+from .cli import main, parse_server # compatibility with the old entry point
 
 
-class AvalonBot(irc.bot.SingleServerIRCBot):
-    def __init__(self, channel, nickname, server, port=6667, highscore_filename="highscore.json"):
-        irc.bot.SingleServerIRCBot.__init__(self, [(server, port)], nickname, nickname)
+class ChannelGameBot:
+    """Stands in as the bot for the AvalonGame of one channel, so that the
+    game's public messages go to the channel it is played in."""
+
+    def __init__(self, bot, channel):
+        self.bot = bot
         self.channel = channel
-        self.game = AvalonGame(self)
+
+    @property
+    def highscore(self):
+        return self.bot.highscore
+
+    @property
+    def history(self):
+        return self.bot.history
+
+    @property
+    def nickname(self):
+        return self.bot.get_nickname()
+
+    def send_pubmsg(self, msg):
+        """Send message to all players. For use by AvalonGame class."""
+        self.bot.send_pubmsg(self.channel, msg)
+
+    def send_privmsg(self, nick, msg):
+        """Send private message to one player. For use by AvalonGame class."""
+        self.bot.send_privmsg(nick, msg)
+
+    def send_privmsgs(self, messages):
+        """Send a batch of (nick, message) private messages. For use by AvalonGame class."""
+        self.bot.send_privmsgs(messages)
+
+    def schedule(self, delay, callback):
+        """Call callback after delay seconds. For use by AvalonGame class."""
+        return self.bot.schedule_game_timer(self.channel, delay, callback)
+
+
+class AvalonBot(irc.client_aio.AioSimpleIRCClient):
+    """IRC bot running on an asyncio event loop (self.loop).
+
+    Incoming messages are processed by the process_pubmsg and process_privmsg
+    coroutines. Game logic runs inline, highscore results are applied in
+    memory and committed by the background writer of the highscore, so
+    other coroutines can share the loop. The other files are written on
+    one disk thread (self.disk_executor): the game logs, the transcript,
+    the traces and the game history. Outgoing messages are paced by
+    self.outbound.
+
+    Every game logs its events to game_log_dir. The logs are written every
+    game_log_interval seconds (or on every event with game_log_sync="always")
+    and games still running are recovered from them on restart.
+
+    With transcript_filename, all inbound messages are recorded, see
+    transcript.py. New games then get their own seeded rng, so that the
+    transcript can be replayed. Games recovered from a game log at start
+    are not part of the transcript.
+
+    The phases of all games have deadlines (phase_timeouts, see
+    AvalonGame.default_phase_timeouts, {} disables them), kept on one timer
+    wheel that is advanced every second.
+
+    Finished games are appended to the game history in history_dir, see
+    history.py, which answers !stats. The disk thread appends them through
+    its own GameHistory, self.history only answers the queries on the loop.
+
+    With metrics_port, the game handlers, the outbound queue and the
+    highscore commits are timed and served in the Prometheus text format on
+    http://metrics_host:metrics_port/metrics, see metrics.py.
+
+    Admins, whose nick!user@host matches one of the admins masks, can take a
+    profile of the running bot with "!profile [seconds]" in a private
+    message, as can SIGUSR1. It is written to profile_dir, see profiler.py.
+
+    With trace_filename, every inbound message and game timer is traced
+    through the game handlers and the outbound queue until its lines are
+    sent, see tracing.py."""
+
+    reconnect_interval = 60
+    game_log_interval = 1.0
+    default_profile_seconds = 30
+    max_profile_seconds = 300
+
+    def __init__(self, channels, nickname, server, port=6667, highscore_filename="highscore.db", loop=None,
+            game_log_dir="games", game_log_sync=SYNC_BATCH, transcript_filename=None, phase_timeouts=None,
+            history_dir="history", metrics_port=None, metrics_host="127.0.0.1", admins=(), profile_dir="profiles",
+            trace_filename=None):
+        self.loop = loop or asyncio.new_event_loop()
+        self.reactor_class = functools.partial(irc.client_aio.AioReactor, loop=self.loop)
+        irc.client_aio.AioSimpleIRCClient.__init__(self)
+        self.server = server
+        self.port = port
+        self.nickname = nickname
+        if isinstance(channels, str):
+            channels = [channels]
+        self.games = {} # channel -> AvalonGame
+        self.player_games = {} # nick -> AvalonGame the nick is registered for
+        self.game_logs = GameLogStore(game_log_dir, game_log_sync)
+        self.transcript = TranscriptRecorder(transcript_filename) if transcript_filename else None
+        self.phase_timeouts = AvalonGame.default_phase_timeouts if phase_timeouts is None else phase_timeouts
+        self.timers = TimerWheel()
+        self.disk_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="avalon-disk")
+        self.history_dir = history_dir
+        self.history = GameHistory(history_dir)
+        self.history_writer = None # GameHistory of the disk thread, opened by the first append
+        self.metrics = None
+        self.metrics_host = metrics_host
+        self.metrics_port = metrics_port
+        self.game_class = AvalonGame
+        if metrics_port is not None:
+            self.metrics = Metrics()
+            self.game_class = instrumented_game_class(AvalonGame, self.metrics)
+            self.games_finished = self.metrics.counter("avalon_games_finished_total", "Games played to the end.")
+            self.highscore_commit_seconds = self.metrics.histogram("avalon_highscore_commit_seconds",
+                "Duration of highscore commits on the writer thread.")
+            self.highscore_lag_seconds = self.metrics.histogram("avalon_highscore_lag_seconds",
+                "Time from the end of a game until its result was committed, the oldest of each commit.")
+            self.metrics.add_collector(self.collect_metrics)
+        self.tracer = None
+        if trace_filename:
+            self.tracer = Tracer(trace_filename)
+            self.game_class = traced_game_class(self.game_class, self.tracer)
+        self.admins = [mask.lower() for mask in admins] # nick!user@host masks
+        self.profile_dir = profile_dir
+        self.profiler = None
+        for channel in channels:
+            self.add_channel(channel)
         self.debug_game = False
-        self.highscore = Highscore(highscore_filename)
+        self.highscore = Highscore(highscore_filename, write_behind=True)
+        if self.metrics:
+            self.highscore.writer.on_commit = self.observe_highscore_commit
+        self.outbound = OutboundQueue(self.connection.privmsg, nickname)
+        self.outbound.hold() # until on_welcome()
+        if self.metrics:
+            self.outbound.observe_wait = self.metrics.histogram("avalon_outbound_wait_seconds",
+                "Time from queueing a message until its line is sent.").observe
+        self.outbound.tracer = self.tracer
+
+    def add_channel(self, channel):
+        key = channel.lower()
+        if not key in self.games:
+            game = self.game_logs.recover(channel)
+            if game is None:
+                game = self.new_game(channel)
+            else:
+                game.__class__ = self.game_class
+                game.bot = ChannelGameBot(self, channel)
+                game.log = self.game_logs.open(channel)
+                game.timeouts = self.phase_timeouts
+                game.set_deadline()
+                for player in game.players:
+                    self.player_games.setdefault(player, game)
+            self.games[key] = game
+
+    def join_channel(self, channel):
+        """Add channel while running."""
+        self.add_channel(channel)
+        if self.connection.is_connected():
+            self.connection.join(channel)
+
+    def new_game(self, channel):
+        rng = None
+        if self.transcript:
+            seed = random.getrandbits(32)
+            rng = random.Random(seed)
+            self.transcript.new_game(channel, seed)
+        game = self.game_class(ChannelGameBot(self, channel), rng=rng)
+        game.log = self.game_logs.open(channel)
+        game.timeouts = self.phase_timeouts
+        return game
+
+    def schedule_game_timer(self, channel, delay, callback):
+        def fire():
+            game = self.games.get(channel.lower())
+            trace = self.tracer.start("timer", target=channel) if self.tracer else None
+            try:
+                if self.transcript:
+                    self.transcript.timer(channel, callback.__name__)
+                try:
+                    callback()
+                except Exception:
+                    # Keep the timers of the other games running.
+                    traceback.print_exc()
+                if game is not None:
+                    self.check_finish(game)
+            finally:
+                if trace:
+                    self.tracer.finish(trace)
+        return self.timers.schedule(delay, fire)
+
+    async def run_timers(self):
+        while True:
+            await asyncio.sleep(self.timers.tick)
+            self.timers.advance()
+
+    async def connect_forever(self):
+        """Connect to the server, retrying every reconnect_interval seconds."""
+        while True:
+            try:
+                await self.connection.connect(self.server, self.port, self.nickname)
+                return
+            except (OSError, irc.client.ServerConnectionError) as e:
+                print("Connection failed: {}".format(e))
+                await asyncio.sleep(self.reconnect_interval)
+
+    def collect_metrics(self):
+        """Return the gauges of the bot for Metrics.render()."""
+        phase_counts = [0]*len(AvalonGame.phase_names)
+        for game in self.games.values():
+            phase_counts[game.phase] += 1
+        gauges = [("avalon_games", "Games by phase.", {"phase": name}, count)
+            for name, count in zip(AvalonGame.phase_names, phase_counts)]
+        gauges.append(("avalon_players", "Players registered for a game.", {}, len(self.player_games)))
+        gauges.append(("avalon_outbound_depth", "Messages waiting in the outbound queue.", {}, self.outbound.depth))
+        gauges.append(("avalon_highscore_durability_lag_seconds",
+            "Age of the oldest highscore result not committed yet, 0 if all are committed.", {}, self.highscore.writer.lag()))
+        return gauges
+
+    def observe_highscore_commit(self, results, seconds, lag):
+        """Called on the writer thread of the highscore after every commit."""
+        self.highscore_commit_seconds.observe(seconds)
+        self.highscore_lag_seconds.observe(lag)
+
+    def run(self):
+        """Connect and run the event loop until interrupted."""
+        metrics_server = None
+        if self.metrics:
+            metrics_server = self.loop.run_until_complete(self.metrics.start_server(self.metrics_host, self.metrics_port))
+        tasks = [
+            self.loop.create_task(self.connect_forever()),
+            self.loop.create_task(self.outbound.run()),
+            self.loop.create_task(self.flush_game_logs()),
+            self.loop.create_task(self.run_timers()),
+        ]
+        self.loop.add_signal_handler(signal.SIGUSR1, self.start_profile)
+        try:
+            self.reactor.process_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.loop.remove_signal_handler(signal.SIGUSR1)
+            if self.profiler:
+                self.profiler.stop()
+            self.close_files()
+            self.highscore.close()
+            for task in tasks:
+                task.cancel()
+            self.loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            if metrics_server:
+                metrics_server.close()
+                self.loop.run_until_complete(metrics_server.wait_closed())
+
+    async def flush_game_logs(self):
+        """Write the game logs, the transcript and the traces every
+        game_log_interval seconds on the disk thread, so fsync does not
+        block the loop."""
+        while True:
+            await asyncio.sleep(self.game_log_interval)
+            await self.loop.run_in_executor(self.disk_executor, self.flush_files)
+
+    def flush_files(self):
+        """Write the game logs, the transcript and the traces. Runs on the disk thread."""
+        self.game_logs.flush()
+        if self.transcript:
+            self.transcript.flush()
+        if self.tracer:
+            self.tracer.flush()
+
+    def append_history(self, game):
+        """Append a finished game to the history. Runs on the disk thread."""
+        try:
+            if self.history_writer is None:
+                self.history_writer = GameHistory(self.history_dir)
+            self.history_writer.append(game)
+        except Exception:
+            traceback.print_exc()
+
+    def wait_for_disk(self):
+        """Wait until the disk thread has done all work queued so far."""
+        self.disk_executor.submit(lambda: None).result()
+
+    def close_files(self):
+        """Finish the work of the disk thread and close the files it writes."""
+        self.disk_executor.shutdown(wait=True)
+        self.game_logs.flush()
+        if self.history_writer:
+            self.history_writer.close()
+        self.history.close()
+        if self.tracer:
+            self.tracer.close()
+        if self.transcript:
+            self.transcript.close()
+
+    def on_disconnect(self, c, e):
+        self.outbound.hold()
+        self.loop.call_later(self.reconnect_interval, lambda: self.loop.create_task(self.connect_forever()))
+
+    def get_nickname(self):
+        """Return the nick the server knows the bot by. It differs from
+        self.nickname, the nick asked for on every connect, after
+        on_nicknameinuse() or a nick change."""
+        if self.connection.is_connected():
+            return self.connection.get_nickname()
+        return self.nickname
 
     def on_nicknameinuse(self, c, e):
         c.nick(c.get_nickname() + "_")
 
     def on_welcome(self, c, e):
-        c.join(self.channel)
+        # RPL_WELCOME usually ends with our nick!user@host.
+        prefix = e.arguments[0].split(" ")[-1] if e.arguments else ""
+        if "!" in prefix and "@" in prefix:
+            self.outbound.set_prefix(prefix)
+        self.outbound.release()
+        for game in self.games.values():
+            c.join(game.bot.channel)
 
-    def check_finish(self):
-        if self.game.phase == AvalonGame.Finished:
+    def update_player_game(self, nick, game):
+        """Keep self.player_games in sync after nick has sent a command to game.
+        Only !join and !leave change game.players, and only for the sending nick."""
+        if nick in game.players:
+            self.player_games[nick] = game
+        elif self.player_games.get(nick) is game:
+            del self.player_games[nick]
+
+    def check_finish(self, game):
+        if game.phase == AvalonGame.Finished:
+            for player in game.players:
+                if self.player_games.get(player) is game:
+                    del self.player_games[player]
+            self.disk_executor.submit(self.append_history, game)
+            if self.metrics:
+                self.games_finished.inc()
             # Start new game:
-            self.game = AvalonGame(self)
-            
+            channel = game.bot.channel
+            self.game_logs.discard(channel)
+            self.games[channel.lower()] = self.new_game(channel)
 
-    def on_privmsg(self, c, e):
-        nick = e.source.split("!")[0]
-        msg = e.arguments[0]
-        self.game.handle_privmsg(nick, msg)
-        self.check_finish()
-        
-    def on_pubmsg(self, c, e):
-        nick = e.source.split("!")[0]
-        msg = e.arguments[0]
+    def dispatch_privmsg(self, game, nick, msg):
+        game.handle_privmsg(nick, msg)
+
+    def dispatch_pubmsg(self, game, nick, msg):
+        other_game = self.player_games.get(nick)
+        if other_game and (other_game is not game) and msg.lower().split(" ")[0] == "!join":
+            self.send_pubmsg(game.bot.channel, "{}: You are already registered in {}.".format(nick, other_game.bot.channel))
+            return
+        game.handle_pubmsg(nick, msg)
+        self.update_player_game(nick, game)
+
+    async def process_privmsg(self, nick, msg, received=None):
+        """Process a private message, received at perf_counter() received."""
+        if self.tracer:
+            trace = self.tracer.start("privmsg", received, nick=nick, command=msg.split(" ", 1)[0].lower())
+            try:
+                self.process_game_privmsg(nick, msg)
+            finally:
+                self.tracer.finish(trace)
+        else:
+            self.process_game_privmsg(nick, msg)
+
+    def process_game_privmsg(self, nick, msg):
+        if self.transcript:
+            self.transcript.privmsg(nick, msg)
+        game = self.player_games.get(nick)
+        if game is None:
+            self.send_privmsg(nick, "You are not registered for a game. Type !join in a game channel first.")
+            return
+        self.dispatch_privmsg(game, nick, msg)
+        self.check_finish(game)
+
+    async def process_pubmsg(self, nick, channel, msg, received=None):
+        """Process a channel message, received at perf_counter() received."""
+        if self.tracer:
+            trace = self.tracer.start("pubmsg", received, nick=nick, target=channel,
+                command=msg.split(" ", 1)[0].lower() if msg.startswith("!") else None)
+            try:
+                self.process_game_pubmsg(nick, channel, msg)
+            finally:
+                self.tracer.finish(trace)
+        else:
+            self.process_game_pubmsg(nick, channel, msg)
+
+    def process_game_pubmsg(self, nick, channel, msg):
+        if self.transcript:
+            self.transcript.pubmsg(channel, nick, msg)
+        game = self.games.get(channel.lower())
+        if game is None:
+            return
         if self.debug_game and msg.startswith("!!"):
             first_excl = msg[2:].find("!")
             if first_excl>=0:
                 print("Debug pubmsg received.")
-                self.game.handle_pubmsg(msg[2:2+first_excl], msg[2+first_excl:])
+                self.dispatch_pubmsg(game, msg[2:2+first_excl], msg[2+first_excl:])
         if self.debug_game and msg.startswith("@@"):
             first_excl = msg[2:].find(" ")
             if first_excl>=0:
                 print("Debug privmsg received.")
-                self.game.handle_privmsg(msg[2:2+first_excl], msg[2+first_excl+1:])
+                self.dispatch_privmsg(game, msg[2:2+first_excl], msg[2+first_excl+1:])
         else:
-            self.game.handle_pubmsg(nick, msg)
-        self.check_finish()
-    
-    def send_pubmsg(self, msg):
-        """Send message to all players. For use by AvalonGame class."""
-        for line in textwrap.wrap(msg, 200):
-            self.connection.privmsg(self.channel, line)
+            self.dispatch_pubmsg(game, nick, msg)
+        self.check_finish(game)
+
+    def is_admin(self, source):
+        """Return whether the nick!user@host source matches an admin mask."""
+        return any(fnmatch.fnmatchcase(source.lower(), mask) for mask in self.admins)
+
+    def report(self, nick, msg):
+        """Tell an admin, or the console if nick is None."""
+        if nick is None:
+            print(msg)
+        else:
+            self.send_privmsg(nick, msg)
+
+    def start_profile(self, seconds=None, nick=None):
+        """Profile the event loop thread for seconds on a background thread
+        and write the profile to profile_dir. Running games are not affected."""
+        if self.profiler and self.profiler.running:
+            self.report(nick, "A profile is already being taken.")
+            return
+        seconds = min(max(seconds or self.default_profile_seconds, 1), self.max_profile_seconds)
+        profiler = self.profiler = SamplingProfiler()
+        prefix = os.path.join(self.profile_dir, time.strftime("profile-%Y%m%d-%H%M%S-") + str(os.getpid()))
+
+        def done():
+            try:
+                msg = "Profile written to {} and {}.".format(*profiler.write(prefix))
+            except OSError as e:
+                msg = "Could not write the profile: {}".format(e)
+            self.loop.call_soon_threadsafe(self.report, nick, msg)
+        profiler.start(seconds, done)
+        self.report(nick, "Profiling for {} seconds.".format(seconds))
+
+    def handle_profile(self, nick, msg):
+        args = msg.split()
+        seconds = None
+        if len(args) > 1:
+            if not args[1].isdigit():
+                self.send_privmsg(nick, "Usage: !profile [seconds]")
+                return
+            seconds = int(args[1])
+        self.start_profile(seconds, nick)
+
+    def on_privmsg(self, c, e):
+        nick = e.source.split("!")[0]
+        if self.admins and e.arguments[0].lower().split(" ")[0] == "!profile" and self.is_admin(e.source):
+            self.handle_profile(nick, e.arguments[0])
+            return
+        self.loop.create_task(self.process_privmsg(nick, e.arguments[0], time.perf_counter()))
+
+    def on_pubmsg(self, c, e):
+        nick = e.source.split("!")[0]
+        self.loop.create_task(self.process_pubmsg(nick, e.target, e.arguments[0], time.perf_counter()))
+
+    def send_pubmsg(self, channel, msg):
+        """Queue message to all players in channel."""
+        self.outbound.put(channel, msg)
 
     def send_privmsg(self, nick, msg):
-        """Send private message to one player. For use by AvalonGame class."""
-        self.connection.privmsg(nick, msg)
+        """Queue private message to one player."""
+        self.outbound.put(nick, msg)
         #self.connection.notice(nick, msg)
         if self.debug_game:
             print("privmsg to {}: {}".format(nick, msg))
             #self.send_pubmsg("((privmsg to {}: {}))".format(nick, msg))
-        
-def main():
-    import sys
-
-    if len(sys.argv) != 4:
-        print("Usage: avalon-irc <server[:port]> <channel> <nickname>")
-        sys.exit(1)
 
-    s = sys.argv[1].split(":", 1)
-    server = s[0]
-    if len(s) == 2:
-        try:
-            port = int(s[1])
-        except ValueError:
-            print("Error: Erroneous port.")
-            sys.exit(1)
-    else:
-        port = 6667
-    channel = sys.argv[2]
-    nickname = sys.argv[3]
-
-    bot = AvalonBot(channel, nickname, server, port)
-    bot.start()
+    def send_privmsgs(self, messages):
+        """Queue a batch of (nick, message) private messages."""
+        self.outbound.put_many(messages)
+        if self.debug_game:
+            for nick, msg in messages:
+                print("privmsg to {}: {}".format(nick, msg))
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,66 @@
+"""Command line entry point of the bot.
+
+    avalon-irc [--metrics-port PORT] [--admin MASK ...] [--trace-file FILE] <server[:port]> <channel>[,<channel>...] <nickname>
+
+Kept apart from bot.py so that printing the usage or rejecting bad
+arguments does not import the IRC client and asyncio, which take most of
+the startup time. The bot module is only imported to actually run.
+"""
+
+import sys
+
+USAGE = "Usage: avalon-irc [--metrics-port PORT] [--admin nick!user@host ...] [--trace-file FILE] <server[:port]> <channel>[,<channel>...] <nickname>"
+
+
+def parse_server(arg):
+    """Return (server, port) for "server[:port]", raise ValueError if the port
+    is not a number."""
+    s = arg.split(":", 1)
+    if len(s) == 2:
+        return s[0], int(s[1])
+    return s[0], 6667
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+
+    if len(argv) == 1 and argv[0] in ("-h", "--help"):
+        print(USAGE)
+        return
+    metrics_port = None
+    admins = []
+    trace_filename = None
+    while len(argv) >= 2 and argv[0] in ("--metrics-port", "--admin", "--trace-file"):
+        if argv[0] == "--admin":
+            admins.append(argv[1])
+        elif argv[0] == "--trace-file":
+            trace_filename = argv[1]
+        else:
+            try:
+                metrics_port = int(argv[1])
+            except ValueError:
+                print("Error: Erroneous metrics port.")
+                sys.exit(1)
+        argv = argv[2:]
+    if len(argv) != 3:
+        print(USAGE)
+        sys.exit(1)
+
+    try:
+        server, port = parse_server(argv[0])
+    except ValueError:
+        print("Error: Erroneous port.")
+        sys.exit(1)
+    channels = argv[1].split(",")
+    nickname = argv[2]
+
+    from .bot import AvalonBot
+
+    bot = AvalonBot(channels, nickname, server, port, metrics_port=metrics_port, admins=admins,
+        trace_filename=trace_filename)
+    bot.run()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,27 @@
 
 import collections
-import copy
+import itertools
 import random
 
-from .roles import *
+from .roles import (RoleMinionOfMordred, RoleAssassin, RoleLoyalServantOfArthur, RoleMerlin,
+    RolePercival, RoleMordred, RoleOberon, RoleMorgana)
+
 Quest = collections.namedtuple('Quest', 'team_size fails_required')
+# role_classes is a tuple of the role classes to be shuffled onto the seats,
+# or None if the game cannot be started. In that case reason tells why.
+RolePlan = collections.namedtuple('RolePlan', 'role_classes reason')
 
 
 class AvalonGame:
 
+    __slots__ = (
+        "phase", "rng", "quest_results", "players", "seats", "roles", "bot",
+        "teamsel_player_idx", "team", "team_mask", "failed_votes", "voted_mask",
+        "players_voted_accept", "players_voted_reject", "game_args", "winner",
+        "assassin_seat", "merlin_seat", "log", "knowledge", "role_msgs",
+        "timeouts", "deadline", "role_classes", "proposals", "kill_seat",
+    )
+
     # Map player count to lists of five quests
     game_plans = {
         5:  [Quest(2, 1), Quest(3, 1), Quest(2, 1), Quest(3, 1), Quest(3, 1)],
@@ -30,12 +43,36 @@ class AvalonGame:
     
     valid_game_args = ["percival", "mordred", "oberon", "morgana"]
 
+    # (player count, frozenset of game arguments) -> RolePlan, see plan_roles()
+    role_plans = {}
+    # player count -> list of valid game argument combinations, see start_options()
+    start_option_lists = {}
+    # Status lines that only depend on the configuration of a game are built
+    # once and shared by all games, see roles_str() and quest_overview_str().
+    # role plan -> roles in play line
+    roles_strs = {}
+    # (player count, tuple of quest results) -> quest overview line
+    quest_overview_strs = {}
+
+    # Longest highscore that can be requested with !highscore N
+    highscore_max_count = 50
+
     Assemble, TeamSel, TeamVote, QuestVote, Assassination, Finished = range(6)
+    phase_names = ["assemble", "teamsel", "teamvote", "questvote", "assassination", "finished"]
     Good, Evil = range(2)
 
+    # Seconds until handle_deadline() resolves a phase, for bots that set
+    # game.timeouts. A reminder is sent reminder_before seconds earlier.
+    default_phase_timeouts = {
+        TeamSel: 300,
+        TeamVote: 180,
+        QuestVote: 180,
+        Assassination: 300,
+    }
+    reminder_before = 60
+
     def get_role(self, nick):
-        player_idx = self.players.index(nick)
-        return self.roles[player_idx]
+        return self.roles[self.seats[nick]]
 
     @property
     def game_plan(self):
@@ -45,23 +82,102 @@ class AvalonGame:
     def current_quest(self):
         return len(self.quest_results)
 
-    def __init__(self, bot):
+    def __init__(self, bot, rng=None):
+        """rng is the random.Random instance used for role assignment and the
+        choice of the first leader. Defaults to the random module."""
         self.phase = AvalonGame.Assemble
+        self.rng = random if rng is None else rng
 
         #self.quest_results=[True, True, False, False]
         self.quest_results=[]
         self.players = []
         #self.players=["a", "b", "c",  "d", "Morn"]
         self.players.sort()
+        self.seats = {} # nick -> index in self.players and self.roles
         self.roles=[]
+        self.role_classes = () # unshuffled role classes of the role plan
+        self.assassin_seat = None
+        self.merlin_seat = None
         self.bot = bot
         self.teamsel_player_idx = None
         self.team = []
+        self.team_mask = 0 # bit i set if self.players[i] is in self.team
         self.failed_votes = 0 # used for quest only
-        self.players_voted = [] # used for both team vote and quest itself
+        self.voted_mask = 0 # bit i set if self.players[i] has voted, used for both team vote and quest itself
         self.players_voted_accept = [] # used for team vote only
         self.players_voted_reject = [] # used for team vote only
+        self.proposals = [] # [leader seat, team mask, accept vote mask, fail votes or None if no quest] per team
+        self.kill_seat = None # seat the Assassin killed
         self.game_args = []
+        self.knowledge = [] # seat -> (mask of seats seen as evil, mask of seats seen as Merlin)
+        self.role_msgs = [] # seat -> role message, sent at start and on !identify
+        self.timeouts = None # phase -> seconds, see set_deadline()
+        self.deadline = None # timer returned by bot.schedule()
+        self.log = None # list-like, receives the events of this game if set
+
+    def log_event(self, *event):
+        """Record a state change. Calling the handlers with the logged events
+        in order rebuilds the game, see gamelog.replay()."""
+        if self.log is not None:
+            self.log.append(event)
+
+    def set_deadline(self):
+        """Cancel the deadline of the previous phase and start the one of the
+        current phase. Timers come from self.bot.schedule(delay, callback),
+        which returns an object with a cancel() method."""
+        if self.deadline is not None:
+            self.deadline.cancel()
+            self.deadline = None
+        timeout = self.timeouts.get(self.phase) if self.timeouts else None
+        if not timeout:
+            return
+        if timeout > self.reminder_before > 0:
+            self.deadline = self.bot.schedule(timeout - self.reminder_before, self.handle_reminder)
+        else:
+            self.deadline = self.bot.schedule(timeout, self.handle_deadline)
+
+    def handle_reminder(self):
+        seconds = self.reminder_before
+        if self.phase == AvalonGame.TeamSel:
+            self.bot.send_pubmsg("{}: Please choose a team with !team. The next player selects the team in {} seconds.".format(
+                self.get_teamsel_player(), seconds))
+        elif self.phase == AvalonGame.TeamVote:
+            self.bot.send_pubmsg("Waiting for team votes from {}. Missing votes count as reject in {} seconds.".format(
+                ", ".join(self.players_without_vote(self.players)), seconds))
+        elif self.phase == AvalonGame.QuestVote:
+            self.bot.send_pubmsg("Waiting for quest votes from {}. Missing votes count as success in {} seconds.".format(
+                ", ".join(self.players_without_vote(self.team)), seconds))
+        elif self.phase == AvalonGame.Assassination:
+            self.bot.send_pubmsg("The Assassin has {} seconds left to !kill Merlin.".format(seconds))
+        self.deadline = self.bot.schedule(seconds, self.handle_deadline)
+
+    def handle_deadline(self):
+        """Resolve the current phase for idle players: the leader is skipped
+        (counting as a failed vote), missing team votes count as reject,
+        missing quest votes as success, and Good wins if the Assassin does
+        not kill."""
+        self.deadline = None
+        self.log_event("x")
+        if self.phase == AvalonGame.TeamSel:
+            self.bot.send_pubmsg("{} did not choose a team in time.".format(self.get_teamsel_player()))
+            self.enter_teamsel(after_failed_vote=True)
+        elif self.phase == AvalonGame.TeamVote:
+            missing_players = self.players_without_vote(self.players)
+            self.bot.send_pubmsg("Missing votes from {} count as reject.".format(", ".join(missing_players)))
+            self.players_voted_reject.extend(missing_players)
+            self.voted_mask = (1 << len(self.players)) - 1
+            self.finish_team_vote()
+        elif self.phase == AvalonGame.QuestVote:
+            self.bot.send_pubmsg("Missing quest votes from {} count as success.".format(
+                ", ".join(self.players_without_vote(self.team))))
+            self.voted_mask = self.team_mask
+            self.finish_quest_vote()
+        elif self.phase == AvalonGame.Assassination:
+            self.bot.send_pubmsg("The Assassin did not choose in time.")
+            self.end_game(winner=AvalonGame.Good)
+
+    def players_without_vote(self, players):
+        return [p for p in players if not self.voted_mask & (1 << self.seats[p])]
 
     def handle_privmsg(self, nick, msg):
         #print("privmsg from {}: {}".format(nick, msg))
@@ -91,7 +207,13 @@ class AvalonGame:
             if cmd=="info":
                 self.handle_info()
             elif cmd=="highscore":
-                self.handle_highscore()
+                self.handle_highscore(nick, arg)
+            elif cmd=="rank":
+                self.handle_rank(nick, arg)
+            elif cmd=="rating":
+                self.handle_rating(nick, arg)
+            elif cmd=="stats":
+                self.handle_stats(nick, arg)
             elif cmd=="join":
                 self.handle_join(nick)
             elif cmd=="leave":
@@ -112,10 +234,12 @@ class AvalonGame:
             self.bot.send_pubmsg("{}: You are not the Assassin.".format(nick))
             return
 
-        if not (arg in self.players):
+        if not (arg in self.seats):
             self.bot.send_pubmsg("{}: Invalid player.".format(nick))
             return
 
+        self.log_event("k", nick, arg)
+        self.kill_seat = self.seats[arg]
         if arg == self.get_merlin():
             self.bot.send_pubmsg("The Assassin has killed Merlin!")
             self.end_game(winner=AvalonGame.Evil)
@@ -129,11 +253,13 @@ class AvalonGame:
             self.bot.send_pubmsg("{}: Command not available.".format(nick))
             return
 
-        if nick in self.players:
+        if nick in self.seats:
             self.bot.send_pubmsg("{}: You are already registered.".format(nick))
         else:
             self.players.append(nick)
             self.players.sort() # This way the same player names will always play in the same order.
+            self.update_seats()
+            self.log_event("j", nick)
             self.bot.send_pubmsg("Players registered: {}".format(self.players_str()))
 
     def handle_leave(self, nick):
@@ -141,41 +267,45 @@ class AvalonGame:
             self.bot.send_pubmsg("{}: Command not available.".format(nick))
             return
 
-        if nick in self.players:
+        if nick in self.seats:
             self.players.remove(nick)
+            self.update_seats()
+            self.log_event("l", nick)
             self.bot.send_pubmsg("Players registered: {}".format(self.players_str()))
         else:
             self.bot.send_pubmsg("{}: You are not registered.".format(nick))
 
 
-    def assign_roles(self, optional_good_roles=[], optional_evil_roles=[]):
-        """Assigns roles to players by assigning self.roles list.
-        If role assignment is successful, return True, else return False.
-        """
-        
-        evil_player_count = self.game_plans_evil_count[len(self.players)]
-        good_player_count = len(self.players) - evil_player_count
+    def update_seats(self):
+        self.seats = {player: idx for idx, player in enumerate(self.players)}
+
+    @classmethod
+    def get_role_classes(cls, player_count, game_args, optional_good_roles=[], optional_evil_roles=[]):
+        """Return the list of role classes for a game, good roles first, or
+        None if too many optional roles are enabled for player_count."""
+        evil_player_count = cls.game_plans_evil_count[player_count]
+        good_player_count = player_count - evil_player_count
 
         evil_roles = [RoleAssassin] + optional_evil_roles
-        if "mordred" in self.game_args:
+        if "mordred" in game_args:
             evil_roles.append(RoleMordred)
-        if "oberon" in self.game_args:
+        if "oberon" in game_args:
             evil_roles.append(RoleOberon)
-        if "morgana" in self.game_args:
+        if "morgana" in game_args:
             evil_roles.append(RoleMorgana)
 
         good_roles = [RoleMerlin] + optional_good_roles
-        if "percival" in self.game_args:
+        if "percival" in game_args:
             good_roles.append(RolePercival)
 
         # TODO: Append optional roles to evil_roles and good_roles dictionary.
 
         if len(evil_roles) > evil_player_count:
             # Game cannot be started because too many optional evil roles are enabled
-            return False
+            return None
         if len(good_roles) > good_player_count:
             # Game cannot be started because too many optional good roles are enabled
-            return False
+            return None
 
         # Fill up remaining slots with RoleMinionOfMordred, RoleLoyalServantOfArthur:
         while len(evil_roles) < evil_player_count:
@@ -183,34 +313,109 @@ class AvalonGame:
         while len(good_roles) < good_player_count:
             good_roles.append(RoleLoyalServantOfArthur)
 
-        # Assign and shuffle self.roles list
-        role_classes = good_roles + evil_roles
+        return good_roles + evil_roles
+
+    @classmethod
+    def plan_roles(cls, player_count, game_args):
+        """Return the RolePlan for player_count players and game_args. Plans
+        are computed once and cached, so invalid configurations are rejected
+        before anything is allocated for the game."""
+        key = (player_count, frozenset(game_args))
+        plan = cls.role_plans.get(key)
+        if plan is None:
+            plan = cls.make_role_plan(player_count, key[1])
+            cls.role_plans[key] = plan
+        return plan
+
+    @classmethod
+    def make_role_plan(cls, player_count, game_args):
+        if player_count < 5:
+            return RolePlan(None, "At least five players are required to start.")
+        if player_count > 10:
+            return RolePlan(None, "At most ten players are required to start.")
+        role_classes = cls.get_role_classes(player_count, game_args)
+        if role_classes is None:
+            evil_player_count = cls.game_plans_evil_count[player_count]
+            return RolePlan(None, "Too many optional roles for {} players, there are {} good and {} evil players.".format(
+                player_count, player_count - evil_player_count, evil_player_count))
+        roles = [role_class("") for role_class in role_classes]
+        for role in roles:
+            if not role.validate_roles(roles):
+                return RolePlan(None, "Invalid combination of roles: {}".format(role.requirements_str))
+        return RolePlan(tuple(role_classes), "")
+
+    @classmethod
+    def start_options(cls, player_count):
+        """Return the combinations of game arguments a game with player_count
+        players can be started with."""
+        options = cls.start_option_lists.get(player_count)
+        if options is None:
+            options = []
+            for n in range(len(cls.valid_game_args) + 1):
+                for game_args in itertools.combinations(cls.valid_game_args, n):
+                    if cls.plan_roles(player_count, game_args).role_classes is not None:
+                        options.append(game_args)
+            cls.start_option_lists[player_count] = options
+        return options
+
+    def assign_roles(self):
+        """Assigns roles to players by assigning self.roles list.
+        If role assignment is successful, return True, else return False.
+        """
 
-        random.shuffle(role_classes)
+        role_classes = self.plan_roles(len(self.players), self.game_args).role_classes
+        if role_classes is None:
+            return False
+        self.role_classes = role_classes
+
+        # Assign and shuffle self.roles list
+        role_classes = list(role_classes)
+        self.rng.shuffle(role_classes)
         roles=[]
         for player_idx, role_class in enumerate(role_classes):
             roles.append(role_class(self.players[player_idx]))
 
-        # Validate roles: Some roles require other roles to be present.
-        roles_valid=True
-        for r in roles:
-            if not r.validate_roles(roles):
-                roles_valid=False
-        if not roles_valid:
-            return False
-
         self.roles = roles
+        for idx, role in enumerate(roles):
+            if role.is_assassin:
+                self.assassin_seat = idx
+            if role.is_merlin:
+                self.merlin_seat = idx
+
+        self.update_knowledge()
 
         # Send info to all players
-        for player in self.players:
-            self.send_rolemsg(player)
+        self.role_msgs = [self.rolemsg_str(seat) for seat in range(len(roles))]
+        self.bot.send_privmsgs(list(zip(self.players, self.role_msgs)))
 
         return True
 
+    def update_knowledge(self):
+        """Compute self.knowledge from the role flags, once per game."""
+        self.knowledge = []
+        for role in self.roles:
+            evil_mask = 0
+            merlin_mask = 0
+            for seat, other in enumerate(self.roles):
+                if other is role:
+                    continue
+                if role.sees_as_evil(other):
+                    evil_mask |= 1 << seat
+                if role.sees_as_merlin(other):
+                    merlin_mask |= 1 << seat
+            self.knowledge.append((evil_mask, merlin_mask))
+
+    def players_in_mask(self, mask):
+        return [player for seat, player in enumerate(self.players) if mask >> seat & 1]
+
+    def rolemsg_str(self, seat):
+        role = self.roles[seat]
+        evil_mask, merlin_mask = self.knowledge[seat]
+        knowledge = role.get_initial_knowledge(self.players_in_mask(evil_mask), self.players_in_mask(merlin_mask))
+        return "You are {} ({}). {}".format(role.long_name_article, role.description, knowledge)
+
     def send_rolemsg(self, player):
-        role = self.get_role(player)
-        msg = "You are {} ({}). {}".format(role.long_name_article, role.description, role.get_initial_knowledge(self))
-        self.bot.send_privmsg(player, msg)
+        self.bot.send_privmsg(player, self.role_msgs[self.seats[player]])
 
     def handle_start(self, nick, arg):
 
@@ -242,23 +447,25 @@ class AvalonGame:
 
         # Evaluate args:
         game_args=arg.lower().strip().split()
+
+        if game_args == ["help"]:
+            self.handle_start_help(nick)
+            return
         
-        for arg in game_args:
-            if not (arg in self.valid_game_args):
+        for game_arg in game_args:
+            if not (game_arg in self.valid_game_args):
                 self.bot.send_pubmsg("{}: Invalid game argument. Valid game arguments are {}".format(nick, ", ".join(self.valid_game_args)))
                 return
 
-        self.game_args = game_args
-
-        if len(self.players)<5:
-            self.bot.send_pubmsg("{}: At least five players are required to start.".format(nick))
-            return
-
-        if len(self.players)>10:
-            self.bot.send_pubmsg("{}: At most ten players are required to start.".format(nick))
+        plan = self.plan_roles(len(self.players), game_args)
+        if plan.role_classes is None:
+            if len(self.players) in self.game_plans:
+                self.bot.send_pubmsg("{}: {} Type !start help to list the options.".format(nick, plan.reason))
+            else:
+                self.bot.send_pubmsg("{}: {}".format(nick, plan.reason))
             return
 
-
+        self.game_args = game_args
 
         if not self.assign_roles():
             self.bot.send_pubmsg("Game could not be started due to error in assigning roles. Please check your options for consistency.")
@@ -270,6 +477,15 @@ class AvalonGame:
         ))
 
         self.enter_teamsel()
+        self.log_event("s", nick, " ".join(self.game_args), [role.short_name for role in self.roles], self.teamsel_player_idx)
+
+    def handle_start_help(self, nick):
+        player_count = len(self.players)
+        if not player_count in self.game_plans:
+            self.bot.send_pubmsg("{}: {}".format(nick, self.plan_roles(player_count, []).reason))
+            return
+        self.bot.send_pubmsg("{}: Options for {} players: {}.".format(nick, player_count,
+            "; ".join(" ".join(game_args) or "none" for game_args in self.start_options(player_count))))
 
     def winner_str(self):
         assert self.phase == AvalonGame.Finished
@@ -299,6 +515,7 @@ class AvalonGame:
             if self.failed_votes >= 5:
                 self.bot.send_pubmsg("Five failed votes: Evil wins.")
                 self.end_game(winner=AvalonGame.Evil)
+                return
             elif self.failed_votes == 4:
                 self.bot.send_pubmsg("Failed votes in this round: {}. When five failed votes are reached, Evil wins!".format(self.failed_votes))
             else:
@@ -308,7 +525,7 @@ class AvalonGame:
 
         # Increment player or choose random first player:
         if self.teamsel_player_idx == None:
-            self.teamsel_player_idx = random.choice(range(len(self.players)))
+            self.teamsel_player_idx = self.rng.choice(range(len(self.players)))
         else:
             self.teamsel_player_idx = (self.teamsel_player_idx + 1) % len(self.players)
 
@@ -316,11 +533,20 @@ class AvalonGame:
 
         self.bot.send_pubmsg("{}".format(self.quest_overview_str()))
         self.bot.send_pubmsg("{} (Type \"!team Player1 Player2 ...\")".format(self.teamsel_str()))
+        self.set_deadline()
 
     def roles_str(self):
+        roles_str = self.roles_strs.get(self.role_classes)
+        if roles_str is None:
+            roles_str = self.make_roles_str(self.role_classes)
+            self.roles_strs[self.role_classes] = roles_str
+        return roles_str
+
+    @classmethod
+    def make_roles_str(cls, role_classes):
         count_evil={}
         count_good={}
-        for role in self.roles:
+        for role in role_classes:
             cur_count=(count_evil if role.evil else count_good)
             if role.long_name in cur_count:
                 cur_count[role.long_name]+=1
@@ -340,7 +566,6 @@ class AvalonGame:
             else:
                 good_roles.append("{}x {}".format(count, role))
 
-        #print(count_evil, count_good)
         return "Good role cards in play: {}. Evil role cards in play: {}.".format(
             ", ".join(good_roles),
             ", ".join(evil_roles)
@@ -364,23 +589,28 @@ class AvalonGame:
             self.bot.send_pubmsg("{}: Team must consist of {} players.".format(nick, team_size))
             return
 
-        player_names_valid=True
+        team_mask = 0
         for player in team:
-            if not (player in self.players):
-                player_names_valid=False
-
-        if not player_names_valid:
-            self.bot.send_pubmsg("{}: Team must consist of valid players.".format(nick))
-            return
+            seat = self.seats.get(player)
+            if seat is None or team_mask & (1 << seat):
+                # Unknown or duplicate player
+                self.bot.send_pubmsg("{}: Team must consist of valid players.".format(nick))
+                return
+            team_mask |= 1 << seat
 
+        self.log_event("t", nick, arg)
         self.team = team
+        self.team_mask = team_mask
+        self.proposals.append([self.teamsel_player_idx, team_mask, 0, None])
         self.phase = AvalonGame.TeamVote
 
-        self.players_voted = []
+        self.voted_mask = 0
         self.players_voted_accept = []
         self.players_voted_reject = []
 
-        self.bot.send_pubmsg("{} Please vote for or against this team with \"/msg Avalon accept\" or h \"/msg Avalon reject\".".format(self.team_str()))
+        self.bot.send_pubmsg("{} Please vote for or against this team with \"/msg {} accept\" or h \"/msg {} reject\".".format(
+            self.team_str(), self.bot.nickname, self.bot.nickname))
+        self.set_deadline()
 
     def team_str(self):
         return "{} has chosen the following team: {}.".format(
@@ -393,39 +623,42 @@ class AvalonGame:
             self.bot.send_privmsg(nick, "Command not available.")
             return
 
-        if not (nick in self.players):
+        seat = self.seats.get(nick)
+        if seat is None:
             self.bot.send_privmsg(nick, "Not eligible for vote.")
             return
 
-        if nick in self.players_voted:
+        if self.voted_mask & (1 << seat):
             self.bot.send_privmsg(nick, "Double vote ignored.")
             return
 
-        self.players_voted.append(nick)
+        self.log_event("v", nick, accept)
+        self.voted_mask |= 1 << seat
         if accept:
             self.players_voted_accept.append(nick)
         else:
             self.players_voted_reject.append(nick)
 
-        missing_players=copy.copy(self.players)
-        for player_voted in self.players_voted:
-            missing_players.remove(player_voted)
-
         self.bot.send_privmsg(nick, "Vote cast.")
-        if len(missing_players) > 0:
+        if self.voted_mask != (1 << len(self.players)) - 1:
+            missing_players = [p for idx, p in enumerate(self.players) if not self.voted_mask & (1 << idx)]
             self.bot.send_pubmsg("{} has voted. Missing votes from {}.".format(nick, ", ".join(missing_players)))
         else:
-            # Vote completed
-            accepted = len(self.players_voted_accept) > len(self.players_voted_reject)
-            
-            if accepted:
-                self.enter_questvote()
-            else:
-                self.bot.send_pubmsg("The proposed team {} has been rejected. {}".format(
-                    ", ".join(self.team),
-                    self.team_vote_result_str()
-                ))   
-                self.enter_teamsel(after_failed_vote=True)
+            self.finish_team_vote()
+
+    def finish_team_vote(self):
+        accepted = len(self.players_voted_accept) > len(self.players_voted_reject)
+        for player in self.players_voted_accept:
+            self.proposals[-1][2] |= 1 << self.seats[player]
+        
+        if accepted:
+            self.enter_questvote()
+        else:
+            self.bot.send_pubmsg("The proposed team {} has been rejected. {}".format(
+                ", ".join(self.team),
+                self.team_vote_result_str()
+            ))   
+            self.enter_teamsel(after_failed_vote=True)
 
     def team_vote_result_str(self):
         return "{} voted to accept the team. {} voted to reject the team.".format(
@@ -434,32 +667,41 @@ class AvalonGame:
         )
 
     def enter_questvote(self):
-        self.bot.send_pubmsg("Team {}: you have been accepted for the quest. {} Please play success or fail for the quest with \"/msg Avalon success\" or h \"/msg Avalon fail\".{}".format(
+        self.bot.send_pubmsg("Team {}: you have been accepted for the quest. {} Please play success or fail for the quest with \"/msg {} success\" or h \"/msg {} fail\".{}".format(
             ", ".join(self.team),
             self.team_vote_result_str(),
+            self.bot.nickname, self.bot.nickname,
             self.get_special_win_condition_or_empty_str()
         ))
-        self.players_voted=[]
+        self.voted_mask=0
         self.failed_votes=0
         self.phase = AvalonGame.QuestVote
+        self.set_deadline()
 
     def quest_overview_str(self):
+        key = (len(self.players), tuple(self.quest_results))
+        overview_str = self.quest_overview_strs.get(key)
+        if overview_str is None:
+            overview_str = self.make_quest_overview_str(*key)
+            self.quest_overview_strs[key] = overview_str
+        return overview_str
+
+    @classmethod
+    def make_quest_overview_str(cls, player_count, quest_results):
         overview_str=""
-        for idx in range(5):
+        for idx, quest in enumerate(cls.game_plans[player_count]):
             if idx>0:
                 overview_str+=" | "
             quest_result="undecided"
-            if self.current_quest > idx:
-                if self.quest_results[idx]:
+            if len(quest_results) > idx:
+                if quest_results[idx]:
                     quest_result="succeeded"
                 else:
                     quest_result="failed"
-            fails_required = self.game_plan[idx].fails_required
-            team_size = self.game_plan[idx].team_size
             overview_str+="Quest {} (team of {}{}): {}".format(
                 idx+1,
-                team_size,
-                ", two fail votes required to fail" if fails_required == 2 else "",
+                quest.team_size,
+                ", two fail votes required to fail" if quest.fails_required == 2 else "",
                 quest_result
             )
         return overview_str
@@ -474,46 +716,49 @@ class AvalonGame:
             self.bot.send_privmsg(nick, "Command not available.")
             return
 
-        if not (nick in self.team):
+        seat = self.seats.get(nick)
+        if seat is None or not self.team_mask & (1 << seat):
             self.bot.send_privmsg(nick, "Not eligible for vote.")
             return
 
-        if nick in self.players_voted:
+        if self.voted_mask & (1 << seat):
             self.bot.send_privmsg(nick, "Double vote ignored.")
             return
 
-        if (not self.get_role(nick).evil) and fail:
+        if (not self.roles[seat].evil) and fail:
             self.bot.send_privmsg(nick, "You are not allowed to vote fail.")
             return
 
-        self.players_voted.append(nick)
+        self.log_event("q", nick, fail)
+        self.voted_mask |= 1 << seat
         if fail:
             self.failed_votes += 1
 
-        missing_players=copy.copy(self.team)
-        for player_voted in self.players_voted:
-            missing_players.remove(player_voted)
-
         self.bot.send_privmsg(nick, "Vote cast.")
-        if len(missing_players) > 0:
+        if self.voted_mask != self.team_mask:
+            missing_players = [p for p in self.team if not self.voted_mask & (1 << self.seats[p])]
             self.bot.send_pubmsg("{} has voted. Missing votes from {}.".format(nick, ", ".join(missing_players)))
         else:
-            # Vote completed
-            success = self.failed_votes < self.get_fails_required()
+            self.finish_quest_vote()
 
-            self.quest_results.append(success)
+    def finish_quest_vote(self):
+        success = self.failed_votes < self.get_fails_required()
+        self.proposals[-1][3] = self.failed_votes
 
-            self.bot.send_pubmsg("Quest {}. Number of success votes was {}, number of fail votes was {}.".format(
-                "succeeded" if success else "failed",
-                len(self.team) - self.failed_votes,
-                self.failed_votes
-            ))
+        self.quest_results.append(success)
+
+        self.bot.send_pubmsg("Quest {}. Number of success votes was {}, number of fail votes was {}.".format(
+            "succeeded" if success else "failed",
+            len(self.team) - self.failed_votes,
+            self.failed_votes
+        ))
 
-            self.enter_next_quest_or_finish()
+        self.enter_next_quest_or_finish()
 
     def end_game(self, winner):
         self.phase = AvalonGame.Finished
         self.winner = winner
+        self.set_deadline()
 
         self.bot.send_pubmsg("{}".format(self.quest_overview_str()))
         self.bot.send_pubmsg("{}".format(self.winner_str()))
@@ -523,38 +768,47 @@ class AvalonGame:
 
         self.bot.send_pubmsg("Highscore: {}".format(self.bot.highscore.get_highscore_str()))
 
-    def handle_highscore(self):
-        self.bot.send_pubmsg("Highscore: {}".format(self.bot.highscore.get_highscore_str()))
+    def handle_highscore(self, nick, arg=""):
+        count = None
+        if arg:
+            if not arg.isdigit() or int(arg) < 1:
+                self.bot.send_pubmsg("{}: Usage: !highscore [number of players]".format(nick))
+                return
+            count = min(int(arg), self.highscore_max_count)
+        self.bot.send_pubmsg("Highscore: {}".format(self.bot.highscore.get_highscore_str(count)))
+
+    def handle_rank(self, nick, arg):
+        player = arg.split(" ")[0] if arg else nick
+        self.bot.send_pubmsg(self.bot.highscore.get_rank_str(player))
+
+    def handle_rating(self, nick, arg):
+        player = arg.split(" ")[0] if arg else nick
+        self.bot.send_pubmsg(self.bot.highscore.get_rating_str(player))
+
+    def handle_stats(self, nick, arg):
+        player = arg.split(" ")[0] if arg else nick
+        self.bot.send_pubmsg(self.bot.history.get_stats_str(player))
 
     def get_assassin(self):
-        for idx in range(len(self.players)):
-            player = self.players[idx]
-            role = self.roles[idx]
-            if role.is_assassin:
-                return player
-        return None
+        return None if self.assassin_seat is None else self.players[self.assassin_seat]
 
     def get_merlin(self):
-        for idx in range(len(self.players)):
-            player = self.players[idx]
-            role = self.roles[idx]
-            if role.is_merlin:
-                return player
-        return None        
+        return None if self.merlin_seat is None else self.players[self.merlin_seat]
 
     def enter_assassination_phase_or_end_game(self):
         assassin = self.get_assassin()
         if assassin:
             self.phase = AvalonGame.Assassination
             self.bot.send_pubmsg("Good has almost won, but the Assassin can turn still turn the game around by identifying and assassinating Merlin by typing \"!kill Player1\".")
+            self.set_deadline()
             # Name of Assassin must not be releaved at this stage.
 
         else:
             self.end_game(winner=AvalonGame.Good)
 
     def enter_next_quest_or_finish(self):
-        total_fails     = len(list(filter(lambda x: not x, self.quest_results)))
-        total_successes = len(list(filter(lambda x:     x, self.quest_results)))
+        total_fails     = self.quest_results.count(False)
+        total_successes = self.quest_results.count(True)
 
 
         if total_fails >= 3:
@@ -568,7 +822,7 @@ class AvalonGame:
         self.enter_teamsel()
 
     def handle_identify(self, nick):
-        if nick in self.players:
+        if nick in self.seats:
             self.send_rolemsg(nick)
 
     def players_str(self):
@@ -0,0 +1,168 @@
+"""Event logs of running games, used to recover them after a restart.
+
+Every AvalonGame with a log appends its state changes as small tuples, see
+AvalonGame.log_event(). GameLogStore keeps one file per channel with one
+JSON array per line and deletes it when the game is over. replay() feeds
+the events of a file back through the handlers of a new AvalonGame.
+"""
+
+import json
+import os
+import random
+import threading
+import urllib.parse
+
+from .game import AvalonGame
+from .roles import roles_by_short_name
+from .simulator import SimulationBot
+
+
+# When GameLog writes events to disk:
+SYNC_ALWAYS = "always" # write and fsync every event
+SYNC_BATCH = "batch" # write and fsync all pending events on flush()
+SYNC_NONE = "none" # write all pending events on flush(), leave fsync to the OS
+sync_modes = [SYNC_ALWAYS, SYNC_BATCH, SYNC_NONE]
+
+
+class RecordedRng:
+    """Stands in for the rng of a game being replayed. Reproduces the role
+    order and first leader recorded in the start event."""
+
+    def __init__(self, role_names, leader_idx):
+        self.role_names = role_names
+        self.leader_idx = leader_idx
+
+    def shuffle(self, role_classes):
+        role_classes[:] = [roles_by_short_name[name] for name in self.role_names]
+
+    def choice(self, seq):
+        return seq[self.leader_idx]
+
+
+def replay(events, rng=None):
+    """Return a new AvalonGame with the events applied. No messages are sent
+    and the highscore is not touched. Set game.bot before using the game."""
+    game = AvalonGame(SimulationBot(), rng=rng)
+    handle_join = game.handle_join
+    for event in events:
+        kind = event[0]
+        if kind == "j":
+            handle_join(event[1])
+        elif kind == "v":
+            game.handle_accept_reject(event[1], event[2])
+        elif kind == "q":
+            game.handle_success_fail(event[1], event[2])
+        elif kind == "t":
+            game.handle_team(event[1], event[2])
+        elif kind == "s":
+            game.rng = RecordedRng(event[3], event[4])
+            game.handle_start(event[1], event[2])
+            game.rng = random if rng is None else rng
+        elif kind == "l":
+            game.handle_leave(event[1])
+        elif kind == "k":
+            game.handle_kill(event[1], event[2])
+        elif kind == "x":
+            game.handle_deadline()
+    return game
+
+
+class GameLog:
+    """Event log of one game. Events are collected by append() and written
+    by flush(), which may run on another thread."""
+
+    def __init__(self, filename, sync=SYNC_BATCH):
+        self.filename = filename
+        self.sync = sync
+        self.pending = []
+        self.file = None
+        self.lock = threading.Lock()
+
+    def append(self, event):
+        with self.lock:
+            self.pending.append(event)
+        if self.sync == SYNC_ALWAYS:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, []
+            if not pending or self.file is False:
+                return
+            if self.file is None:
+                self.file = open(self.filename, "a")
+            self.file.write("".join(json.dumps(event, separators=(",", ":")) + "\n" for event in pending))
+            self.file.flush()
+            if self.sync != SYNC_NONE:
+                os.fsync(self.file.fileno())
+
+    def discard(self):
+        """Delete the log, the game is over."""
+        with self.lock:
+            self.pending = []
+            if self.file:
+                self.file.close()
+            self.file = False
+            try:
+                os.remove(self.filename)
+            except FileNotFoundError:
+                pass
+
+
+class GameLogStore:
+    """Directory of game logs, one per channel."""
+
+    def __init__(self, directory, sync=SYNC_BATCH):
+        if not sync in sync_modes:
+            raise ValueError("Invalid sync mode {}, valid modes are {}.".format(sync, ", ".join(sync_modes)))
+        self.directory = directory
+        self.sync = sync
+        self.logs = {} # channel -> GameLog
+        os.makedirs(directory, exist_ok=True)
+
+    def filename(self, channel):
+        return os.path.join(self.directory, urllib.parse.quote(channel.lower(), safe="") + ".log")
+
+    def load(self, channel):
+        """Return the events logged for the game in channel."""
+        events = []
+        try:
+            with open(self.filename(channel), "r") as f:
+                for line in f:
+                    if not line.endswith("\n"):
+                        break # Partial line from a crash
+                    events.append(json.loads(line))
+        except FileNotFoundError:
+            pass
+        return events
+
+    def open(self, channel):
+        """Return the log for the current game in channel, appending to the file
+        if it exists."""
+        log = GameLog(self.filename(channel), self.sync)
+        self.logs[channel.lower()] = log
+        return log
+
+    def recover(self, channel):
+        """Return the game in channel rebuilt from its log, or None if there is
+        no unfinished game."""
+        events = self.load(channel)
+        if not events:
+            return None
+        game = replay(events)
+        if game.phase == AvalonGame.Finished:
+            self.open(channel).discard()
+            return None
+        # Drop a partial last line, new events are appended.
+        with open(self.filename(channel), "w") as f:
+            f.write("".join(json.dumps(event, separators=(",", ":")) + "\n" for event in events))
+        return game
+
+    def discard(self, channel):
+        log = self.logs.pop(channel.lower(), None)
+        if log:
+            log.discard()
+
+    def flush(self):
+        for log in list(self.logs.values()):
+            log.flush()
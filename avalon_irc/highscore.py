@@ -1,44 +1,638 @@
+import fcntl
 import json
+import os
+import sqlite3
+import threading
+import time
+import traceback
 
-class Highscore:
-    def __init__(self, json_filename):
+from .rating import EloRating
+
+
+def apply_result(data, winners, losers):
+    for winner in winners:
+        data.setdefault(winner, {"won":0, "lost":0})["won"]+=1
+    for loser in losers:
+        data.setdefault(loser, {"won":0, "lost":0})["lost"]+=1
+
+
+def add_deltas(deltas, winners, losers):
+    """Count a result in deltas, {player: [won, lost]}."""
+    for winner in winners:
+        deltas.setdefault(winner, [0, 0])[0] += 1
+    for loser in losers:
+        deltas.setdefault(loser, [0, 0])[1] += 1
+
+
+class JsonHighscoreStore:
+    """Keeps the highscore in one JSON file, which is rewritten on every commit
+    to a temporary file that replaces it. Ratings are kept in the player
+    entries, the game history is not kept.
+
+    Several processes can share the file. A commit holds an exclusive flock
+    on <file>.lock, reads the file again if another process has replaced
+    it and adds its results to what it read. The changes found that way are
+    passed to the Highscore by refresh(), which reads the file again only
+    when it was replaced."""
+
+    def __init__(self, json_filename, rating):
         self.json_filename=json_filename
-        self.load()
+        self.rating=rating
+        self.lock = threading.Lock()
+        self.lock_fd = os.open(json_filename + ".lock", os.O_RDWR | os.O_CREAT, 0o644)
+        self.data = {}
+        self.signature = None # (inode, mtime, size) of the file self.data was read from or written to
+        self.unseen = {} # player -> [won, lost] committed by other processes, not returned by refresh() yet
+        self.unseen_ratings = {}
 
-    def load(self):
+    def file_signature(self):
+        try:
+            st = os.stat(self.json_filename)
+        except FileNotFoundError:
+            return None
+        return st.st_ino, st.st_mtime_ns, st.st_size
+
+    def read(self):
+        """Read the file again if it was replaced, and note the changes made
+        by other processes."""
+        signature = self.file_signature()
+        if signature == self.signature:
+            return
         try:
             with open(self.json_filename, "r") as f:
-                self.data = json.load(f)
+                data = json.load(f)
         except FileNotFoundError:
-            self.data={}
-            self.save()
+            data = {}
+        for player, d in data.items():
+            old = self.data.get(player, {"won":0, "lost":0})
+            if d["won"] != old["won"] or d["lost"] != old["lost"]:
+                delta = self.unseen.setdefault(player, [0, 0])
+                delta[0] += d["won"] - old["won"]
+                delta[1] += d["lost"] - old["lost"]
+            if "rating" in d and d["rating"] != old.get("rating"):
+                self.unseen_ratings[player] = d["rating"]
+        self.data = data
+        self.signature = signature
+
+    def load(self):
+        with self.lock:
+            self.read()
+            self.unseen, self.unseen_ratings = {}, {}
+            return {player: {"won":d["won"], "lost":d["lost"]} for player, d in self.data.items()}
+
+    def load_ratings(self):
+        return {player: d["rating"] for player, d in self.data.items() if "rating" in d}
+
+    def refresh(self):
+        """Return (changes {player: [won, lost]}, {player: rating}) made by
+        other processes since the last refresh(). The ratings are those of
+        all players in results committed since then, by any process."""
+        with self.lock:
+            self.read()
+            changes, ratings = self.unseen, self.unseen_ratings
+            self.unseen, self.unseen_ratings = {}, {}
+            return changes, ratings
+
+    def commit(self, results):
+        with self.lock:
+            fcntl.flock(self.lock_fd, fcntl.LOCK_EX)
+            try:
+                self.read()
+                # Applied to a copy, so that a failed write leaves self.data
+                # as it is on disk and a retry does not count results twice.
+                data = {player: dict(d) for player, d in self.data.items()}
+                ratings = self.load_ratings()
+                new_ratings = {}
+                for winners, losers in results:
+                    apply_result(data, winners, losers)
+                    for player, rating in self.rating.update(ratings, winners, losers).items():
+                        data[player]["rating"] = rating
+                        new_ratings[player] = rating
+                tmp_filename = self.json_filename + ".tmp"
+                with open(tmp_filename, "w") as f:
+                    json.dump(data, f, indent=4)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_filename, self.json_filename)
+                self.data = data
+                self.unseen_ratings.update(new_ratings)
+                self.signature = self.file_signature()
+            finally:
+                fcntl.flock(self.lock_fd, fcntl.LOCK_UN)
+
+    def close(self):
+        os.close(self.lock_fd)
+
+
+class SqliteHighscoreStore:
+    """Keeps the highscore in an SQLite database in WAL mode. Every commit is
+    one small transaction that only touches the rows of the players involved.
+    Ratings are updated from the ratings in the database within the same
+    transaction, and every result is appended to the results table, the game
+    history rerate.py recomputes the ratings from.
+
+    Processes sharing the database find the results committed by the others
+    in the results table, after the last id they have seen. refresh()
+    returns their changes and reads the ratings of their players by primary
+    key, without reading the whole highscore again.
+
+    If the database is new and a JSON highscore with the same base name exists
+    (highscore.json for highscore.db), it is imported and renamed to
+    highscore.json.migrated."""
+
+    def __init__(self, db_filename, rating):
+        self.db_filename=db_filename
+        self.rating=rating
+        self.lock = threading.Lock()
+        self.last_result_id = 0 # results up to this id are in the data returned by load() or refresh()
+        self.own_result_ids = set() # committed by this process after last_result_id
+        # commit() is called from executor threads.
+        self.db = sqlite3.connect(db_filename, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=FULL")
+        with self.db:
+            self.db.execute("""CREATE TABLE IF NOT EXISTS highscore (
+                player TEXT PRIMARY KEY,
+                won INTEGER NOT NULL DEFAULT 0,
+                lost INTEGER NOT NULL DEFAULT 0
+            )""")
+            self.db.execute("""CREATE TABLE IF NOT EXISTS ratings (
+                player TEXT PRIMARY KEY,
+                rating REAL NOT NULL
+            )""")
+            # Nicks are separated by spaces, which IRC nicks cannot contain.
+            self.db.execute("""CREATE TABLE IF NOT EXISTS results (
+                id INTEGER PRIMARY KEY,
+                winners TEXT NOT NULL,
+                losers TEXT NOT NULL
+            )""")
+        self.migrate_json(os.path.splitext(db_filename)[0] + ".json")
+
+    def migrate_json(self, json_filename):
+        if self.db.execute("SELECT 1 FROM highscore LIMIT 1").fetchone() or not os.path.exists(json_filename):
+            return
+        with open(json_filename, "r") as f:
+            data = json.load(f)
+        with self.db:
+            self.db.executemany("INSERT INTO highscore (player, won, lost) VALUES (?, ?, ?)",
+                [(player, d["won"], d["lost"]) for player, d in data.items()])
+            self.db.executemany("INSERT INTO ratings (player, rating) VALUES (?, ?)",
+                [(player, d["rating"]) for player, d in data.items() if "rating" in d])
+        os.replace(json_filename, json_filename + ".migrated")
+
+    def load(self):
+        data = {}
+        with self.lock:
+            # One read transaction, so that last_result_id matches the highscore.
+            self.db.execute("BEGIN")
+            try:
+                self.last_result_id = self.db.execute("SELECT COALESCE(MAX(id), 0) FROM results").fetchone()[0]
+                self.own_result_ids.clear()
+                for player, won, lost in self.db.execute("SELECT player, won, lost FROM highscore"):
+                    data[player] = {"won":won, "lost":lost}
+            finally:
+                self.db.execute("COMMIT")
+        return data
+
+    def refresh(self):
+        """Return (changes {player: [won, lost]}, {player: rating}) made by
+        other processes since the last refresh(). The ratings are those of
+        all players in results committed since then, by any process."""
+        changes = {}
+        with self.lock:
+            rows = self.db.execute("SELECT id, winners, losers FROM results WHERE id > ? ORDER BY id",
+                (self.last_result_id,)).fetchall()
+            if not rows:
+                return changes, {}
+            players = set()
+            for result_id, winners, losers in rows:
+                winners, losers = winners.split(), losers.split()
+                players.update(winners)
+                players.update(losers)
+                if result_id in self.own_result_ids:
+                    self.own_result_ids.discard(result_id)
+                else:
+                    add_deltas(changes, winners, losers)
+            self.last_result_id = rows[-1][0]
+            players = list(players)
+            ratings = {}
+            for i in range(0, len(players), 500):
+                chunk = players[i:i+500]
+                ratings.update(self.db.execute("SELECT player, rating FROM ratings WHERE player IN ({})".format(
+                    ", ".join("?" * len(chunk))), chunk))
+        return changes, ratings
+
+    def load_ratings(self):
+        with self.lock:
+            return dict(self.db.execute("SELECT player, rating FROM ratings"))
+
+    def commit(self, results):
+        rows = []
+        for winners, losers in results:
+            rows.extend((winner, 1, 0) for winner in winners)
+            rows.extend((loser, 0, 1) for loser in losers)
+        result_ids = []
+        with self.lock:
+            with self.db:
+                self.db.executemany("""INSERT INTO highscore (player, won, lost) VALUES (?, ?, ?)
+                    ON CONFLICT (player) DO UPDATE SET won=won+excluded.won, lost=lost+excluded.lost""", rows)
+                for winners, losers in results:
+                    cursor = self.db.execute("INSERT INTO results (winners, losers) VALUES (?, ?)",
+                        (" ".join(winners), " ".join(losers)))
+                    result_ids.append(cursor.lastrowid)
+                for winners, losers in results:
+                    players = list(winners) + list(losers)
+                    ratings = dict(self.db.execute("SELECT player, rating FROM ratings WHERE player IN ({})".format(
+                        ", ".join("?" * len(players))), players))
+                    self.db.executemany("INSERT OR REPLACE INTO ratings (player, rating) VALUES (?, ?)",
+                        self.rating.update(ratings, winners, losers).items())
+            # Only once committed: the ids of a rolled back transaction are given out again.
+            self.own_result_ids.update(result_ids)
+
+    def close(self):
+        self.db.close()
+
+
+class RankingIndex:
+    """Players ordered by games won, updated incrementally.
+
+    A Fenwick tree counts the players per number of games won, so the rank
+    of a player and the next lower score are found in O(log w), w being
+    the highest number of games won. Players with equal scores are kept
+    in the order they reached that score."""
+
+    def __init__(self):
+        self.size = 64
+        self.tree = [0]*(self.size+1)
+        self.buckets = {} # games won -> dict of players (used as ordered set)
+        self.won = {} # player -> games won
+
+    def __len__(self):
+        return len(self.won)
+
+    def add_count(self, won, delta):
+        i = won + 1
+        while i <= self.size:
+            self.tree[i] += delta
+            i += i & -i
+
+    def count_le(self, won):
+        """Return the number of players who have won at most won games."""
+        i = min(won + 1, self.size)
+        count = 0
+        while i > 0:
+            count += self.tree[i]
+            i -= i & -i
+        return count
+
+    def find_kth(self, k):
+        """Return the score of the k-th lowest ranked player (1-based)."""
+        pos = 0
+        step = self.size
+        while step > 0:
+            if pos + step <= self.size and self.tree[pos + step] < k:
+                pos += step
+                k -= self.tree[pos]
+            step //= 2
+        return pos
+
+    def grow(self, won):
+        counts = [0]*(self.size)
+        for score, bucket in self.buckets.items():
+            counts[score] = len(bucket)
+        while self.size <= won:
+            self.size *= 2
+        self.tree = [0]*(self.size+1)
+        for score, count in enumerate(counts):
+            if count:
+                self.add_count(score, count)
+
+    def set_won(self, player, won):
+        old = self.won.get(player)
+        if old == won:
+            return
+        if old is not None:
+            del self.buckets[old][player]
+            if not self.buckets[old]:
+                del self.buckets[old]
+            self.add_count(old, -1)
+        if won >= self.size:
+            self.grow(won)
+        self.won[player] = won
+        self.buckets.setdefault(won, {})[player] = None
+        self.add_count(won, 1)
+
+    def rank(self, player):
+        """Return 1 + the number of players with more games won."""
+        return 1 + len(self.won) - self.count_le(self.won[player])
+
+    def top(self, count):
+        """Return up to count players with the most games won, best first."""
+        players = []
+        remaining = len(self.won)
+        while remaining > 0 and len(players) < count:
+            won = self.find_kth(remaining)
+            for player in self.buckets[won]:
+                players.append(player)
+                if len(players) >= count:
+                    break
+            remaining -= len(self.buckets[won])
+        return players
+
+
+class HighscoreWriter:
+    """Commits results to a store on a background thread (write-behind).
+
+    put() only queues a result. The thread waits delay seconds after the
+    first result of a burst and then commits all queued results at once,
+    so a busy evening of many games costs one JSON file write or SQLite
+    transaction per burst. A failed commit is retried after retry_delay
+    seconds. close() commits what is left, but waits at most close_timeout
+    seconds for it.
+
+    The thread also fetches the results committed by other processes, after
+    every commit and every refresh_interval seconds, so that reading them
+    never waits for a commit. take_changes() returns them."""
+
+    retry_delay = 5.0
+    refresh_interval = 1.0
+    close_timeout = 10.0
+
+    def __init__(self, store, delay=0.5, clock=time.monotonic):
+        self.store = store
+        self.delay = delay
+        self.clock = clock
+        self.condition = threading.Condition()
+        self.pending = [] # results not taken by a commit yet
+        self.pending_since = None # clock() when the oldest pending result was queued
+        self.oldest = None # clock() when the oldest result not committed yet was queued
+        self.committing = 0 # results taken by the commit in progress
+        self.flush_waiters = 0
+        self.closed = False
+        self.on_commit = None # called on the writer thread with (results, commit seconds, lag seconds)
+        self.changes = {} # player -> [won, lost] committed by other processes, not taken yet
+        self.changed_ratings = {}
+        self.thread = threading.Thread(target=self.run, name="highscore-writer", daemon=True)
+        self.thread.start()
+
+    def put(self, result):
+        with self.condition:
+            now = self.clock()
+            if self.pending_since is None:
+                self.pending_since = now
+            if self.oldest is None:
+                self.oldest = now
+            self.pending.append(result)
+            self.condition.notify_all()
+
+    def lag(self):
+        """Return the seconds the oldest result that is not committed yet has
+        waited, the durability lag, or 0 if everything is committed."""
+        with self.condition:
+            return 0.0 if self.oldest is None else self.clock() - self.oldest
+
+    def uncommitted(self):
+        """Return the number of results that are not committed yet."""
+        with self.condition:
+            return len(self.pending) + self.committing
+
+    def report_uncommitted(self):
+        print("{} highscore results are not committed, the oldest waited {:.1f} s.".format(
+            self.uncommitted(), self.lag()))
+
+    def take(self):
+        """Wait for a burst of results and take them, return (results, time
+        the oldest was queued), ([], None) after refresh_interval seconds
+        without results, or (None, None) when closed."""
+        with self.condition:
+            self.condition.wait_for(lambda: self.pending or self.closed, self.refresh_interval)
+            if not self.pending:
+                return (None, None) if self.closed else ([], None)
+            self.condition.wait_for(lambda: self.closed or self.flush_waiters,
+                max(0, self.pending_since + self.delay - self.clock()))
+            results, since = self.pending, self.pending_since
+            self.pending, self.pending_since = [], None
+            self.committing = len(results)
+            return results, since
+
+    def run(self):
+        while True:
+            results, since = self.take()
+            if results is None:
+                return
+            if results and not self.commit(results, since):
+                continue
+            if not self.closed:
+                self.fetch_changes()
+
+    def commit(self, results, since):
+        """Commit results taken by take(), return False if it failed."""
+        start = self.clock()
+        try:
+            self.store.commit(results)
+        except Exception:
+            traceback.print_exc()
+            with self.condition:
+                self.committing = 0
+                if self.closed:
+                    print("Could not commit {} highscore results.".format(len(results)))
+                    self.condition.notify_all()
+                    return False
+                self.pending[:0] = results
+                self.pending_since = since
+                self.condition.wait_for(lambda: self.closed, self.retry_delay)
+            return False
+        end = self.clock()
+        with self.condition:
+            self.committing = 0
+            self.oldest = self.pending_since
+            self.condition.notify_all()
+        if self.on_commit is not None:
+            self.on_commit(results, end - start, end - since)
+        return True
+
+    def fetch_changes(self):
+        """Fetch the results other processes have committed to the store."""
+        try:
+            changes, ratings = self.store.refresh()
+        except Exception:
+            traceback.print_exc()
+            return
+        if not changes and not ratings:
+            return
+        with self.condition:
+            for player, (won, lost) in changes.items():
+                delta = self.changes.setdefault(player, [0, 0])
+                delta[0] += won
+                delta[1] += lost
+            self.changed_ratings.update(ratings)
+
+    def take_changes(self):
+        """Return (player -> (won, lost), player -> rating) committed by other
+        processes since the last call, without waiting for the store."""
+        with self.condition:
+            changes, ratings = self.changes, self.changed_ratings
+            self.changes, self.changed_ratings = {}, {}
+            return changes, ratings
+
+    def flush(self, timeout=None):
+        """Commit the queued results now and wait until they are committed.
+        Return False on timeout."""
+        with self.condition:
+            self.flush_waiters += 1
+            self.condition.notify_all()
+            try:
+                return self.condition.wait_for(lambda: not self.pending and not self.committing, timeout)
+            finally:
+                self.flush_waiters -= 1
+
+    def close(self, timeout=None):
+        """Commit the queued results and stop the thread. If that takes
+        longer than timeout seconds, by default close_timeout, report what
+        is not committed and return False, leaving the daemon thread to
+        finish the commit until the process exits."""
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        self.thread.join(self.close_timeout if timeout is None else timeout)
+        if self.thread.is_alive():
+            self.report_uncommitted()
+            return False
+        return True
+
+
+def open_store(filename, rating):
+    """Return the storage backend for filename: JSON for *.json, SQLite otherwise."""
+    if filename.endswith(".json"):
+        return JsonHighscoreStore(filename, rating)
+    return SqliteHighscoreStore(filename, rating)
+
+
+class Highscore:
+    """Results of all games, kept in memory and committed to a store.
+
+    Several processes can share a store. The get_*_str() methods first
+    apply the results the others have committed, see refresh(). With
+    write_behind they only apply what the writer thread has already
+    fetched, so they never wait for a commit of that thread."""
+
+    default_count = 10
+
+    def __init__(self, filename, autosave=True, rating=None, write_behind=False):
+        """If autosave is False, update() only collects results and the owner
+        is responsible for calling save() or passing take_unsaved() to
+        self.store.commit(). With write_behind, update() hands results to
+        self.writer, a HighscoreWriter, instead and returns without waiting
+        for the disk. rating defaults to EloRating()."""
+        self.rating=EloRating() if rating is None else rating
+        self.store=open_store(filename, self.rating)
+        self.autosave=autosave
+        self.unsaved=[]
+        self.load()
+        self.writer = HighscoreWriter(self.store) if write_behind else None
+
+    @property
+    def dirty(self):
+        return len(self.unsaved) > 0
+
+    def load(self):
+        self.data = self.store.load()
+        self.ratings = self.store.load_ratings()
+        self.ranking = RankingIndex()
+        for player, player_data in self.data.items():
+            self.ranking.set_won(player, player_data["won"])
+
+    def take_unsaved(self):
+        """Return results of games not yet committed to the store and forget them."""
+        unsaved = self.unsaved
+        self.unsaved = []
+        return unsaved
 
     def save(self):
-        with open(self.json_filename, "w") as f:
-            json.dump(self.data, f, indent=4)
+        self.store.commit(self.take_unsaved())
 
-    def ensure_record_exists(self, player):
-        if not player in self.data:
-            self.data[player]={
-                "won":0,
-                "lost":0
-            }
+    def flush(self, timeout=HighscoreWriter.close_timeout):
+        """Commit all results of update() to the store. With write_behind,
+        wait at most timeout seconds and report what is not committed then."""
+        if self.writer:
+            if not self.writer.flush(timeout):
+                self.writer.report_uncommitted()
+        elif self.dirty:
+            self.save()
+
+    def close(self, timeout=None):
+        """Commit all results and close the store. With write_behind, wait at
+        most timeout seconds, see HighscoreWriter.close()."""
+        if self.writer:
+            if not self.writer.close(timeout):
+                return # the writer thread still uses the store
+        elif self.dirty:
+            self.save()
+        self.store.close()
+
+    def refresh(self):
+        """Apply the results committed to the store by other processes. The
+        ratings of their players are replaced by those in the store, which
+        miss results of this process that are not committed yet until a
+        later refresh()."""
+        if self.writer:
+            changes, ratings = self.writer.take_changes()
+        else:
+            changes, ratings = self.store.refresh()
+        for player, (won, lost) in changes.items():
+            player_data = self.data.setdefault(player, {"won":0, "lost":0})
+            player_data["won"] += won
+            player_data["lost"] += lost
+            self.ranking.set_won(player, player_data["won"])
+        self.ratings.update(ratings)
 
     def update(self, winners, losers):
-        for winner in winners:
-            self.ensure_record_exists(winner)
-            self.data[winner]["won"]+=1
-        for loser in losers:
-            self.ensure_record_exists(loser)
-            self.data[loser]["lost"]+=1
-        self.save()
-
-    def get_highscore_str(self):
-        entries = list(self.data.items())
-        entries.sort(key=lambda p: p[1]["won"], reverse=True)
+        apply_result(self.data, winners, losers)
+        self.rating.update(self.ratings, winners, losers)
+        for player in list(winners) + list(losers):
+            self.ranking.set_won(player, self.data[player]["won"])
+        if self.writer:
+            self.writer.put((list(winners), list(losers)))
+            return
+        self.unsaved.append((list(winners), list(losers)))
+        if self.autosave:
+            self.save()
+
+    def get_rank(self, player):
+        """Return (rank, number of ranked players), or None if player has no record."""
+        if not player in self.data:
+            return None
+        return self.ranking.rank(player), len(self.ranking)
+
+    def get_highscore_str(self, count=None):
+        self.refresh()
         entries_str=[]
-        for player, player_data in entries:
+        for player in self.ranking.top(count or self.default_count):
+            player_data = self.data[player]
             entries_str.append("{} (won: {}, lost: {})".format(
                 player, player_data["won"], player_data["lost"]
             ))
-        return ", ".join(entries_str)
\ No newline at end of file
+        return ", ".join(entries_str)
+
+    def get_rating(self, player):
+        """Return the rating of player, or None if player has no record."""
+        if not player in self.data:
+            return None
+        return self.ratings.get(player, self.rating.initial)
+
+    def get_rating_str(self, player):
+        self.refresh()
+        rating = self.get_rating(player)
+        if rating is None:
+            return "No games recorded for {}.".format(player)
+        return "{} has a rating of {:.0f} after {} games.".format(
+            player, rating, self.data[player]["won"] + self.data[player]["lost"])
+
+    def get_rank_str(self, player):
+        self.refresh()
+        rank = self.get_rank(player)
+        if rank is None:
+            return "No games recorded for {}.".format(player)
+        return "{} is ranked {} of {} (won: {}, lost: {}).".format(
+            player, rank[0], rank[1], self.data[player]["won"], self.data[player]["lost"]
+        )
@@ -0,0 +1,319 @@
+"""Columnar history of finished games, with an index per player.
+
+A history is a directory of column files. Each file is an append-only
+array of fixed-width values (see the array module for the type codes):
+
+    games      time (d), seat_start (I), seat_count (B), proposal_start (I),
+               proposal_count (B), args (B), kill_seat (b), winner (B)
+    seats      game (I), player (I), role (B), won (B), prev (i)
+    proposals  game (I), leader (B), team (H), accepts (H), fails (b)
+
+Every game has one seat row per player and one proposal row per proposed
+team. Seats and masks count from 0 within the game, fails is -1 if the team
+was rejected, args is a mask of AvalonGame.valid_game_args, kill_seat is -1
+if the Assassin did not kill. meta.json lists the short names of the roles
+in the order of the role column.
+
+players.txt has one nick per line, and the line number is the player id.
+player_last.i holds the last seat row of every player, and every seat row
+links to the previous seat row of its player. So the games of a player are
+found by following these links, without reading the rows of other players.
+Queries read the columns through mmap.
+
+GameHistory.append() holds an exclusive lock on the lock file, so several
+processes can share a history. The winner column is written last, and its
+length is the number of complete games. Rows of the other columns beyond
+the last complete game are left over from a crash and are cut off when the
+history is opened.
+"""
+
+import array
+import collections
+import contextlib
+import fcntl
+import json
+import mmap
+import os
+import time
+
+from .game import AvalonGame
+from .roles import RoleMerlin, roles_by_short_name
+
+VERSION = 1
+
+GAME_COLUMNS = [("time", "d"), ("seat_start", "I"), ("seat_count", "B"), ("proposal_start", "I"),
+    ("proposal_count", "B"), ("args", "B"), ("kill_seat", "b"), ("winner", "B")]
+SEAT_COLUMNS = [("game", "I"), ("player", "I"), ("role", "B"), ("won", "B"), ("prev", "i")]
+PROPOSAL_COLUMNS = [("game", "I"), ("leader", "B"), ("team", "H"), ("accepts", "H"), ("fails", "b")]
+
+# games, wins and the games as Merlin in which the Assassin chose a target
+# (or ran out of time) and in which Merlin survived that.
+PlayerStats = collections.namedtuple("PlayerStats", "games wins faction_stats role_stats merlin_assassinations merlin_survived")
+
+
+class Column:
+    """An append-only file of fixed-width values."""
+
+    def __init__(self, filename, typecode):
+        self.typecode = typecode
+        self.itemsize = array.array(typecode).itemsize
+        self.fd = os.open(filename, os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o644)
+        self.map = None
+        self.view = ()
+
+    def __len__(self):
+        return os.fstat(self.fd).st_size // self.itemsize
+
+    def append(self, values):
+        os.write(self.fd, array.array(self.typecode, values).tobytes())
+
+    def truncate(self, length):
+        self.unmap()
+        os.ftruncate(self.fd, length * self.itemsize)
+
+    def values(self):
+        """Return a memoryview of the values, mapped again if the file has grown.
+        Do not keep it across calls of append() or truncate()."""
+        length = len(self)
+        if length != len(self.view):
+            self.unmap()
+            if length:
+                self.map = mmap.mmap(self.fd, length * self.itemsize, prot=mmap.PROT_READ)
+                self.view = memoryview(self.map).cast(self.typecode)
+        return self.view
+
+    def unmap(self):
+        if self.map is not None:
+            self.view.release()
+            self.map.close()
+            self.map = None
+        self.view = ()
+
+    def close(self):
+        self.unmap()
+        os.close(self.fd)
+
+
+class GameHistory:
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.lock_fd = os.open(self.path("lock"), os.O_RDWR | os.O_CREAT, 0o644)
+        self.games = {name: Column(self.path("game_{}.{}".format(name, typecode)), typecode)
+            for name, typecode in GAME_COLUMNS}
+        self.seats = {name: Column(self.path("seat_{}.{}".format(name, typecode)), typecode)
+            for name, typecode in SEAT_COLUMNS}
+        self.proposals = {name: Column(self.path("proposal_{}.{}".format(name, typecode)), typecode)
+            for name, typecode in PROPOSAL_COLUMNS}
+        self.player_last_fd = os.open(self.path("player_last.i"), os.O_RDWR | os.O_CREAT, 0o644)
+        self.players_file = open(self.path("players.txt"), "ab+")
+        self.players_offset = 0
+        self.player_ids = {} # nick -> player id
+        self.player_names = [] # player id -> nick
+        with self.locked():
+            self.load_meta()
+            self.read_new_players()
+            self.repair()
+
+    def path(self, filename):
+        return os.path.join(self.directory, filename)
+
+    @contextlib.contextmanager
+    def locked(self):
+        """Hold the exclusive lock of the history, shared with other processes."""
+        fcntl.flock(self.lock_fd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self.lock_fd, fcntl.LOCK_UN)
+
+    def load_meta(self):
+        try:
+            with open(self.path("meta.json"), "r") as f:
+                meta = json.load(f)
+            if meta["version"] != VERSION:
+                raise ValueError("{} is a version {} history, not version {}.".format(self.directory, meta["version"], VERSION))
+            self.role_names = meta["roles"]
+        except FileNotFoundError:
+            self.role_names = []
+        new_roles = [short_name for short_name in roles_by_short_name if not short_name in self.role_names]
+        if new_roles:
+            self.role_names += new_roles
+            self.save_meta()
+        self.role_index = {short_name: idx for idx, short_name in enumerate(self.role_names)}
+
+    def save_meta(self):
+        tmp_filename = self.path("meta.json.tmp")
+        with open(tmp_filename, "w") as f:
+            json.dump({"version": VERSION, "roles": self.role_names}, f)
+        os.replace(tmp_filename, self.path("meta.json"))
+
+    def read_new_players(self):
+        """Read the players added since the last call, also by other processes."""
+        self.players_file.seek(self.players_offset)
+        data = self.players_file.read()
+        data = data[:data.rfind(b"\n") + 1] # Only complete lines
+        self.players_offset += len(data)
+        for line in data.decode("utf-8").splitlines():
+            self.player_ids[line] = len(self.player_names)
+            self.player_names.append(line)
+
+    def add_player(self, nick):
+        """Return the id of nick, adding nick if unknown. Call with the lock held."""
+        player_id = self.player_ids.get(nick)
+        if player_id is None:
+            # No games yet. Written first, so that player_last.i never has a hole.
+            self.set_last_seat(len(self.player_names), -1)
+            self.players_file.seek(0, os.SEEK_END)
+            self.players_file.write(nick.encode("utf-8") + b"\n")
+            self.players_file.flush()
+            self.read_new_players()
+            player_id = self.player_ids[nick]
+        return player_id
+
+    def last_seat(self, player_id):
+        data = os.pread(self.player_last_fd, 4, player_id * 4)
+        return array.array("i", data)[0] if len(data) == 4 else -1
+
+    def set_last_seat(self, player_id, row):
+        os.pwrite(self.player_last_fd, array.array("i", [row]).tobytes(), player_id * 4)
+
+    def __len__(self):
+        return len(self.games["winner"])
+
+    def repair(self):
+        """Cut off the rows of a game whose append was interrupted."""
+        game_count = len(self)
+        seat_count = proposal_count = 0
+        if game_count:
+            last = game_count - 1
+            seat_count = self.games["seat_start"].values()[last] + self.games["seat_count"].values()[last]
+            proposal_count = self.games["proposal_start"].values()[last] + self.games["proposal_count"].values()[last]
+        prev = self.seats["prev"].values()
+        for player_id in range(len(self.player_names)):
+            row = self.last_seat(player_id)
+            if row >= seat_count:
+                while row >= seat_count:
+                    row = prev[row]
+                self.set_last_seat(player_id, row)
+        for columns, count in ((self.games, game_count), (self.seats, seat_count), (self.proposals, proposal_count)):
+            for column in columns.values():
+                if len(column) > count:
+                    column.truncate(count)
+
+    def append(self, game, timestamp=None):
+        """Append a finished AvalonGame."""
+        assert game.phase == AvalonGame.Finished
+        evil_won = game.winner == AvalonGame.Evil
+        with self.locked():
+            self.read_new_players()
+            game_id = len(self)
+            seat_start = len(self.seats["game"])
+            proposal_start = len(self.proposals["game"])
+            player_ids = [self.add_player(player) for player in game.players]
+
+            self.seats["game"].append([game_id] * len(player_ids))
+            self.seats["player"].append(player_ids)
+            self.seats["role"].append([self.role_index[role.short_name] for role in game.roles])
+            self.seats["won"].append([role.evil == evil_won for role in game.roles])
+            self.seats["prev"].append([self.last_seat(player_id) for player_id in player_ids])
+
+            self.proposals["game"].append([game_id] * len(game.proposals))
+            self.proposals["leader"].append([leader for leader, team, accepts, fails in game.proposals])
+            self.proposals["team"].append([team for leader, team, accepts, fails in game.proposals])
+            self.proposals["accepts"].append([accepts for leader, team, accepts, fails in game.proposals])
+            self.proposals["fails"].append([-1 if fails is None else fails for leader, team, accepts, fails in game.proposals])
+
+            for seat, player_id in enumerate(player_ids):
+                self.set_last_seat(player_id, seat_start + seat)
+
+            args = 0
+            for idx, game_arg in enumerate(AvalonGame.valid_game_args):
+                if game_arg in game.game_args:
+                    args |= 1 << idx
+            row = {
+                "time": time.time() if timestamp is None else timestamp,
+                "seat_start": seat_start,
+                "seat_count": len(player_ids),
+                "proposal_start": proposal_start,
+                "proposal_count": len(game.proposals),
+                "args": args,
+                "kill_seat": -1 if game.kill_seat is None else game.kill_seat,
+                "winner": game.winner,
+            }
+            for name, typecode in GAME_COLUMNS: # winner last, it completes the game
+                self.games[name].append([row[name]])
+
+    def player_stats(self, nick):
+        """Return the PlayerStats of nick, or None if nick has no games. Reads
+        only the rows of the games of nick."""
+        player_id = self.player_ids.get(nick)
+        if player_id is None:
+            self.read_new_players()
+            player_id = self.player_ids.get(nick)
+            if player_id is None:
+                return None
+        # Read the last row of the player and the game count before mapping
+        # the columns: another process can append meanwhile, and the rows
+        # it links then lie beyond views mapped earlier.
+        row = self.last_seat(player_id)
+        game_count = len(self)
+        seat_game = self.seats["game"].values()
+        seat_role = self.seats["role"].values()
+        seat_won = self.seats["won"].values()
+        seat_prev = self.seats["prev"].values()
+        seat_start = self.games["seat_start"].values()
+        kill_seat = self.games["kill_seat"].values()
+        merlin = self.role_index[RoleMerlin.short_name]
+
+        games = wins = merlin_assassinations = merlin_survived = 0
+        role_stats = collections.defaultdict(lambda: [0, 0]) # role short name -> [games, wins]
+        while row >= 0:
+            game = seat_game[row]
+            if game < game_count: # Not a game being appended by another process
+                won = seat_won[row]
+                games += 1
+                wins += won
+                stats = role_stats[seat_role[row]]
+                stats[0] += 1
+                stats[1] += won
+                if seat_role[row] == merlin and (won or kill_seat[game] == row - seat_start[game]):
+                    merlin_assassinations += 1
+                    merlin_survived += won
+            row = seat_prev[row]
+        if not games:
+            return None
+
+        faction_stats = {AvalonGame.Good: [0, 0], AvalonGame.Evil: [0, 0]}
+        for role, stats in role_stats.items():
+            faction = faction_stats[AvalonGame.Evil if roles_by_short_name[self.role_names[role]].evil else AvalonGame.Good]
+            faction[0] += stats[0]
+            faction[1] += stats[1]
+        return PlayerStats(games, wins, faction_stats,
+            {self.role_names[role]: tuple(stats) for role, stats in role_stats.items()},
+            merlin_assassinations, merlin_survived)
+
+    def get_stats_str(self, nick):
+        stats = self.player_stats(nick)
+        if stats is None:
+            return "No games recorded for {}.".format(nick)
+        parts = ["{}: won {} of {} games ({:.0%})".format(nick, stats.wins, stats.games, stats.wins / stats.games)]
+        for faction, name in ((AvalonGame.Good, "Good"), (AvalonGame.Evil, "Evil")):
+            games, wins = stats.faction_stats[faction]
+            if games:
+                parts.append("as {} {} of {}".format(name, wins, games))
+        roles = sorted(stats.role_stats.items(), key=lambda item: -item[1][0])
+        parts.append("by role: " + ", ".join("{} {} of {}".format(roles_by_short_name[role].long_name, wins, games)
+            for role, (games, wins) in roles))
+        if stats.merlin_assassinations:
+            parts.append("survived {} of {} assassinations as Merlin".format(stats.merlin_survived, stats.merlin_assassinations))
+        return "; ".join(parts) + "."
+
+    def close(self):
+        for columns in (self.games, self.seats, self.proposals):
+            for column in columns.values():
+                column.close()
+        os.close(self.player_last_fd)
+        os.close(self.lock_fd)
+        self.players_file.close()
+
@@ -0,0 +1,169 @@
+"""Latency histograms and counters of AvalonBot in the Prometheus text format.
+
+Only AvalonBot(metrics_port=...) creates a Metrics registry. It then plays
+its games with a subclass of AvalonGame made by instrumented_game_class(),
+whose handlers observe their duration, and times the outbound queue and the
+highscore commits. Without metrics_port nothing is wrapped, so there is no
+overhead at all. The registry is served on http://host:port/metrics by
+Metrics.start_server().
+
+Histograms have fixed buckets. observe() is one bisect and three additions,
+and the cumulative bucket counts are only summed up when scraped.
+"""
+
+import asyncio
+import bisect
+import functools
+import time
+
+# Seconds, from 0.1 ms to 10 s
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Methods of AvalonGame timed by instrumented_game_class(). handle_pubmsg and
+# handle_privmsg include the command handlers they call.
+GAME_HANDLERS = [
+    "handle_pubmsg", "handle_privmsg", "handle_join", "handle_leave", "handle_start", "handle_team",
+    "handle_accept_reject", "handle_success_fail", "handle_kill", "handle_identify", "handle_info",
+    "handle_highscore", "handle_rank", "handle_rating", "handle_stats", "handle_deadline", "end_game",
+]
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = list(buckets)
+        self.counts = [0]*(len(self.buckets) + 1) # per bucket, not cumulative, the last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(self.buckets + ["+Inf"], self.counts):
+            cumulative += count
+            yield name + "_bucket", labels + (("le", format_value(bound)),), cumulative
+        yield name + "_sum", labels, self.sum
+        yield name + "_count", labels, self.count
+
+
+class Counter:
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def samples(self, name, labels):
+        yield name, labels, self.value
+
+
+def format_value(value):
+    if isinstance(value, str):
+        return value
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(key, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for key, value in labels) + "}"
+
+
+class Metrics:
+    """Registry of metrics. Metrics with the same name and different labels
+    form one family. Gauges are computed when scraped by the collectors."""
+
+    def __init__(self):
+        self.families = {} # name -> [type, help, {labels: metric}]
+        self.collectors = [] # callables returning lists of (name, help, labels dict, value) gauges
+
+    def get(self, metric_class, metric_type, name, help, labels):
+        family = self.families.setdefault(name, [metric_type, help, {}])
+        key = tuple(sorted(labels.items()))
+        metric = family[2].get(key)
+        if metric is None:
+            metric = family[2][key] = metric_class()
+        return metric
+
+    def histogram(self, name, help, **labels):
+        return self.get(Histogram, "histogram", name, help, labels)
+
+    def counter(self, name, help, **labels):
+        return self.get(Counter, "counter", name, help, labels)
+
+    def add_collector(self, collector):
+        self.collectors.append(collector)
+
+    def render(self):
+        """Return all metrics in the Prometheus text exposition format."""
+        lines = []
+        for name, (metric_type, help, metrics) in self.families.items():
+            lines.append("# HELP {} {}".format(name, help))
+            lines.append("# TYPE {} {}".format(name, metric_type))
+            for labels, metric in metrics.items():
+                for sample_name, sample_labels, value in metric.samples(name, labels):
+                    lines.append("{}{} {}".format(sample_name, format_labels(sample_labels), format_value(value)))
+        gauges = {}
+        for collector in self.collectors:
+            for name, help, labels, value in collector():
+                gauges.setdefault(name, [help, []])[1].append((tuple(sorted(labels.items())), value))
+        for name, (help, samples) in gauges.items():
+            lines.append("# HELP {} {}".format(name, help))
+            lines.append("# TYPE {} gauge".format(name))
+            for labels, value in samples:
+                lines.append("{}{} {}".format(name, format_labels(labels), format_value(value)))
+        return "\n".join(lines) + "\n"
+
+    async def handle_request(self, reader, writer):
+        try:
+            request = await reader.readline()
+            while (await reader.readline()).strip():
+                pass # Headers
+            parts = request.decode("latin-1").split()
+            if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+                status, body = "200 OK", self.render().encode("utf-8")
+            else:
+                status, body = "404 Not Found", b"Not found. Metrics are at /metrics.\n"
+            writer.write("HTTP/1.0 {}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\nContent-Length: {}\r\n\r\n".format(
+                status, len(body)).encode("latin-1") + body)
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def start_server(self, host, port):
+        """Serve GET /metrics on host:port. Return the asyncio.Server."""
+        return await asyncio.start_server(self.handle_request, host, port)
+
+
+def timed(func, histogram):
+    """Return func wrapped to observe its duration in histogram."""
+    perf_counter = time.perf_counter
+    observe = histogram.observe
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            observe(perf_counter() - start)
+    return wrapper
+
+
+def instrumented_game_class(game_class, metrics, handlers=GAME_HANDLERS):
+    """Return a subclass of game_class whose handlers are timed in the
+    avalon_handler_seconds histogram of metrics. It adds no slots, so the
+    class of an existing game can be changed to it."""
+    namespace = {"__slots__": ()}
+    for name in handlers:
+        namespace[name] = timed(getattr(game_class, name), metrics.histogram("avalon_handler_seconds",
+            "Duration of AvalonGame handlers.", handler=name))
+    return type("Instrumented" + game_class.__name__, (game_class,), namespace)
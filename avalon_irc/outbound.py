@@ -0,0 +1,234 @@
+import asyncio
+import collections
+import heapq
+import time
+import traceback
+
+
+# Lower values are sent first.
+PRIORITY_PUBLIC, PRIORITY_PRIVATE = range(2)
+
+# RFC 1459: 512 bytes per line including the trailing CR LF.
+IRC_LINE_LENGTH = 512
+
+# Hostnames are at most 63 characters, used until the server told us our real prefix.
+MAX_HOST_LENGTH = 63
+
+
+def split_text(text, limit):
+    """Split text into a head of at most limit bytes (UTF-8) and the rest.
+    Splits at the last space in the head when there is one."""
+    head = text.encode("utf-8")[:limit].decode("utf-8", "ignore")
+    if len(head) < len(text):
+        space = head.rfind(" ")
+        if space > 0:
+            head = head[:space]
+    return head, text[len(head):].lstrip(" ")
+
+
+class TokenBucket:
+    """Allows rate events per second on average and up to burst events at once."""
+
+    def __init__(self, rate, burst, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.tokens = burst
+        self.last = clock()
+
+    def refill(self):
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+    def delay(self):
+        """Return seconds until the next token is available, 0 if one is available now."""
+        self.refill()
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+
+class OutboundQueue:
+    """Paces outgoing PRIVMSGs to stay below the server's flood limits.
+
+    Messages are queued per target. Channels are served before private
+    messages, targets of the same priority take turns. So that a busy
+    channel cannot starve the players, a private message waits for at most
+    max_public_streak channel lines. When a target is
+    served, its queued messages are packed into one line of the maximum
+    length the server will relay, so consecutive messages to the same
+    target are merged.
+
+    send_line(target, line) is called for every line that goes out. While
+held, e.g. before the server has welcomed us, messages are only queued.
+
+    With a tracer (see tracing.py), every message keeps the trace that was
+    current when it was queued, and tracer.sent() is called after its line
+    went out."""
+
+    max_public_streak = 3
+
+    def __init__(self, send_line, nickname, rate=1.0, burst=5, clock=time.monotonic):
+        self.send_line = send_line
+        self.bucket = TokenBucket(rate, burst, clock)
+        self.clock = clock
+        self.set_prefix("{}!{}@{}".format(nickname, nickname, "x"*MAX_HOST_LENGTH))
+        self.pending = {} # target -> deque of (enqueue time, text, trace)
+        self.ready = [] # heap of (priority, seq, target) for targets with pending messages
+        self.seq = 0
+        self.private_ready = 0 # entries of private targets in self.ready
+        self.public_streak = 0 # channel lines sent while a private target was ready
+        self.depth = 0 # messages waiting to be sent
+        self.latencies = collections.deque(maxlen=1000) # seconds from put() until sent
+        self.observe_wait = None # called with the seconds from put() until sent, if set
+        self.tracer = None
+        self.line_traces = [] # (trace, wait) of the messages in the line being sent
+        self.held = False
+        self.wakeup = asyncio.Event()
+
+    def hold(self):
+        """Keep the queued messages until release()."""
+        self.held = True
+
+    def release(self):
+        self.held = False
+        self.wakeup.set()
+
+    def set_prefix(self, prefix):
+        """Set our nick!user@host as other clients see it. It is prepended to
+        every line relayed by the server and counts towards the line length."""
+        self.prefix = prefix
+
+    def max_line_bytes(self, target):
+        return IRC_LINE_LENGTH - len(":{} PRIVMSG {} :\r\n".format(self.prefix, target).encode("utf-8"))
+
+    @staticmethod
+    def priority(target):
+        return PRIORITY_PUBLIC if target[:1] in "#&" else PRIORITY_PRIVATE
+
+    def schedule(self, target):
+        self.seq += 1
+        priority = self.priority(target)
+        if priority == PRIORITY_PRIVATE:
+            self.private_ready += 1
+        heapq.heappush(self.ready, (priority, self.seq, target))
+
+    def pop_ready(self):
+        """Return the target to serve next and remove it from self.ready."""
+        if self.private_ready and self.public_streak >= self.max_public_streak:
+            entry = min(entry for entry in self.ready if entry[0] == PRIORITY_PRIVATE)
+            self.ready.remove(entry)
+            heapq.heapify(self.ready)
+        else:
+            entry = heapq.heappop(self.ready)
+        if entry[0] == PRIORITY_PRIVATE:
+            self.private_ready -= 1
+            self.public_streak = 0
+        elif self.private_ready:
+            self.public_streak += 1
+        return entry[2]
+
+    def put(self, target, msg):
+        if not msg:
+            return
+        if not target in self.pending:
+            self.pending[target] = collections.deque()
+            self.schedule(target)
+        trace = self.tracer.current() if self.tracer else None
+        if trace is not None:
+            trace.messages += 1
+        self.pending[target].append((self.clock(), msg, trace))
+        self.depth += 1
+        self.wakeup.set()
+
+    def put_many(self, messages):
+        """Queue a batch of (target, msg) pairs, e.g. the role messages at the
+        start of a game."""
+        now = self.clock()
+        trace = self.tracer.current() if self.tracer else None
+        for target, msg in messages:
+            if not msg:
+                continue
+            if not target in self.pending:
+                self.pending[target] = collections.deque()
+                self.schedule(target)
+            if trace is not None:
+                trace.messages += 1
+            self.pending[target].append((now, msg, trace))
+            self.depth += 1
+        self.wakeup.set()
+
+    def pack_line(self, target):
+        """Remove text from the messages queued for target and return it as
+        one line of at most max_line_bytes(target) bytes."""
+        messages = self.pending[target]
+        limit = self.max_line_bytes(target)
+        line = ""
+        while messages:
+            queued_at, text, trace = messages[0]
+            packed = text if not line else line + " " + text
+            if len(packed.encode("utf-8")) <= limit:
+                line = packed
+                messages.popleft()
+                self.depth -= 1
+                wait = self.clock() - queued_at
+                self.latencies.append(wait)
+                if self.observe_wait is not None:
+                    self.observe_wait(wait)
+                if trace is not None:
+                    self.line_traces.append((trace, wait))
+            elif line:
+                break
+            else:
+                line, rest = split_text(text, limit)
+                messages[0] = (queued_at, rest, trace)
+                break
+        return line
+
+    def send_next(self):
+        """Send one line if a token is available. Return the seconds to wait
+        before calling again, or None if nothing is queued or the queue is held."""
+        if not self.ready or self.held:
+            return None
+        delay = self.bucket.delay()
+        if delay > 0:
+            return delay
+        target = self.pop_ready()
+        line = self.pack_line(target)
+        if self.pending[target]:
+            self.schedule(target)
+        else:
+            del self.pending[target]
+        self.bucket.take()
+        self.send_line(target, line)
+        if self.line_traces:
+            self.tracer.sent(target, line, self.line_traces)
+            self.line_traces = []
+        return 0
+
+    async def run(self):
+        while True:
+            try:
+                delay = self.send_next()
+            except Exception:
+                # The line is lost, but the queue keeps running.
+                traceback.print_exc()
+                continue
+            if delay is None:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+            elif delay > 0:
+                await asyncio.sleep(delay)
+
+    def stats(self):
+        latencies = sorted(self.latencies)
+        return {
+            "depth": self.depth,
+            "targets": len(self.pending),
+            "latency_avg": sum(latencies) / len(latencies) if latencies else 0,
+            "latency_max": latencies[-1] if latencies else 0,
+        }
@@ -0,0 +1,43 @@
+"""Elo ratings for team games.
+
+Every finished game is a match of the winning team against the losing team.
+A team is rated by the mean rating of its players, and every player of the
+team gains or loses the same amount:
+
+    expected = 1 / (1 + 10 ** ((loser mean - winner mean) / scale))
+    change   = k * (1 - expected)
+
+Winners gain change, losers lose it, so one game costs O(team size). The
+function is deterministic, so rerate.py recomputes the same ratings from
+the game history.
+"""
+
+
+class EloRating:
+    def __init__(self, k=32.0, initial=1500.0, scale=400.0):
+        self.k = k
+        self.initial = initial
+        self.scale = scale
+
+    def mean(self, ratings, players):
+        return sum(ratings.get(player, self.initial) for player in players) / len(players)
+
+    def change(self, ratings, winners, losers):
+        """Return the rating points the winners gain and the losers lose.
+        ratings maps players to ratings, players without one are at initial."""
+        if not winners or not losers:
+            return 0.0
+        expected = 1 / (1 + 10 ** ((self.mean(ratings, losers) - self.mean(ratings, winners)) / self.scale))
+        return self.k * (1 - expected)
+
+    def update(self, ratings, winners, losers):
+        """Apply the result of one game to ratings. Return {player: new rating}
+        for the players of the game."""
+        change = self.change(ratings, winners, losers)
+        updated = {}
+        for player in winners:
+            updated[player] = ratings.get(player, self.initial) + change
+        for player in losers:
+            updated[player] = ratings.get(player, self.initial) - change
+        ratings.update(updated)
+        return updated
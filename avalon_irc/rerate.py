@@ -0,0 +1,167 @@
+"""Recompute all ratings from the game history, to tune rating parameters.
+
+    python3 -m avalon_irc.rerate highscore.db [--k 16 32 ...] [--scale 400 ...] [--write]
+
+Replays the results table of an SQLite highscore with the rating.EloRating
+rule and reports how well every combination of the given parameters
+predicted the results: the mean log loss of the expected score of the
+winners before each game, lower is better. With --write the ratings of the
+single given combination replace the ratings table. Requires numpy
+(pip3 install avalon-irc[rerate]).
+
+Elo is a recurrence, every game depends on the ratings left by the games
+of its players before, and the games of a channel's regulars depend on
+each other almost in a chain. So the games are replayed in order, over
+players encoded as integers, and a parameter grid is vectorized instead:
+one pass over the history updates the ratings of all combinations at once.
+The array operations of one game cost about as much as replaying it for
+MIN_VECTORIZED_GRID parameter sets one by one, smaller grids are replayed
+one by one.
+"""
+
+import itertools
+import math
+import sqlite3
+import time
+
+import numpy as np
+
+from .rating import EloRating
+
+MIN_VECTORIZED_GRID = 16
+
+
+def load_results(db_filename):
+    """Return the (winners, losers) lists of all recorded games, in order."""
+    db = sqlite3.connect(db_filename)
+    try:
+        return [(winners.split(), losers.split())
+            for winners, losers in db.execute("SELECT winners, losers FROM results ORDER BY id")]
+    finally:
+        db.close()
+
+
+def encode(results):
+    """Return (players, games): the list of players and the games as
+    (winner indices, loser indices), leaving out games without a loser or
+    without a winner, which do not change ratings."""
+    index = {}
+    games = []
+    for winners, losers in results:
+        if winners and losers:
+            games.append(([index.setdefault(player, len(index)) for player in winners],
+                [index.setdefault(player, len(index)) for player in losers]))
+    return list(index), games
+
+
+def replay(games, player_count, rating):
+    """Return (ratings by player index, mean log loss) for one parameter set.
+    Equal to applying rating.update() to the games in order."""
+    ratings = [rating.initial] * player_count
+    k = rating.k
+    scale = rating.scale
+    loss = 0.0
+    for winners, losers in games:
+        winner_sum = 0.0
+        for player in winners:
+            winner_sum += ratings[player]
+        loser_sum = 0.0
+        for player in losers:
+            loser_sum += ratings[player]
+        expected = 1 / (1 + 10 ** ((loser_sum / len(losers) - winner_sum / len(winners)) / scale))
+        loss -= math.log(expected)
+        change = k * (1 - expected)
+        for player in winners:
+            ratings[player] += change
+        for player in losers:
+            ratings[player] -= change
+    return ratings, loss / max(len(games), 1)
+
+
+def replay_grid(games, player_count, grid):
+    """Return (array of ratings by player index and parameter set, array of
+    mean log loss by parameter set) for a list of EloRatings."""
+    ratings = np.tile(np.array([rating.initial for rating in grid], dtype=float), (player_count, 1))
+    k = np.array([rating.k for rating in grid], dtype=float)
+    scale = np.array([rating.scale for rating in grid], dtype=float)
+    loss = np.zeros(len(grid))
+    for winners, losers in games:
+        winner_ratings = ratings[winners]
+        loser_ratings = ratings[losers]
+        expected = 1 / (1 + 10 ** ((loser_ratings.mean(axis=0) - winner_ratings.mean(axis=0)) / scale))
+        loss -= np.log(expected)
+        change = k * (1 - expected)
+        ratings[winners] = winner_ratings + change
+        ratings[losers] = loser_ratings - change
+    return ratings, loss / max(len(games), 1)
+
+
+def rate_grid(games, player_count, grid):
+    """Return (ratings by player index for every parameter set, mean log
+    loss for every parameter set)."""
+    if len(grid) >= MIN_VECTORIZED_GRID:
+        ratings, losses = replay_grid(games, player_count, grid)
+        return ratings.T.tolist(), losses.tolist()
+    replays = [replay(games, player_count, rating) for rating in grid]
+    return [ratings for ratings, loss in replays], [loss for ratings, loss in replays]
+
+
+def recompute(results, rating=None):
+    """Return {player: rating} after rating results in order."""
+    rating = EloRating() if rating is None else rating
+    players, games = encode(results)
+    ratings, loss = replay(games, len(players), rating)
+    return dict(zip(players, ratings))
+
+
+def write_ratings(db_filename, ratings):
+    db = sqlite3.connect(db_filename)
+    try:
+        with db:
+            db.execute("DELETE FROM ratings")
+            db.executemany("INSERT INTO ratings (player, rating) VALUES (?, ?)", ratings.items())
+    finally:
+        db.close()
+
+
+def main():
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description="Recompute all ratings from the game history.")
+    parser.add_argument("db", help="SQLite highscore database")
+    parser.add_argument("--k", type=float, nargs="+", default=[32.0])
+    parser.add_argument("--scale", type=float, nargs="+", default=[400.0])
+    parser.add_argument("--initial", type=float, default=1500.0)
+    parser.add_argument("--top", type=int, default=10, help="print the best rated players of a single combination")
+    parser.add_argument("--write", action="store_true", help="replace the ratings in the database")
+    args = parser.parse_args()
+
+    grid = [EloRating(k, args.initial, scale) for k, scale in itertools.product(args.k, args.scale)]
+    if args.write and len(grid) > 1:
+        print("Error: --write needs a single value of --k and --scale.")
+        sys.exit(1)
+
+    start = time.perf_counter()
+    players, games = encode(load_results(args.db))
+    loaded = time.perf_counter()
+    grid_ratings, losses = rate_grid(games, len(players), grid)
+    elapsed = time.perf_counter() - loaded
+    print("{} games, {} players: loaded in {:.2f} s, rated {} parameter sets in {:.2f} s".format(
+        len(games), len(players), loaded - start, len(grid), elapsed))
+
+    print("{:>8} {:>8} {:>10}".format("k", "scale", "log loss"))
+    for rating, loss in sorted(zip(grid, losses), key=lambda r: r[1]):
+        print("{:>8g} {:>8g} {:>10.5f}".format(rating.k, rating.scale, loss))
+
+    if len(grid) == 1:
+        ratings = grid_ratings[0]
+        print()
+        for player in sorted(range(len(players)), key=ratings.__getitem__, reverse=True)[:args.top]:
+            print("{:<20} {:>8.1f}".format(players[player], ratings[player]))
+        if args.write:
+            write_ratings(args.db, dict(zip(players, ratings)))
+
+
+if __name__ == "__main__":
+    main()
@@ -5,11 +5,21 @@ class Role:
     is_percival = False
     unknown_to_merlin = False
     looks_like_merlin_to_percival = False
+    requirements_str = "" # explains validate_roles() to the players
 
     def __init__(self, nick):
         self.nick = nick
 
-    def get_initial_knowledge(self, game):
+    def sees_as_evil(self, other):
+        """Return True if this role knows that the player with role other is evil."""
+        return False
+
+    def sees_as_merlin(self, other):
+        """Return True if the player with role other appears as Merlin to this role."""
+        return False
+
+    def get_initial_knowledge(self, evil, merlins):
+        """evil and merlins are the nicks this role sees as evil and as Merlin."""
         return "You have no knowledge of other identities."
     def validate_roles(self, roles):
         """Return True if roles contain all roles that are required for this role to participate properly in the game."""
@@ -24,13 +34,11 @@ class RoleMinionOfMordred(Role):
     evil = True
     is_minion_of_mordred = True
 
-    def get_initial_knowledge(self, game):
-        fellow_minions=[]
-        for player in game.players:
-            if player == self.nick:
-                continue
-            if game.get_role(player).is_minion_of_mordred:
-                fellow_minions.append(player)
+    def sees_as_evil(self, other):
+        return other.is_minion_of_mordred
+
+    def get_initial_knowledge(self, evil, merlins):
+        fellow_minions=evil
         if len(fellow_minions)==0:
             return "There is no fellow Minion of Mordred."
         if len(fellow_minions)==1:
@@ -63,14 +71,11 @@ class RoleMerlin(RoleLoyalServantOfArthur):
     is_merlin = True
     looks_like_merlin_to_percival = True
 
-    def get_initial_knowledge(self, game):
-        minions=[]
-        for player in game.players:
-            role = game.get_role(player)
-            if role.unknown_to_merlin:
-                continue
-            if role.is_minion_of_mordred:
-                minions.append(player)
+    def sees_as_evil(self, other):
+        return other.is_minion_of_mordred and not other.unknown_to_merlin
+
+    def get_initial_knowledge(self, evil, merlins):
+        minions=evil
         if len(minions)==1:
             return "The Minion of Mordred is {}.".format(minions[0])
         else:
@@ -86,12 +91,10 @@ class RolePercival(RoleLoyalServantOfArthur):
     description="good player with knowledge of the identity of Merlin"
     is_percival = True
 
-    def get_initial_knowledge(self, game):
-        merlins=[]
-        for player in game.players:
-            role = game.get_role(player)
-            if role.looks_like_merlin_to_percival:
-                merlins.append(player)
+    def sees_as_merlin(self, other):
+        return other.looks_like_merlin_to_percival
+
+    def get_initial_knowledge(self, evil, merlins):
         return "{} {} Merlin.".format(
             " and ".join(merlins),
             "is" if len(merlins) == 1 else "are"
@@ -113,7 +116,10 @@ class RoleOberon(RoleMinionOfMordred):
 
     is_minion_of_mordred = False
 
-    def get_initial_knowledge(self, game):
+    def sees_as_evil(self, other):
+        return False
+
+    def get_initial_knowledge(self, evil, merlins):
         return "You have no knowledge of other identities."
 
 class RoleMorgana(RoleMinionOfMordred):
@@ -123,6 +129,7 @@ class RoleMorgana(RoleMinionOfMordred):
     description="evil player with knowledge of the identities of the other Minions of Mordred, to Percival appears as Merlin"
 
     looks_like_merlin_to_percival = True
+    requirements_str = "Morgana can only be played together with Percival."
 
     def validate_roles(self, all_roles):
         # Percival needs to present for Morgana to participate.
@@ -131,3 +138,8 @@ class RoleMorgana(RoleMinionOfMordred):
             if role.is_percival:
                 percival_present = True
         return percival_present
+
+roles_by_short_name = {role.short_name: role for role in [
+    RoleMinionOfMordred, RoleAssassin, RoleLoyalServantOfArthur, RoleMerlin,
+    RolePercival, RoleMordred, RoleOberon, RoleMorgana
+]}
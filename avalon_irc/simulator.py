@@ -0,0 +1,362 @@
+"""Headless simulation of complete games with player policies.
+
+Example:
+
+    sim = Simulator(HeuristicPolicy(), seed=1)
+    report = sim.run(10000, player_count=7, game_args=["mordred", "oberon"])
+    print(report)
+
+Or from the command line: python3 -m avalon_irc.simulator --help
+"""
+
+import abc
+import collections
+import random
+import time
+
+from .game import AvalonGame
+
+
+class SimulationError(Exception):
+    pass
+
+
+class NullHighscore:
+    def update(self, winners, losers):
+        pass
+
+    def get_highscore_str(self, count=None):
+        return ""
+
+    def get_rank_str(self, player):
+        return ""
+
+    def get_rating_str(self, player):
+        return ""
+
+
+class NullHistory:
+    def append(self, game):
+        pass
+
+    def get_stats_str(self, player):
+        return ""
+
+
+class SimulationBot:
+    """Bot that drops all messages. For use by AvalonGame class."""
+
+    nickname = "Avalon"
+
+    def __init__(self):
+        self.highscore = NullHighscore()
+        self.history = NullHistory()
+
+    def send_pubmsg(self, msg):
+        pass
+
+    def send_privmsg(self, nick, msg):
+        pass
+
+    def send_privmsgs(self, messages):
+        pass
+
+
+class SilentAvalonGame(AvalonGame):
+    """AvalonGame that does not build the human-readable parts of its messages.
+    Game play, including the use of self.rng, is identical to AvalonGame."""
+
+    def rolemsg_str(self, seat):
+        return ""
+
+    def winner_str(self):
+        return ""
+
+    def roles_str(self):
+        return ""
+
+    def team_str(self):
+        return ""
+
+    def team_vote_result_str(self):
+        return ""
+
+    def quest_overview_str(self):
+        return ""
+
+    def players_str(self):
+        return ""
+
+    def teamsel_str(self):
+        return ""
+
+    def get_special_win_condition_or_empty_str(self):
+        return ""
+
+
+class Policy(abc.ABC):
+    """Decides the actions of a player. One policy object can play any number
+    of seats and games; new_game and observe_quest allow it to keep state
+    for the current game."""
+
+    def new_game(self, game):
+        pass
+
+    def observe_quest(self, game, team, success):
+        pass
+
+    @abc.abstractmethod
+    def propose_team(self, game, nick, rng):
+        """Return list of players for the current quest, nick is the leader."""
+
+    @abc.abstractmethod
+    def vote_team(self, game, nick, rng):
+        """Return True to accept game.team."""
+
+    @abc.abstractmethod
+    def play_quest(self, game, nick, rng):
+        """Return True to play fail. Only used for evil players."""
+
+    @abc.abstractmethod
+    def choose_kill(self, game, nick, rng):
+        """Return the player the Assassin kills."""
+
+
+class RandomPolicy(Policy):
+    def __init__(self, accept_probability=0.5, fail_probability=0.5):
+        self.accept_probability = accept_probability
+        self.fail_probability = fail_probability
+
+    def propose_team(self, game, nick, rng):
+        return rng.sample(game.players, game.get_team_size())
+
+    def vote_team(self, game, nick, rng):
+        return rng.random() < self.accept_probability
+
+    def play_quest(self, game, nick, rng):
+        return rng.random() < self.fail_probability
+
+    def choose_kill(self, game, nick, rng):
+        return rng.choice([p for p in game.players if p != nick])
+
+
+class ScriptedPolicy(Policy):
+    """Takes its decisions from the given lists in order. When a list is
+    exhausted, the fallback policy decides."""
+
+    def __init__(self, teams=(), votes=(), quest_plays=(), kills=(), fallback=None):
+        self.script = {
+            "teams": list(teams),
+            "votes": list(votes),
+            "quest_plays": list(quest_plays),
+            "kills": list(kills),
+        }
+        self.fallback = fallback or RandomPolicy()
+
+    def new_game(self, game):
+        self.pos = collections.Counter()
+        self.fallback.new_game(game)
+
+    def observe_quest(self, game, team, success):
+        self.fallback.observe_quest(game, team, success)
+
+    def next(self, key):
+        if self.pos[key] < len(self.script[key]):
+            self.pos[key] += 1
+            return True, self.script[key][self.pos[key] - 1]
+        return False, None
+
+    def propose_team(self, game, nick, rng):
+        scripted, team = self.next("teams")
+        return team if scripted else self.fallback.propose_team(game, nick, rng)
+
+    def vote_team(self, game, nick, rng):
+        scripted, vote = self.next("votes")
+        return vote if scripted else self.fallback.vote_team(game, nick, rng)
+
+    def play_quest(self, game, nick, rng):
+        scripted, fail = self.next("quest_plays")
+        return fail if scripted else self.fallback.play_quest(game, nick, rng)
+
+    def choose_kill(self, game, nick, rng):
+        scripted, target = self.next("kills")
+        return target if scripted else self.fallback.choose_kill(game, nick, rng)
+
+
+class HeuristicPolicy(Policy):
+    """Plays like a cautious human: evil players fail every quest they are on,
+    good players prefer players from successful quests and avoid players from
+    failed ones, and players use the knowledge their role gives them."""
+
+    def new_game(self, game):
+        self.suspicion = collections.Counter()
+
+    def observe_quest(self, game, team, success):
+        for player in team:
+            self.suspicion[player] += -0.5 if success else 1
+
+    def known_evil(self, game, nick):
+        role = game.get_role(nick)
+        if role.evil:
+            if not role.is_minion_of_mordred:
+                return set()
+            return {p for p in game.players if p != nick and game.get_role(p).is_minion_of_mordred}
+        if role.is_merlin:
+            return {p for p in game.players if game.get_role(p).is_minion_of_mordred and not game.get_role(p).unknown_to_merlin}
+        return set()
+
+    def propose_team(self, game, nick, rng):
+        known_evil = self.known_evil(game, nick)
+        others = [p for p in game.players if p != nick]
+        rng.shuffle(others)
+        # Evil leaders also avoid their known fellows to keep the team unsuspicious.
+        others.sort(key=lambda p: (p in known_evil, self.suspicion[p]))
+        return [nick] + others[:game.get_team_size() - 1]
+
+    def vote_team(self, game, nick, rng):
+        if game.failed_votes >= 4:
+            # Evil wins on the fifth failed vote.
+            return not game.get_role(nick).evil or rng.random() < 0.5
+        known_evil = self.known_evil(game, nick)
+        if game.get_role(nick).evil:
+            return nick in game.team or any(p in known_evil for p in game.team)
+        if any(p in known_evil for p in game.team):
+            return False
+        return sum(self.suspicion[p] for p in game.team) <= sum(self.suspicion[p] for p in game.players) / len(game.players)
+
+    def play_quest(self, game, nick, rng):
+        return True
+
+    def choose_kill(self, game, nick, rng):
+        known_evil = self.known_evil(game, nick)
+        candidates = [p for p in game.players if p != nick and not p in known_evil]
+        least_suspicious = min(self.suspicion[p] for p in candidates)
+        return rng.choice([p for p in candidates if self.suspicion[p] == least_suspicious])
+
+
+GameResult = collections.namedtuple("GameResult", "winner quest_results roles")
+
+
+class SimulationReport(collections.namedtuple("SimulationReport", "games good_wins evil_wins elapsed")):
+    @property
+    def games_per_second(self):
+        return self.games / self.elapsed if self.elapsed > 0 else float("inf")
+
+    @property
+    def evil_win_rate(self):
+        return self.evil_wins / self.games if self.games else 0
+
+    def __str__(self):
+        return "{} games, Good won {}, Evil won {} ({:.1%}), {:.0f} games/s".format(
+            self.games, self.good_wins, self.evil_wins, self.evil_win_rate, self.games_per_second
+        )
+
+
+class Simulator:
+    """Plays complete games of AvalonGame without IRC.
+
+    policies is a single Policy used for every seat, or a list of policies
+    with one entry per seat. With format_messages=False, the game does not
+    build message strings, which is considerably faster."""
+
+    max_steps = 1000
+
+    def __init__(self, policies, seed=None, format_messages=False):
+        self.policies = policies
+        self.rng = random.Random(seed)
+        self.game_class = AvalonGame if format_messages else SilentAvalonGame
+        self.bot = SimulationBot()
+
+    def seat_policies(self, player_count):
+        if isinstance(self.policies, Policy):
+            return [self.policies]*player_count
+        if len(self.policies) != player_count:
+            raise SimulationError("Expected {} policies, got {}.".format(player_count, len(self.policies)))
+        return self.policies
+
+    def play(self, player_count, game_args=(), actions=None):
+        """Play one game. If actions is a list, the handler calls of the game
+        are appended to it as (method name, arguments) tuples. Replaying
+        them on a game with an rng in the state self.rng had before play()
+        reproduces the game."""
+        if actions is None:
+            act = lambda name, *args: getattr(game, name)(*args)
+        else:
+            def act(name, *args):
+                actions.append((name, args))
+                getattr(game, name)(*args)
+
+        game = self.game_class(self.bot, rng=self.rng)
+        for i in range(player_count):
+            act("handle_join", "P{}".format(i))
+        act("handle_start", game.players[0], " ".join(game_args))
+        if game.phase != AvalonGame.TeamSel:
+            raise SimulationError("Game with {} players and {} could not be started.".format(player_count, ", ".join(game_args) or "no game arguments"))
+
+        policy = dict(zip(game.players, self.seat_policies(player_count)))
+        for p in set(policy.values()):
+            p.new_game(game)
+
+        rng = self.rng
+        for step in range(self.max_steps):
+            phase = game.phase
+            if phase == AvalonGame.Finished:
+                break
+            elif phase == AvalonGame.TeamSel:
+                leader = game.get_teamsel_player()
+                act("handle_team", leader, " ".join(policy[leader].propose_team(game, leader, rng)))
+            elif phase == AvalonGame.TeamVote:
+                for player in game.players:
+                    act("handle_accept_reject", player, policy[player].vote_team(game, player, rng))
+            elif phase == AvalonGame.QuestVote:
+                team = list(game.team)
+                for player in team:
+                    fail = game.get_role(player).evil and policy[player].play_quest(game, player, rng)
+                    act("handle_success_fail", player, fail)
+                success = game.quest_results[-1]
+                for p in set(policy.values()):
+                    p.observe_quest(game, team, success)
+            elif phase == AvalonGame.Assassination:
+                assassin = game.get_assassin()
+                act("handle_kill", assassin, policy[assassin].choose_kill(game, assassin, rng))
+            if game.phase == phase:
+                raise SimulationError("Game did not advance in phase {}.".format(phase))
+        else:
+            raise SimulationError("Game did not finish after {} steps.".format(self.max_steps))
+
+        return GameResult(game.winner, game.quest_results, [r.short_name for r in game.roles])
+
+    def run(self, games, player_count, game_args=()):
+        good_wins = 0
+        start = time.perf_counter()
+        for i in range(games):
+            if self.play(player_count, game_args).winner == AvalonGame.Good:
+                good_wins += 1
+        elapsed = time.perf_counter() - start
+        return SimulationReport(games, good_wins, games - good_wins, elapsed)
+
+
+policy_classes = {
+    "random": RandomPolicy,
+    "heuristic": HeuristicPolicy,
+}
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Simulate games of Avalon.")
+    parser.add_argument("--games", type=int, default=10000)
+    parser.add_argument("--players", type=int, default=5, choices=sorted(AvalonGame.game_plans))
+    parser.add_argument("--policy", default="heuristic", choices=sorted(policy_classes))
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--format-messages", action="store_true", help="build all messages like a real game")
+    parser.add_argument("game_args", nargs="*", metavar="game_arg", help=", ".join(AvalonGame.valid_game_args))
+    args = parser.parse_args()
+
+    sim = Simulator(policy_classes[args.policy](), seed=args.seed, format_messages=args.format_messages)
+    print(sim.run(args.games, args.players, args.game_args))
+
+
+if __name__ == "__main__":
+    main()
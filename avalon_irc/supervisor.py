@@ -0,0 +1,243 @@
+"""Run the bot for many channels in several worker processes.
+
+    avalon-irc-supervisor <server[:port]> <channel>[,<channel>...] <nickname> [--channels-file FILE]
+
+Channels are spread over worker processes of at most --channels-per-worker
+channels. Every worker runs its own AvalonBot with its own IRC connection,
+the first one as <nickname>, the others as <nickname>1, <nickname>2, ...
+All workers share the SQLite highscore database, whose commits only add
+to the rows of the players involved, the game log directory, in which
+each channel has its own file, and the game history, which is appended
+to under a file lock. !highscore, !rank and !rating in one worker include
+the games finished in the others, found in the results table. A worker that exits is restarted and
+recovers the running games of its channels from the game logs.
+
+On SIGHUP the channels file (one channel per line) is read again. New
+channels are passed to a worker with room left, or to a new worker, while
+all other channels keep running. SIGUSR1 is passed on to the workers,
+which then take a profile, see AvalonBot.start_profile().
+"""
+
+import multiprocessing
+import os
+import signal
+import sys
+import time
+
+from .cli import parse_server
+
+
+def run_worker(server, port, nickname, channels, conn, highscore_filename, game_log_dir, history_dir,
+        metrics_port=None, admins=(), profile_dir="profiles", trace_filename=None):
+    """Worker process: run one AvalonBot, add channels received on conn."""
+    from .bot import AvalonBot
+
+    # The supervisor stops workers with SIGTERM, which ends AvalonBot.run() like
+    # Ctrl-C. SIGINT from the terminal reaches the supervisor, not the workers.
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    signal.signal(signal.SIGUSR1, signal.SIG_IGN) # until AvalonBot.run() handles it
+    bot = AvalonBot(channels, nickname, server, port, highscore_filename=highscore_filename,
+        game_log_dir=game_log_dir, history_dir=history_dir, metrics_port=metrics_port,
+        admins=admins, profile_dir=profile_dir, trace_filename=trace_filename)
+
+    def on_command():
+        try:
+            command, channel = conn.recv()
+        except EOFError:
+            bot.loop.remove_reader(conn.fileno())
+            return
+        if command == "join":
+            bot.join_channel(channel)
+
+    bot.loop.add_reader(conn.fileno(), on_command)
+    bot.run()
+
+
+class Worker:
+    def __init__(self, index, nickname):
+        self.index = index
+        self.nickname = nickname
+        self.channels = []
+        self.process = None
+        self.conn = None
+        self.started_at = 0
+        self.exited_at = None
+        self.restart_delay = 0
+
+
+class Supervisor:
+    # Restart delay after a worker crashed shortly after its start, doubled
+    # on every further crash up to max_restart_delay.
+    min_uptime = 30
+    restart_delay = 1
+    max_restart_delay = 60
+
+    def __init__(self, server, port, nickname, channels_per_worker=20, highscore_filename="highscore.db",
+            game_log_dir="games", history_dir="history", metrics_port=None, admins=(), profile_dir="profiles",
+            trace_filename=None, clock=time.monotonic):
+        if highscore_filename.endswith(".json"):
+            raise ValueError("Workers can only share an SQLite highscore, not {}.".format(highscore_filename))
+        self.server = server
+        self.port = port
+        self.nickname = nickname
+        self.channels_per_worker = channels_per_worker
+        self.highscore_filename = highscore_filename
+        self.game_log_dir = game_log_dir
+        self.history_dir = history_dir
+        self.metrics_port = metrics_port # worker i serves its metrics on metrics_port + i
+        self.admins = list(admins)
+        self.profile_dir = profile_dir
+        self.trace_filename = trace_filename # worker i traces to <root>-<i><ext>
+        self.clock = clock
+        self.workers = []
+        self.channels = set() # lowercased channels assigned to a worker
+
+    def worker_nickname(self, index):
+        return self.nickname if index == 0 else "{}{}".format(self.nickname, index)
+
+    def add_channel(self, channel):
+        """Assign channel to a worker with room left or to a new worker.
+        Return the worker, or None if the channel is already assigned."""
+        if channel.lower() in self.channels:
+            return None
+        self.channels.add(channel.lower())
+        for worker in self.workers:
+            if len(worker.channels) < self.channels_per_worker:
+                worker.channels.append(channel)
+                if worker.process is not None:
+                    try:
+                        worker.conn.send(("join", channel))
+                    except OSError:
+                        pass # Worker has exited, the channel is joined on restart.
+                return worker
+        worker = Worker(len(self.workers), self.worker_nickname(len(self.workers)))
+        worker.channels.append(channel)
+        self.workers.append(worker)
+        return worker
+
+    def add_channels(self, channels):
+        for channel in channels:
+            self.add_channel(channel)
+        self.start_workers()
+
+    def start_workers(self):
+        for worker in self.workers:
+            if worker.process is None:
+                self.start(worker)
+
+    def start(self, worker):
+        if worker.conn is not None:
+            worker.conn.close()
+        parent_conn, child_conn = multiprocessing.Pipe()
+        worker.conn = parent_conn
+        metrics_port = None if self.metrics_port is None else self.metrics_port + worker.index
+        trace_filename = None
+        if self.trace_filename:
+            root, ext = os.path.splitext(self.trace_filename)
+            trace_filename = "{}-{}{}".format(root, worker.index, ext)
+        worker.process = multiprocessing.Process(target=run_worker, name="avalon-worker-{}".format(worker.index),
+            args=(self.server, self.port, worker.nickname, list(worker.channels), child_conn,
+                self.highscore_filename, self.game_log_dir, self.history_dir, metrics_port,
+                self.admins, self.profile_dir, trace_filename))
+        worker.process.start()
+        child_conn.close() # the worker has its copy, a dead worker then breaks the pipe
+        worker.started_at = self.clock()
+        worker.exited_at = None
+        print("Started worker {} ({}) for {}.".format(worker.index, worker.nickname, ", ".join(worker.channels)))
+
+    def check_workers(self):
+        """Restart workers that have exited. Called periodically."""
+        now = self.clock()
+        for worker in self.workers:
+            if worker.process is None or worker.process.is_alive():
+                continue
+            if worker.exited_at is None:
+                print("Worker {} exited with code {}.".format(worker.index, worker.process.exitcode))
+                worker.exited_at = now
+                if now - worker.started_at < self.min_uptime:
+                    worker.restart_delay = min(max(worker.restart_delay * 2, self.restart_delay), self.max_restart_delay)
+                else:
+                    worker.restart_delay = 0
+            if now - worker.exited_at >= worker.restart_delay:
+                self.start(worker)
+
+    def signal_workers(self, signum):
+        for worker in self.workers:
+            if worker.process is not None and worker.process.is_alive():
+                os.kill(worker.process.pid, signum)
+
+    def stop(self):
+        for worker in self.workers:
+            if worker.process is not None and worker.process.is_alive():
+                worker.process.terminate()
+        for worker in self.workers:
+            if worker.process is not None:
+                worker.process.join()
+
+
+def read_channels_file(filename):
+    with open(filename, "r") as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith("#")]
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run the Avalon bot in several worker processes.")
+    parser.add_argument("server", metavar="server[:port]")
+    parser.add_argument("channels", metavar="channel[,channel...]")
+    parser.add_argument("nickname")
+    parser.add_argument("--channels-file", help="more channels, one per line, read again on SIGHUP")
+    parser.add_argument("--channels-per-worker", type=int, default=20)
+    parser.add_argument("--highscore", default="highscore.db", help="SQLite highscore database")
+    parser.add_argument("--game-log-dir", default="games")
+    parser.add_argument("--history-dir", default="history")
+    parser.add_argument("--metrics-port", type=int, help="serve the metrics of worker i on this port + i")
+    parser.add_argument("--admin", action="append", default=[], metavar="MASK",
+        help="nick!user@host mask allowed to send !profile, may be repeated")
+    parser.add_argument("--profile-dir", default="profiles")
+    parser.add_argument("--trace-file", help="JSON lines file of traces, worker i writes traces-i.jsonl for traces.jsonl")
+    args = parser.parse_args()
+
+    try:
+        server, port = parse_server(args.server)
+    except ValueError:
+        print("Error: Erroneous port.")
+        sys.exit(1)
+    try:
+        supervisor = Supervisor(server, port, args.nickname, args.channels_per_worker, args.highscore, args.game_log_dir,
+            args.history_dir, args.metrics_port, args.admin, args.profile_dir,
+            args.trace_file)
+    except ValueError as e:
+        print("Error: {}".format(e))
+        sys.exit(1)
+
+    channels = [c for c in args.channels.split(",") if c]
+    if args.channels_file:
+        channels += read_channels_file(args.channels_file)
+    supervisor.add_channels(channels)
+
+    reload_requested = []
+    signal.signal(signal.SIGHUP, lambda signum, frame: reload_requested.append(True))
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    signal.signal(signal.SIGUSR1, lambda signum, frame: supervisor.signal_workers(signum))
+    try:
+        while True:
+            time.sleep(1)
+            if reload_requested and args.channels_file:
+                reload_requested.clear()
+                try:
+                    supervisor.add_channels(read_channels_file(args.channels_file))
+                except OSError as e:
+                    print("Error: {}".format(e))
+            supervisor.check_workers()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        supervisor.stop()
+
+
+if __name__ == "__main__":
+    main()
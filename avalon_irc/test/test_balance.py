@@ -0,0 +1,21 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from ..balance import simulate, check_against_engine, role_setup
+
+
+def test_simulate_counts():
+    report = simulate(7, ["mordred", "oberon"], 20000, seed=1, batch_size=7000)
+    assert report.games == 20000
+    assert sum(report.evil_wins_by_reason.values()) == report.evil_wins
+    assert sum(report.good_wins_by_reason.values()) == 20000 - report.evil_wins
+
+def test_invalid_configuration():
+    with pytest.raises(ValueError):
+        role_setup(5, ["morgana"])
+
+@pytest.mark.parametrize("player_count,game_args", [(5, []), (8, ["percival", "morgana"]), (10, ["mordred", "oberon"])])
+def test_matches_engine(player_count, game_args):
+    engine_rate, vectorized_rate, z = check_against_engine(player_count, game_args, 2000, seed=5)
+    assert abs(z) < 4
@@ -0,0 +1,138 @@
+import asyncio
+
+import pytest
+
+from ..bot import AvalonBot
+from ..game import AvalonGame
+from ..highscore import Highscore
+
+
+class RecordingBot(AvalonBot):
+    def __init__(self, *args, **kwargs):
+        AvalonBot.__init__(self, *args, **kwargs)
+        self.sent = []
+
+    def send_pubmsg(self, channel, msg):
+        self.sent.append((channel, msg))
+
+    def send_privmsg(self, nick, msg):
+        self.sent.append((nick, msg))
+
+    def send_privmsgs(self, messages):
+        self.sent.extend(messages)
+
+
+def pubmsg(bot, nick, channel, msg):
+    bot.loop.run_until_complete(bot.process_pubmsg(nick, channel, msg))
+
+def privmsg(bot, nick, msg):
+    bot.loop.run_until_complete(bot.process_privmsg(nick, msg))
+
+@pytest.fixture
+def bot(tmp_path):
+    bot = RecordingBot(["#a", "#b"], "Avalon", "localhost", highscore_filename=str(tmp_path / "highscore.db"),
+        game_log_dir=str(tmp_path / "games"), history_dir=str(tmp_path / "history"))
+    yield bot
+    bot.highscore.close()
+    bot.close_files()
+    bot.loop.close()
+
+def test_games_per_channel(bot):
+    pubmsg(bot, "alice", "#a", "!join")
+    pubmsg(bot, "bob", "#B", "!join")
+
+    assert bot.games["#a"].players == ["alice"]
+    assert bot.games["#b"].players == ["bob"]
+    assert bot.player_games["alice"] is bot.games["#a"]
+    assert bot.sent == [("#a", "Players registered: alice"), ("#b", "Players registered: bob")]
+
+def test_join_second_channel_rejected(bot):
+    pubmsg(bot, "alice", "#a", "!join")
+    pubmsg(bot, "alice", "#b", "!join")
+
+    assert bot.games["#b"].players == []
+    assert bot.player_games["alice"] is bot.games["#a"]
+
+def test_leave_unregisters(bot):
+    pubmsg(bot, "alice", "#a", "!join")
+    pubmsg(bot, "alice", "#a", "!leave")
+    assert "alice" not in bot.player_games
+
+def test_privmsg_routed_to_players_game(bot):
+    for i in range(5):
+        pubmsg(bot, "p{}".format(i), "#b", "!join")
+    pubmsg(bot, "p0", "#b", "!start")
+    assert bot.games["#b"].phase == AvalonGame.TeamSel
+    bot.sent = []
+
+    privmsg(bot, "p3", "identify")
+    assert len(bot.sent) == 1 and bot.sent[0][0] == "p3"
+    assert bot.sent[0][1].startswith("You are ")
+
+    privmsg(bot, "stranger", "identify")
+    assert bot.sent[-1][0] == "stranger"
+
+def test_highscore_written_behind(bot, tmp_path):
+    bot.highscore.update(["alice"], ["bob"])
+    assert bot.highscore.data["alice"] == {"won":1, "lost":0}
+    bot.highscore.flush()
+    assert bot.highscore.writer.lag() == 0
+    assert Highscore(str(tmp_path / "highscore.db")).data["alice"] == {"won":1, "lost":0}
+
+def test_finished_game_in_history(bot):
+    for i in range(5):
+        pubmsg(bot, "p{}".format(i), "#a", "!join")
+    pubmsg(bot, "p0", "#a", "!start")
+    game = bot.games["#a"]
+    for i in range(5):
+        game.handle_deadline() # The leader does not choose, five failed votes.
+    assert game.phase == AvalonGame.Finished
+    bot.check_finish(game)
+    bot.wait_for_disk()
+    assert len(bot.history) == 1
+
+    evil = game.get_role("p0").evil
+    pubmsg(bot, "p1", "#a", "!stats p0")
+    assert bot.sent[-1] == ("#a", "p0: won {} of 1 games ({}); as {} {} of 1; by role: {} {} of 1.".format(
+        int(evil), "100%" if evil else "0%", "Evil" if evil else "Good", int(evil), game.get_role("p0").long_name, int(evil)))
+
+def test_games_use_nick_after_fallback(bot):
+    bot.connection.connected = True
+    bot.connection.real_nickname = "Avalon_" # set by the welcome after on_nicknameinuse
+    try:
+        for i in range(5):
+            pubmsg(bot, "p{}".format(i), "#a", "!join")
+        pubmsg(bot, "p0", "#a", "!start")
+        game = bot.games["#a"]
+        pubmsg(bot, game.get_teamsel_player(), "#a", "!team p0 p1")
+        assert '"/msg Avalon_ accept"' in bot.sent[-1][1]
+    finally:
+        bot.connection.connected = False
+
+def test_messages_held_until_welcome(tmp_path, capsys):
+    bot = AvalonBot(["#a"], "Avalon", "localhost", highscore_filename=str(tmp_path / "highscore.db"),
+        game_log_dir=str(tmp_path / "games"), history_dir=str(tmp_path / "history"))
+    try:
+        sender = bot.loop.create_task(bot.outbound.run())
+        # A deadline of a recovered game can fire while connect_forever() still retries.
+        bot.send_pubmsg("#a", "Time is up.")
+        bot.loop.run_until_complete(asyncio.sleep(0.01))
+        assert bot.outbound.depth == 1
+
+        # A line that cannot be sent is lost, but the sender keeps running.
+        bot.outbound.release()
+        bot.loop.run_until_complete(asyncio.sleep(0.01))
+        assert bot.outbound.depth == 0 and not sender.done()
+        assert "Traceback" in capsys.readouterr().err
+
+        sent = []
+        bot.outbound.send_line = lambda target, line: sent.append((target, line))
+        bot.send_pubmsg("#a", "Welcome back.")
+        bot.loop.run_until_complete(asyncio.sleep(0.01))
+        assert sent == [("#a", "Welcome back.")]
+        sender.cancel()
+        bot.loop.run_until_complete(asyncio.gather(sender, return_exceptions=True))
+    finally:
+        bot.highscore.close()
+        bot.close_files()
+        bot.loop.close()
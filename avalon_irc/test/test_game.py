@@ -1,9 +1,16 @@
 import pytest
+import random
 import re
 
+from ..benchmark import bench_status
 from ..game import AvalonGame
+from ..gamelog import replay
+from ..simulator import NullHighscore
+from ..timers import TimerWheel
 
 class DummyBot:
+    nickname = "Avalon"
+
     def __init__(self):
         self.pubmsg_queue=[]
         self.privmsg_queue=[]
@@ -16,6 +23,10 @@ class DummyBot:
     def send_privmsg(self, nick, msg):
         """Send private message to one player. For use by AvalonGame class."""
         self.privmsg_queue.append((nick, msg))
+
+    def send_privmsgs(self, messages):
+        """Send a batch of (nick, message) private messages. For use by AvalonGame class."""
+        self.privmsg_queue.extend(messages)
         
     def assert_messages(self, pubmsgs=[], privmsgs=[]):
         """pubmsgs must be a list of regular expressions. The first matching
@@ -86,6 +97,165 @@ def test_game():
     #g.handle_pubmsg("Player5", "!join")
     #g.handle_pubmsg("Player1", "!start")
 
+def test_team_vote_messages():
+    gt = GameTester()
+    gt.game.rng = random.Random(0)
+    gt.join_count(5)
+    gt.start("!start")
+    gt.bot.pubmsg_queue = []
+    gt.bot.privmsg_queue = []
+
+    leader = gt.game.get_teamsel_player()
+    gt.game.handle_pubmsg(leader, "!team Player1 Player1")
+    gt.bot.assert_messages(pubmsgs=["^{}: Team must consist of valid players.$".format(leader)])
+
+    gt.game.handle_pubmsg(leader, "!team Player3 Player1")
+    gt.bot.assert_messages(pubmsgs=["^{} has chosen the following team: Player3, Player1.".format(leader)])
+
+    gt.game.handle_privmsg("Player2", "reject")
+    gt.bot.assert_messages(pubmsgs=["^Player2 has voted. Missing votes from Player0, Player1, Player3, Player4.$"],
+        privmsgs=[("Player2", "^Vote cast.$")])
+    gt.game.handle_privmsg("Player2", "accept")
+    gt.bot.assert_messages(privmsgs=[("Player2", "^Double vote ignored.$")])
+    gt.game.handle_privmsg("Stranger", "accept")
+    gt.bot.assert_messages(privmsgs=[("Stranger", "^Not eligible for vote.$")])
+
+    for player in ["Player4", "Player0", "Player1"]:
+        gt.game.handle_privmsg(player, "accept")
+    gt.game.handle_privmsg("Player3", "reject")
+    assert gt.game.phase == AvalonGame.QuestVote
+    assert "Player4, Player0, Player1 voted to accept the team. Player2, Player3 voted to reject the team." in gt.bot.pubmsg_queue[-1]
+    gt.bot.pubmsg_queue = []
+    gt.bot.privmsg_queue = []
+
+    gt.game.handle_privmsg("Player0", "success")
+    gt.bot.assert_messages(privmsgs=[("Player0", "^Not eligible for vote.$")])
+    gt.game.handle_privmsg("Player1", "success")
+    gt.bot.assert_messages(pubmsgs=["^Player1 has voted. Missing votes from Player3.$"],
+        privmsgs=[("Player1", "^Vote cast.$")])
+
+def test_role_knowledge():
+    gt = GameTester()
+    gt.game.rng = random.Random(1)
+    gt.join_count(10)
+    gt.start("!start percival mordred oberon morgana")
+    game = gt.game
+    role_msgs = dict(gt.bot.privmsg_queue)
+    assert len(role_msgs) == 10
+
+    def with_role(*short_names):
+        return [p for p in game.players if game.get_role(p).short_name in short_names]
+
+    merlin = with_role("merlin")[0]
+    assert role_msgs[merlin].endswith("The Minions of Mordred are {}.".format(", ".join(with_role("assassin", "morgana"))))
+    percival = with_role("percival")[0]
+    assert role_msgs[percival].endswith("{} are Merlin.".format(" and ".join(with_role("merlin", "morgana"))))
+    oberon = with_role("oberon")[0]
+    assert role_msgs[oberon].endswith("You have no knowledge of other identities.")
+    mordred = with_role("mordred")[0]
+    fellows = [p for p in with_role("assassin", "morgana", "mordred") if p != mordred]
+    assert role_msgs[mordred].endswith("Your fellow Minions of Mordred are {}.".format(", ".join(fellows)))
+
+    gt.bot.pubmsg_queue = []
+    gt.bot.privmsg_queue = []
+    game.handle_privmsg(percival, "identify")
+    gt.bot.assert_messages(privmsgs=[(percival, "^" + re.escape(role_msgs[percival]) + "$")])
+
+def test_start_rejected_early():
+    gt = GameTester()
+    gt.join_count(5)
+    gt.start("!start morgana")
+    gt.bot.assert_messages(pubmsgs=["^Player0: Invalid combination of roles: Morgana can only be played together with Percival. Type !start help"])
+    assert gt.game.phase == AvalonGame.Assemble and gt.game.roles == [] and gt.game.game_args == []
+
+    gt.start("!start mordred oberon")
+    gt.bot.assert_messages(pubmsgs=["^Player0: Too many optional roles for 5 players, there are 3 good and 2 evil players."])
+
+    gt.start("!start help")
+    gt.bot.assert_messages(pubmsgs=["^Player0: Options for 5 players: none; percival; mordred; oberon; percival mordred; percival oberon; percival morgana.$"])
+
+def test_plan_roles_cached():
+    plan = AvalonGame.plan_roles(7, ["morgana", "percival"])
+    assert AvalonGame.plan_roles(7, ["percival", "morgana"]) is plan
+    assert sorted(role.short_name for role in plan.role_classes) == ["assassin", "merlin", "minion", "morgana", "percival", "servant", "servant"]
+    assert AvalonGame.plan_roles(4, []).reason == "At least five players are required to start."
+
+def test_status_lines_cached():
+    game = AvalonGame(DummyBot())
+    game.players = ["a", "b", "c", "d", "e", "f", "g"]
+    for quest_results in bench_status.quest_states():
+        game.quest_results = quest_results
+        assert game.quest_overview_str() == bench_status.uncached_quest_overview_str(game)
+    assert game.quest_overview_str() is game.quest_overview_str()
+    assert "Quest 4 (team of 4, two fail votes required to fail): undecided" in AvalonGame.make_quest_overview_str(7, ())
+
+    for game in bench_status.started_games():
+        # Roles are listed in the order of the role plan instead of the seats.
+        roles_in_play = lambda s: [sorted(side.split(", ")) for side in re.findall(r"in play: ([^.]*)\.", s)]
+        assert roles_in_play(game.roles_str()) == roles_in_play(bench_status.uncached_roles_str(game))
+        assert game.roles_str() is AvalonGame.roles_strs[game.role_classes]
+
+def test_phase_deadlines():
+    class Clock:
+        now = 0.0
+        def __call__(self):
+            return self.now
+    clock = Clock()
+    wheel = TimerWheel(clock=clock)
+
+    def expire(seconds):
+        for i in range(seconds):
+            clock.now += 1
+            wheel.advance()
+
+    gt = GameTester()
+    gt.bot.schedule = wheel.schedule
+    gt.bot.highscore = NullHighscore()
+    game = gt.game
+    game.rng = random.Random(0)
+    game.timeouts = {AvalonGame.TeamSel: 100, AvalonGame.TeamVote: 100, AvalonGame.QuestVote: 100, AvalonGame.Assassination: 100}
+    game.log = []
+    gt.join_count(5)
+    gt.start("!start")
+    assert len(wheel) == 1
+    gt.bot.pubmsg_queue = []
+    gt.bot.privmsg_queue = []
+
+    # Idle leader: reminder, then the next player selects.
+    leader = game.get_teamsel_player()
+    expire(40)
+    gt.bot.assert_messages(pubmsgs=["^{}: Please choose a team with !team. The next player selects the team in 60 seconds.$".format(leader)])
+    expire(60)
+    assert game.get_teamsel_player() != leader and game.failed_votes == 1
+    assert gt.bot.pubmsg_queue[0] == "{} did not choose a team in time.".format(leader)
+    assert len(wheel) == 1
+
+    # Missing team votes count as reject.
+    gt.game.handle_pubmsg(game.get_teamsel_player(), "!team Player0 Player1")
+    for player in ["Player0", "Player1"]:
+        game.handle_privmsg(player, "accept")
+    gt.bot.pubmsg_queue = []
+    expire(100)
+    assert gt.bot.pubmsg_queue[0].startswith("Waiting for team votes from Player2, Player3, Player4.")
+    assert "Missing votes from Player2, Player3, Player4 count as reject." in gt.bot.pubmsg_queue
+    assert game.phase == AvalonGame.TeamSel and game.failed_votes == 2
+    assert len(wheel) == 1
+
+    # Missing quest votes count as success.
+    gt.game.handle_pubmsg(game.get_teamsel_player(), "!team Player0 Player1")
+    for player in game.players:
+        game.handle_privmsg(player, "accept")
+    assert game.phase == AvalonGame.QuestVote
+    expire(100)
+    assert game.quest_results == [True] and game.phase == AvalonGame.TeamSel
+
+    # The recorded deadlines replay to the same state.
+    replayed = replay(game.log)
+    assert (replayed.phase, replayed.quest_results, replayed.teamsel_player_idx) == (game.phase, game.quest_results, game.teamsel_player_idx)
+
+    # Ending the game cancels the deadline.
+    game.end_game(AvalonGame.Good)
+    assert len(wheel) == 0
 
 if __name__=="__main__":
-    test_game()
\ No newline at end of file
+    test_game()
@@ -0,0 +1,76 @@
+import time
+
+from ..game import AvalonGame
+from ..gamelog import GameLogStore, replay
+from .test_bot import RecordingBot, pubmsg, privmsg
+
+
+def new_bot(tmp_path):
+    return RecordingBot(["#a"], "Avalon", "localhost", highscore_filename=str(tmp_path / "highscore.db"),
+        game_log_dir=str(tmp_path / "games"), history_dir=str(tmp_path / "history"))
+
+def play_first_quest(bot):
+    for i in range(5):
+        pubmsg(bot, "p{}".format(i), "#a", "!join")
+    pubmsg(bot, "p0", "#a", "!start percival morgana")
+    game = bot.games["#a"]
+    leader = game.get_teamsel_player()
+    pubmsg(bot, leader, "#a", "!team p0 p1")
+    for i in range(5):
+        privmsg(bot, "p{}".format(i), "accept")
+    privmsg(bot, "p0", "success")
+    return game
+
+def test_recover_after_restart(tmp_path):
+    bot = new_bot(tmp_path)
+    game = play_first_quest(bot)
+    bot.game_logs.flush()
+    bot.loop.close()
+
+    bot = new_bot(tmp_path)
+    recovered = bot.games["#a"]
+    assert bot.sent == []
+    assert recovered.phase == game.phase == AvalonGame.QuestVote
+    assert recovered.players == game.players
+    assert [role.short_name for role in recovered.roles] == [role.short_name for role in game.roles]
+    assert recovered.team == game.team
+    assert recovered.voted_mask == game.voted_mask
+    assert recovered.teamsel_player_idx == game.teamsel_player_idx
+    assert bot.player_games["p3"] is recovered
+
+    # The recovered game goes on and keeps logging.
+    privmsg(bot, "p1", "success")
+    assert recovered.quest_results == game.quest_results + [True]
+    bot.game_logs.flush()
+    bot.loop.close()
+    assert new_bot(tmp_path).games["#a"].quest_results == recovered.quest_results
+
+def test_partial_line_ignored(tmp_path):
+    store = GameLogStore(str(tmp_path))
+    log = store.open("#a")
+    log.append(("j", "alice"))
+    log.flush()
+    with open(store.filename("#a"), "a") as f:
+        f.write('["j","bo')
+    assert store.load("#a") == [["j", "alice"]]
+    assert store.recover("#a").players == ["alice"]
+
+def test_finished_game_discarded(tmp_path):
+    bot = new_bot(tmp_path)
+    game = play_first_quest(bot)
+    game.end_game(AvalonGame.Good)
+    bot.check_finish(game)
+    bot.close_files()
+    bot.loop.close()
+    assert new_bot(tmp_path).games["#a"].players == []
+
+def test_replay_fast(tmp_path):
+    bot = new_bot(tmp_path)
+    play_first_quest(bot)
+    bot.game_logs.flush()
+    events = bot.game_logs.load("#a")
+    bot.loop.close()
+    start = time.perf_counter()
+    for i in range(100):
+        replay(events)
+    assert (time.perf_counter() - start) / 100 < 0.001
@@ -0,0 +1,234 @@
+import json
+import multiprocessing
+import os
+import threading
+import time
+
+import pytest
+
+from ..highscore import Highscore, HighscoreWriter
+
+
+@pytest.mark.parametrize("filename", ["highscore.json", "highscore.db"])
+def test_update_persists(tmp_path, filename):
+    hs = Highscore(str(tmp_path / filename))
+    hs.update(["alice", "bob"], ["carol"])
+    hs.update(["carol"], ["alice"])
+    assert not hs.dirty
+
+    reloaded = Highscore(str(tmp_path / filename))
+    assert reloaded.data == {
+        "alice": {"won":1, "lost":1},
+        "bob": {"won":1, "lost":0},
+        "carol": {"won":1, "lost":1},
+    }
+
+def test_json_migrated_to_sqlite(tmp_path):
+    with open(tmp_path / "highscore.json", "w") as f:
+        json.dump({"alice": {"won":3, "lost":2}}, f)
+
+    hs = Highscore(str(tmp_path / "highscore.db"))
+    assert hs.data == {"alice": {"won":3, "lost":2}}
+    assert not (tmp_path / "highscore.json").exists()
+    assert (tmp_path / "highscore.json.migrated").exists()
+
+    hs.update(["alice"], [])
+    assert Highscore(str(tmp_path / "highscore.db")).data["alice"] == {"won":4, "lost":2}
+
+def test_autosave_off_collects_results(tmp_path):
+    hs = Highscore(str(tmp_path / "highscore.db"), autosave=False)
+    hs.update(["alice"], ["bob"])
+    assert hs.dirty
+    assert Highscore(str(tmp_path / "highscore.db")).data == {}
+    hs.store.commit(hs.take_unsaved())
+    assert not hs.dirty
+    assert Highscore(str(tmp_path / "highscore.db")).data["bob"] == {"won":0, "lost":1}
+
+def test_ranking(tmp_path):
+    hs = Highscore(str(tmp_path / "highscore.db"))
+    hs.update(["alice", "bob"], ["carol"])
+    hs.update(["alice"], ["bob", "dave"])
+
+    assert hs.get_highscore_str() == "alice (won: 2, lost: 0), bob (won: 1, lost: 1), carol (won: 0, lost: 1), dave (won: 0, lost: 1)"
+    assert hs.get_highscore_str(2) == "alice (won: 2, lost: 0), bob (won: 1, lost: 1)"
+    assert hs.get_rank("alice") == (1, 4)
+    assert hs.get_rank("dave") == (3, 4)
+    assert hs.get_rank("erin") is None
+    assert hs.get_rank_str("bob") == "bob is ranked 2 of 4 (won: 1, lost: 1)."
+
+def test_ranking_matches_sort(tmp_path):
+    import random
+    rng = random.Random(1)
+    hs = Highscore(str(tmp_path / "highscore.json"), autosave=False)
+    players = ["p{}".format(i) for i in range(50)]
+    for i in range(300):
+        rng.shuffle(players)
+        hs.update(players[:3], players[3:6])
+
+    by_won = sorted(hs.data, key=lambda p: hs.data[p]["won"], reverse=True)
+    top = hs.ranking.top(len(players))
+    assert [hs.data[p]["won"] for p in top] == [hs.data[p]["won"] for p in by_won]
+    for player in players:
+        assert hs.get_rank(player)[0] == 1 + sum(1 for p in players if hs.data[p]["won"] > hs.data[player]["won"])
+
+class RecordingStore:
+    def __init__(self):
+        self.commits = []
+        self.failures = 0
+        self.proceed = threading.Event()
+        self.proceed.set()
+
+    def commit(self, results):
+        self.proceed.wait()
+        if self.failures:
+            self.failures -= 1
+            raise OSError("disk full")
+        self.commits.append(results)
+
+    def refresh(self):
+        return {}, {}
+
+@pytest.mark.parametrize("filename", ["highscore.json", "highscore.db"])
+def test_write_behind(tmp_path, filename):
+    hs = Highscore(str(tmp_path / filename), write_behind=True)
+    hs.update(["alice", "bob"], ["carol"])
+    hs.update(["carol"], ["alice"])
+    assert hs.data["alice"] == {"won":1, "lost":1}
+    assert hs.get_rank("carol") == (1, 3)
+    hs.close()
+    assert Highscore(str(tmp_path / filename)).data == hs.data
+    assert not (tmp_path / (filename + ".tmp")).exists()
+
+def test_writer_coalesces_burst():
+    store = RecordingStore()
+    store.proceed.clear()
+    writer = HighscoreWriter(store, delay=0)
+    writer.put((["a"], ["b"]))
+    # The first result is being committed, the burst behind it waits.
+    for i in range(10):
+        writer.put((["p{}".format(i)], ["q"]))
+    assert writer.lag() > 0
+    store.proceed.set()
+    assert writer.flush(timeout=5)
+    assert writer.lag() == 0
+    assert [len(results) for results in store.commits] in ([1, 10], [11])
+    writer.close()
+    assert not writer.thread.is_alive()
+
+def test_writer_retries_failed_commit():
+    store = RecordingStore()
+    store.failures = 1
+    writer = HighscoreWriter(store, delay=0)
+    writer.retry_delay = 0.01
+    lags = []
+    writer.on_commit = lambda results, seconds, lag: lags.append(lag)
+    writer.put((["a"], ["b"]))
+    assert writer.flush(timeout=5)
+    assert store.commits == [[(["a"], ["b"])]]
+    assert len(lags) == 1 and lags[0] > 0
+    writer.close()
+
+def test_close_commits_pending():
+    store = RecordingStore()
+    writer = HighscoreWriter(store, delay=60)
+    writer.put((["a"], ["b"]))
+    writer.close()
+    assert store.commits == [[(["a"], ["b"])]]
+
+def test_json_commit_retried_once(tmp_path, monkeypatch):
+    filename = str(tmp_path / "highscore.json")
+    hs = Highscore(filename, write_behind=True)
+    hs.writer.retry_delay = 0.01
+    fsync = os.fsync
+    failures = [OSError("disk full")]
+
+    def failing_fsync(fd):
+        if failures:
+            raise failures.pop()
+        fsync(fd)
+    monkeypatch.setattr(os, "fsync", failing_fsync)
+    hs.update(["alice"], ["bob"])
+    assert hs.writer.flush(timeout=5)
+    assert not failures
+    hs.close()
+    reloaded = Highscore(filename)
+    assert reloaded.data == {"alice": {"won":1, "lost":0}, "bob": {"won":0, "lost":1}}
+    assert reloaded.ratings == pytest.approx(hs.ratings)
+
+def test_close_does_not_hang_on_stuck_commit(capsys):
+    store = RecordingStore()
+    store.proceed.clear()
+    writer = HighscoreWriter(store, delay=0)
+    writer.put((["a"], ["b"]))
+    writer.put((["c"], ["d"]))
+    assert not writer.flush(timeout=0.05)
+    assert not writer.close(timeout=0.05)
+    assert writer.uncommitted() >= 1
+    assert capsys.readouterr().out.startswith("{} highscore results are not committed, the oldest waited ".format(
+        writer.uncommitted()))
+    store.proceed.set()
+    writer.thread.join(5)
+    assert writer.uncommitted() == 0
+
+@pytest.mark.parametrize("filename", ["highscore.json", "highscore.db"])
+def test_shared_by_processes(tmp_path, filename):
+    a = Highscore(str(tmp_path / filename))
+    b = Highscore(str(tmp_path / filename))
+    a.update(["alice"], ["bob"])
+    b.update(["bob", "carol"], ["alice"])
+    a.update(["alice"], ["carol"])
+
+    # Both results are in the file, neither commit overwrote the other.
+    assert Highscore(str(tmp_path / filename)).data == {
+        "alice": {"won":2, "lost":1},
+        "bob": {"won":1, "lost":1},
+        "carol": {"won":1, "lost":1},
+    }
+    assert a.get_rank_str("carol") == "carol is ranked 2 of 3 (won: 1, lost: 1)."
+    assert b.get_highscore_str() == "alice (won: 2, lost: 1), bob (won: 1, lost: 1), carol (won: 1, lost: 1)"
+    assert a.data == b.data
+    assert a.ratings == pytest.approx(b.ratings)
+    a.close()
+    b.close()
+
+@pytest.mark.parametrize("filename", ["highscore.json", "highscore.db"])
+def test_write_behind_refresh_does_not_wait_for_store(tmp_path, filename):
+    a = Highscore(str(tmp_path / filename))
+    b = Highscore(str(tmp_path / filename), write_behind=True)
+    b.writer.refresh_interval = 0.01
+    a.update(["alice"], ["bob"])
+    deadline = time.monotonic() + 5
+    while "alice" not in b.data and time.monotonic() < deadline:
+        b.refresh()
+        time.sleep(0.01)
+    assert b.data["alice"] == {"won":1, "lost":0}
+    assert b.ratings == pytest.approx(a.ratings)
+
+    # A commit of the writer thread holds the store lock, reading the
+    # highscore is served from what the thread fetched before.
+    with b.store.lock:
+        b.update(["bob"], ["alice"])
+        assert b.get_highscore_str() == "alice (won: 1, lost: 1), bob (won: 1, lost: 1)"
+        assert b.get_rank_str("bob") == "bob is ranked 1 of 2 (won: 1, lost: 1)."
+    a.close()
+    b.close()
+
+def play_games(filename, index, count):
+    hs = Highscore(filename, write_behind=True)
+    for i in range(count):
+        hs.update(["p{}".format(index)], ["q{}".format(i % 3)])
+    hs.close()
+
+@pytest.mark.parametrize("filename", ["highscore.json", "highscore.db"])
+def test_concurrent_commits_merged(tmp_path, filename):
+    filename = str(tmp_path / filename)
+    Highscore(filename).close() # create the database before the processes race for it
+    processes = [multiprocessing.Process(target=play_games, args=(filename, i, 25)) for i in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+        assert process.exitcode == 0
+    data = Highscore(filename).data
+    assert [data["p{}".format(i)]["won"] for i in range(4)] == [25] * 4
+    assert sum(data["q{}".format(i)]["lost"] for i in range(3)) == 100
@@ -0,0 +1,121 @@
+import random
+
+import pytest
+
+from ..game import AvalonGame
+from ..history import GameHistory
+from ..simulator import Simulator, RandomPolicy, SilentAvalonGame
+
+
+def finished_games(count, seed=0, pool_size=12):
+    """Return count finished games of random players from a pool of nicks."""
+    finished = []
+
+    class RecordingGame(SilentAvalonGame):
+        def end_game(self, winner):
+            SilentAvalonGame.end_game(self, winner)
+            finished.append(self)
+
+    sim = Simulator(RandomPolicy(), seed=seed)
+    sim.game_class = RecordingGame
+    rng = random.Random(seed)
+    pool = ["nick{}".format(i) for i in range(pool_size)]
+    for i in range(count):
+        sim.play(rng.randint(5, 10), rng.choice([[], ["percival"], ["mordred"]]))
+        finished[-1].players = rng.sample(pool, len(finished[-1].players))
+    return finished
+
+def expected_stats(games, nick):
+    played = wins = 0
+    roles = {}
+    for game in games:
+        if nick in game.players:
+            role = game.roles[game.players.index(nick)]
+            won = role.evil == (game.winner == AvalonGame.Evil)
+            played += 1
+            wins += won
+            games_won = roles.get(role.short_name, (0, 0))
+            roles[role.short_name] = (games_won[0] + 1, games_won[1] + won)
+    return played, wins, roles
+
+@pytest.fixture
+def history(tmp_path):
+    history = GameHistory(str(tmp_path / "history"))
+    yield history
+    history.close()
+
+def test_player_stats(history, tmp_path):
+    games = finished_games(200)
+    for game in games:
+        history.append(game, timestamp=0)
+    assert len(history) == 200
+
+    for nick in ["nick0", "nick7"]:
+        stats = history.player_stats(nick)
+        played, wins, roles = expected_stats(games, nick)
+        assert (stats.games, stats.wins, stats.role_stats) == (played, wins, roles)
+        assert stats.faction_stats[AvalonGame.Good][0] + stats.faction_stats[AvalonGame.Evil][0] == played
+        assert stats.merlin_survived <= stats.merlin_assassinations <= roles.get("merlin", (0, 0))[0]
+    assert history.player_stats("stranger") is None
+    assert history.get_stats_str("stranger") == "No games recorded for stranger."
+
+    game = games[-1]
+    proposals = history.proposals
+    last = len(proposals["game"]) - 1
+    assert proposals["game"].values()[last] == 199
+    assert proposals["team"].values()[last] == game.proposals[-1][1]
+    assert proposals["accepts"].values()[last] == game.proposals[-1][2]
+
+    reopened = GameHistory(str(tmp_path / "history"))
+    assert reopened.player_stats("nick0") == history.player_stats("nick0")
+    reopened.close()
+
+def test_shared_by_processes(history, tmp_path):
+    other = GameHistory(str(tmp_path / "history"))
+    games = finished_games(20, seed=1)
+    for idx, game in enumerate(games):
+        (history if idx % 2 else other).append(game)
+    for nick in ["nick1", "nick2"]:
+        assert history.player_stats(nick) == other.player_stats(nick)
+        assert history.player_stats(nick).games == expected_stats(games, nick)[0]
+    other.close()
+
+def test_interrupted_append_cut_off(tmp_path):
+    history = GameHistory(str(tmp_path / "history"))
+    games = finished_games(11, seed=2)
+    for game in games[:10]:
+        history.append(game)
+    expected = history.player_stats("nick3")
+
+    # Crash before the winner column of the last game was written.
+    history.append(games[10])
+    history.games["winner"].truncate(10)
+    history.close()
+
+    history = GameHistory(str(tmp_path / "history"))
+    assert len(history) == 10
+    assert len(history.seats["game"]) == sum(len(game.players) for game in games[:10])
+    assert history.player_stats("nick3") == expected
+    history.append(games[10])
+    assert history.player_stats("nick3").games == expected_stats(games, "nick3")[0]
+    history.close()
+
+def test_append_by_other_process_during_query(history, tmp_path):
+    other = GameHistory(str(tmp_path / "history"))
+    games = finished_games(6, seed=3)
+    nick = games[5].players[0]
+    for game in games[:5]:
+        history.append(game)
+    history.player_stats(nick) # map the columns
+
+    # The last game of a player is read while another process appends.
+    last_seat = history.last_seat
+    def last_seat_during_append(player_id):
+        if len(other) == 5:
+            other.append(games[5])
+        return last_seat(player_id)
+    history.last_seat = last_seat_during_append
+
+    stats = history.player_stats(nick)
+    assert stats.games == expected_stats(games, nick)[0]
+    other.close()
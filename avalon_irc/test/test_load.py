@@ -0,0 +1,10 @@
+import asyncio
+
+from ..benchmark.bench_load import load_test
+
+
+def test_load_test_plays_games():
+    stats, elapsed, cpu_seconds, max_rss = asyncio.run(load_test(tables=2, players=5, games=2, timeout=60))
+    assert stats.games == 4
+    assert len(stats.latencies) == stats.commands # every command was answered
+    assert max_rss > 0
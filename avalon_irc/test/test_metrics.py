@@ -0,0 +1,75 @@
+import asyncio
+
+from ..game import AvalonGame
+from ..metrics import Metrics, instrumented_game_class
+from .test_bot import RecordingBot, pubmsg
+
+
+def test_histogram_render():
+    metrics = Metrics()
+    histogram = metrics.histogram("latency_seconds", "Latency.", handler="a")
+    for value in [0.001, 0.003, 20]:
+        histogram.observe(value)
+    metrics.counter("done_total", "Done.").inc(2)
+    metrics.add_collector(lambda: [("depth", "Depth.", {"queue": 'a"b'}, 4)])
+
+    lines = metrics.render().splitlines()
+    assert lines[:2] == ["# HELP latency_seconds Latency.", "# TYPE latency_seconds histogram"]
+    assert 'latency_seconds_bucket{handler="a",le="0.0005"} 0' in lines
+    assert 'latency_seconds_bucket{handler="a",le="0.001"} 1' in lines
+    assert 'latency_seconds_bucket{handler="a",le="0.005"} 2' in lines
+    assert 'latency_seconds_bucket{handler="a",le="10"} 2' in lines
+    assert 'latency_seconds_bucket{handler="a",le="+Inf"} 3' in lines
+    assert 'latency_seconds_count{handler="a"} 3' in lines
+    assert "done_total 2" in lines
+    assert "# TYPE depth gauge" in lines
+    assert 'depth{queue="a\\"b"} 4' in lines
+
+def test_instrumented_game_class():
+    metrics = Metrics()
+    game_class = instrumented_game_class(AvalonGame, metrics)
+    assert issubclass(game_class, AvalonGame)
+    assert game_class.handle_team.__doc__ == AvalonGame.handle_team.__doc__
+    assert game_class.__slots__ == ()
+
+def test_bot_metrics(tmp_path):
+    bot = RecordingBot(["#a"], "Avalon", "localhost", highscore_filename=str(tmp_path / "highscore.db"),
+        game_log_dir=str(tmp_path / "games"), history_dir=str(tmp_path / "history"), metrics_port=0)
+    try:
+        for i in range(5):
+            pubmsg(bot, "p{}".format(i), "#a", "!join")
+        pubmsg(bot, "p0", "#a", "!start")
+        assert type(bot.games["#a"]) is bot.game_class
+
+        async def scrape():
+            server = await bot.metrics.start_server("127.0.0.1", 0)
+            reader, writer = await asyncio.open_connection("127.0.0.1", server.sockets[0].getsockname()[1])
+            writer.write(b"GET /metrics HTTP/1.0\r\n\r\n")
+            response = await reader.read()
+            writer.close()
+            server.close()
+            await server.wait_closed()
+            return response.decode()
+
+        response = bot.loop.run_until_complete(scrape())
+        assert response.startswith("HTTP/1.0 200 OK\r\n")
+        lines = response.split("\r\n\r\n", 1)[1].splitlines()
+        assert 'avalon_handler_seconds_count{handler="handle_join"} 5' in lines
+        assert 'avalon_handler_seconds_count{handler="handle_start"} 1' in lines
+        assert 'avalon_handler_seconds_count{handler="handle_pubmsg"} 6' in lines
+        assert 'avalon_games{phase="teamsel"} 1' in lines
+        assert 'avalon_games{phase="assemble"} 0' in lines
+        assert "avalon_players 5" in lines
+    finally:
+        bot.close_files()
+        bot.loop.close()
+
+def test_bot_without_metrics(tmp_path):
+    bot = RecordingBot(["#a"], "Avalon", "localhost", highscore_filename=str(tmp_path / "highscore.db"),
+        game_log_dir=str(tmp_path / "games"), history_dir=str(tmp_path / "history"))
+    try:
+        assert bot.metrics is None
+        assert type(bot.games["#a"]) is AvalonGame
+    finally:
+        bot.close_files()
+        bot.loop.close()
@@ -0,0 +1,85 @@
+import pytest
+
+from ..outbound import OutboundQueue, split_text
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+@pytest.fixture
+def sent():
+    return []
+
+@pytest.fixture
+def queue(clock, sent):
+    return OutboundQueue(lambda target, line: sent.append((target, line)), "Avalon", rate=1.0, burst=3, clock=clock)
+
+def drain(queue):
+    while queue.send_next() == 0:
+        pass
+
+def test_split_text():
+    assert split_text("abc def ghi", 9) == ("abc def", "ghi")
+    assert split_text("abcdefghi", 4) == ("abcd", "efghi")
+    # Never split inside a multi-byte character.
+    assert split_text("äää", 3) == ("ä", "ää")
+
+def test_consecutive_messages_merged(queue, sent):
+    queue.put("#avalon", "Quest 1 succeeded.")
+    queue.put("#avalon", "Alice now selects a team.")
+    drain(queue)
+    assert sent == [("#avalon", "Quest 1 succeeded. Alice now selects a team.")]
+    assert queue.depth == 0
+
+def test_line_length_from_prefix(queue, sent):
+    queue.set_prefix("Avalon!avalon@example.org")
+    limit = 512 - len(":Avalon!avalon@example.org PRIVMSG #avalon :\r\n")
+    queue.put("#avalon", "word " * 300)
+    drain(queue)
+    assert len(sent) == 3
+    for target, line in sent:
+        assert len(line.encode("utf-8")) <= limit
+    assert len(sent[0][1]) > limit - 5
+
+def test_public_before_private(queue, sent):
+    queue.put("alice", "Vote cast.")
+    queue.put("#avalon", "Alice has voted.")
+    drain(queue)
+    assert sent == [("#avalon", "Alice has voted."), ("alice", "Vote cast.")]
+
+def test_private_not_starved(queue, sent):
+    queue.put("alice", "Vote cast.")
+    for i in range(10):
+        queue.put("#avalon", "x" * 400)
+        queue.put("#other", "x" * 400)
+    queue.bucket.burst = queue.bucket.tokens = 100
+    drain(queue)
+    assert sent.index(("alice", "Vote cast.")) == queue.max_public_streak
+    assert len(sent) == 21
+
+def test_token_bucket_paces(queue, sent, clock):
+    for i in range(5):
+        queue.put("p{}".format(i), "Vote cast.")
+    drain(queue)
+    assert len(sent) == 3
+    assert queue.depth == 2
+    assert queue.send_next() == pytest.approx(1.0)
+
+    clock.now += 1.0
+    drain(queue)
+    assert len(sent) == 4
+    assert queue.stats()["latency_max"] == pytest.approx(1.0)
+
+def test_put_many(queue, sent):
+    queue.put_many([("alice", "You are Merlin."), ("bob", ""), ("carol", "You are Percival.")])
+    assert queue.depth == 2
+    drain(queue)
+    assert sent == [("alice", "You are Merlin."), ("carol", "You are Percival.")]
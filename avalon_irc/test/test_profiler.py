@@ -0,0 +1,68 @@
+import asyncio
+import time
+
+import irc.client
+
+from ..profiler import SamplingProfiler
+from .test_bot import RecordingBot
+
+
+def busy(seconds):
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        pass
+
+def test_sampling_profiler():
+    profiler = SamplingProfiler(interval=0.001)
+    profiler.start(10)
+    busy(0.2)
+    profiler.stop()
+
+    assert profiler.samples > 10
+    assert sum(profiler.stacks.values()) == profiler.samples
+    label = __name__ + ".busy"
+    top, count = profiler.collapsed()[0].rsplit(" ", 1)
+    assert top.split(";")[-2:] == [__name__ + ".test_sampling_profiler", label]
+    assert int(count) > 0
+
+    own, total = profiler.function_samples()
+    assert total[label] >= own[label] > profiler.samples / 2
+    summary = profiler.summary(modules=(__name__,))
+    assert "Hottest functions in {}:".format(__name__) in summary
+    assert label in summary
+
+def test_write(tmp_path):
+    profiler = SamplingProfiler()
+    profiler.sample()
+    collapsed, summary = profiler.write(str(tmp_path / "profiles" / "p"))
+    with open(collapsed) as f:
+        assert f.read().endswith(".test_write;avalon_irc.profiler.SamplingProfiler.sample 1\n")
+    with open(summary) as f:
+        assert f.readline().startswith("1 samples")
+
+def test_admin_profile_command(tmp_path):
+    bot = RecordingBot(["#a"], "Avalon", "localhost", highscore_filename=str(tmp_path / "highscore.db"),
+        game_log_dir=str(tmp_path / "games"), history_dir=str(tmp_path / "history"),
+        admins=["alice!*@admin.example"], profile_dir=str(tmp_path / "profiles"))
+    try:
+        def privmsg(source, msg):
+            bot.on_privmsg(bot.connection, irc.client.Event("privmsg", source, "Avalon", [msg]))
+            bot.loop.run_until_complete(asyncio.sleep(0))
+
+        privmsg("alice!a@elsewhere.example", "!profile 1")
+        assert bot.profiler is None
+        assert bot.sent == [("alice", "You are not registered for a game. Type !join in a game channel first.")]
+
+        bot.sent.clear()
+        privmsg("Alice!a@admin.example", "!profile 1")
+        assert bot.sent == [("Alice", "Profiling for 1 seconds.")]
+        privmsg("Alice!a@admin.example", "!profile")
+        assert bot.sent[-1] == ("Alice", "A profile is already being taken.")
+
+        bot.profiler.thread.join()
+        bot.loop.run_until_complete(asyncio.sleep(0))
+        assert bot.sent[-1][1].startswith("Profile written to ")
+        assert sorted(path.suffix for path in (tmp_path / "profiles").iterdir()) == [".collapsed", ".txt"]
+    finally:
+        bot.close_files()
+        bot.loop.close()
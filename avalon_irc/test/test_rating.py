@@ -0,0 +1,32 @@
+import pytest
+
+from ..highscore import Highscore
+from ..rating import EloRating
+
+
+def test_elo_update():
+    elo = EloRating(k=32, initial=1500)
+    ratings = {}
+    updated = elo.update(ratings, ["alice", "bob"], ["carol", "dave", "erin"])
+    assert updated == {"alice": 1516, "bob": 1516, "carol": 1484, "dave": 1484, "erin": 1484}
+    assert ratings == updated
+
+    # Beating a weaker team gains less.
+    change = elo.change(ratings, ["alice", "bob"], ["carol", "dave"])
+    assert 0 < change < 16
+    assert elo.change(ratings, ["carol", "dave"], ["alice", "bob"]) == pytest.approx(32 - change)
+    assert elo.change(ratings, ["alice"], []) == 0
+
+@pytest.mark.parametrize("filename", ["highscore.json", "highscore.db"])
+def test_ratings_persist(tmp_path, filename):
+    hs = Highscore(str(tmp_path / filename), autosave=False)
+    hs.update(["alice", "bob"], ["carol"])
+    hs.update(["carol"], ["alice"])
+    assert hs.get_rating("erin") is None
+    assert hs.get_rating_str("alice") == "alice has a rating of {:.0f} after 2 games.".format(hs.get_rating("alice"))
+    assert Highscore(str(tmp_path / filename)).ratings == {}
+
+    hs.save()
+    reloaded = Highscore(str(tmp_path / filename))
+    assert reloaded.ratings == pytest.approx(hs.ratings)
+    assert reloaded.data == hs.data
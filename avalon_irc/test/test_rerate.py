@@ -0,0 +1,44 @@
+import random
+import sqlite3
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from ..highscore import Highscore
+from ..rating import EloRating
+from ..rerate import load_results, encode, replay, replay_grid, recompute, write_ratings
+
+
+def random_results(count, seed=0):
+    rng = random.Random(seed)
+    players = ["p{}".format(i) for i in range(30)]
+    results = []
+    for i in range(count):
+        game = rng.sample(players, rng.randint(5, 10))
+        winner_count = rng.randint(2, len(game) - 2)
+        results.append((game[:winner_count], game[winner_count:]))
+    return results
+
+def test_recompute_matches_incremental(tmp_path):
+    filename = str(tmp_path / "highscore.db")
+    hs = Highscore(filename, autosave=False)
+    results = random_results(500)
+    for winners, losers in results:
+        hs.update(winners, losers)
+    hs.save()
+
+    assert load_results(filename) == results
+    assert recompute(results) == pytest.approx(hs.ratings)
+
+    write_ratings(filename, recompute(results, EloRating(k=16)))
+    assert Highscore(filename).ratings != pytest.approx(hs.ratings)
+
+def test_grid_matches_replay():
+    players, games = encode(random_results(300, seed=1))
+    grid = [EloRating(k, 1500, scale) for k in (8, 16, 32) for scale in (200, 400)]
+    ratings, losses = replay_grid(games, len(players), grid)
+    for column, rating in enumerate(grid):
+        expected_ratings, expected_loss = replay(games, len(players), rating)
+        assert ratings[:, column].tolist() == pytest.approx(expected_ratings)
+        assert losses[column] == pytest.approx(expected_loss)
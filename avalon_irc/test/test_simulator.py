@@ -0,0 +1,32 @@
+import pytest
+
+from ..game import AvalonGame
+from ..simulator import Simulator, RandomPolicy, ScriptedPolicy, HeuristicPolicy, SimulationError
+
+
+@pytest.mark.parametrize("player_count", sorted(AvalonGame.game_plans))
+@pytest.mark.parametrize("policy_class", [RandomPolicy, HeuristicPolicy])
+def test_games_finish(player_count, policy_class):
+    report = Simulator(policy_class(), seed=0).run(50, player_count, ["percival", "morgana"])
+    assert report.games == 50
+    assert report.good_wins + report.evil_wins == 50
+
+def test_seed_reproducible():
+    sim_a = Simulator(HeuristicPolicy(), seed=42)
+    sim_b = Simulator(HeuristicPolicy(), seed=42)
+    assert [sim_a.play(7) for i in range(20)] == [sim_b.play(7) for i in range(20)]
+
+def test_fast_path_plays_same_games():
+    silent = Simulator(RandomPolicy(), seed=3)
+    formatted = Simulator(RandomPolicy(), seed=3, format_messages=True)
+    assert [silent.play(8) for i in range(20)] == [formatted.play(8) for i in range(20)]
+
+def test_scripted_five_rejections():
+    sim = Simulator(ScriptedPolicy(votes=[False]*25), seed=0)
+    result = sim.play(5)
+    assert result.winner == AvalonGame.Evil
+    assert result.quest_results == []
+
+def test_invalid_configuration():
+    with pytest.raises(SimulationError):
+        Simulator(RandomPolicy(), seed=0).play(5, ["morgana"])
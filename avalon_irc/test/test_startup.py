@@ -0,0 +1,21 @@
+import pytest
+
+from ..benchmark import bench_startup
+
+
+@pytest.mark.parametrize("name", sorted(bench_startup.BUDGETS_MS))
+def test_no_heavy_imports(name):
+    modules = bench_startup.loaded_modules(bench_startup.COMMANDS[name])
+    assert "avalon_irc" in modules
+    for heavy in bench_startup.HEAVY_MODULES:
+        assert heavy not in modules
+
+
+def test_bot_imports_irc():
+    assert "irc.client" in bench_startup.loaded_modules(bench_startup.COMMANDS["import bot"])
+
+
+def test_startup_budget():
+    results = bench_startup.run(runs=3)
+    for name, budget in bench_startup.BUDGETS_MS.items():
+        assert results[name] < budget, "{} took {:.1f} ms, budget {} ms".format(name, results[name], budget)
@@ -0,0 +1,57 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from ..benchmark.ircserver import IRCServer
+from ..supervisor import Supervisor
+
+
+@pytest.fixture
+def server():
+    loop = asyncio.new_event_loop()
+    server = IRCServer()
+    port = loop.run_until_complete(server.start())
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    yield server
+    asyncio.run_coroutine_threadsafe(server.close(), loop).result()
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    loop.close()
+
+def wait_until(condition, timeout=20):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+
+def test_supervisor(server, tmp_path):
+    supervisor = Supervisor("127.0.0.1", server.port, "Avalon", channels_per_worker=2,
+        highscore_filename=str(tmp_path / "highscore.db"), game_log_dir=str(tmp_path / "games"),
+        history_dir=str(tmp_path / "history"))
+    supervisor.restart_delay = 0
+    try:
+        supervisor.add_channels(["#a", "#b", "#c"])
+        assert [w.channels for w in supervisor.workers] == [["#a", "#b"], ["#c"]]
+        wait_until(lambda: server.members("#b") == {"Avalon"} and server.members("#c") == {"Avalon1"})
+
+        # A new channel goes to the worker with room left, without a restart.
+        process = supervisor.workers[1].process
+        supervisor.add_channels(["#d", "#A"])
+        wait_until(lambda: server.members("#d") == {"Avalon1"})
+        assert supervisor.workers[1].process is process and len(supervisor.workers) == 2
+
+        # Crashed workers are restarted with all their channels.
+        process.kill()
+        process.join()
+        with pytest.raises(BrokenPipeError):
+            supervisor.workers[1].conn.send(("join", "#e"))
+        wait_until(lambda: not server.members("#c"))
+        supervisor.check_workers()
+        assert supervisor.workers[1].process is not process
+        wait_until(lambda: server.members("#c") == server.members("#d") == {"Avalon1"})
+    finally:
+        supervisor.stop()
+    assert all(w.process.exitcode == 0 for w in supervisor.workers)
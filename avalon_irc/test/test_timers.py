@@ -0,0 +1,41 @@
+from ..timers import TimerWheel
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+def test_timer_wheel():
+    clock = FakeClock()
+    wheel = TimerWheel(tick=1.0, size=8, clock=clock)
+    fired = []
+    wheel.schedule(2, lambda: fired.append("a"))
+    b = wheel.schedule(3, lambda: fired.append("b"))
+    wheel.schedule(20, lambda: fired.append("c")) # more than one round ahead
+    assert len(wheel) == 3
+
+    clock.now = 2.5
+    wheel.advance()
+    assert fired == ["a"]
+    b.cancel()
+    assert not b.active and len(wheel) == 1
+
+    clock.now = 19.9
+    wheel.advance()
+    assert fired == ["a"]
+    clock.now = 20
+    wheel.advance()
+    assert fired == ["a", "c"] and len(wheel) == 0
+
+def test_long_pause_fires_everything_due():
+    clock = FakeClock()
+    wheel = TimerWheel(tick=1.0, size=8, clock=clock)
+    fired = []
+    for delay in range(1, 30):
+        wheel.schedule(delay, lambda delay=delay: fired.append(delay))
+    clock.now = 100
+    wheel.advance()
+    assert sorted(fired) == list(range(1, 30))
@@ -0,0 +1,41 @@
+import pytest
+
+from ..simulator import Simulator, SimulationError
+from ..tournament import Tournament, run_shard, Shard
+
+
+def test_shard_deterministic():
+    shard = Shard(7, ["mordred"], 3, 20)
+    assert run_shard(shard, "random", 1) == run_shard(shard, "random", 1)
+    assert run_shard(shard, "random", 1) != run_shard(shard, "random", 2)
+
+def test_invalid_configuration_skipped(monkeypatch):
+    shard = Shard(5, ["mordred", "morgana", "oberon"], 0, 20)
+    assert run_shard(shard, "random", 1) == (shard, None)
+
+    # Errors of the engine are not taken for an invalid configuration.
+    def play(self, player_count, game_args=(), actions=None):
+        raise SimulationError("Game did not advance in phase 1.")
+    monkeypatch.setattr(Simulator, "play", play)
+    with pytest.raises(SimulationError):
+        run_shard(Shard(7, ["mordred"], 0, 20), "random", 1)
+
+def test_resume(tmp_path):
+    results = str(tmp_path / "results.jsonl")
+    tournament = Tournament(30, [5, 6], [[], ["percival", "morgana"]], "random", seed=0, shard_size=10)
+    stats = tournament.run(results, workers=1)
+    assert stats.by_player_count[5][0] == 60
+    assert stats.by_game_args[("percival", "morgana")][0] == 60
+
+    # Drop the last shard and leave a partial line, as if interrupted.
+    with open(results) as f:
+        lines = f.readlines()
+    with open(results, "w") as f:
+        f.writelines(lines[:-1])
+        f.write('{"key": ')
+
+    resumed = Tournament(30, [5, 6], [[], ["percival", "morgana"]], "random", seed=0, shard_size=10).run(results, workers=1)
+    assert dict(resumed.by_player_count) == dict(stats.by_player_count)
+    assert dict(resumed.by_role) == dict(stats.by_role)
+    with open(results) as f:
+        assert len(f.readlines()) == len(lines)
@@ -0,0 +1,91 @@
+import collections
+import json
+import os
+
+import pytest
+
+from ..bot import AvalonBot
+from ..timers import TimerWheel
+from ..tracing import Tracer, current_trace
+
+
+def read_spans(filename):
+    with open(filename) as f:
+        return [json.loads(line) for line in f]
+
+def test_trace_from_pubmsg_to_sent_lines(tmp_path):
+    trace_filename = str(tmp_path / "traces.jsonl")
+    bot = AvalonBot(["#a"], "Avalon", "localhost", highscore_filename=str(tmp_path / "highscore.db"),
+        game_log_dir=str(tmp_path / "games"), history_dir=str(tmp_path / "history"), trace_filename=trace_filename)
+    sent = []
+    bot.outbound.send_line = lambda target, line: sent.append((target, line))
+    try:
+        for i in range(5):
+            bot.loop.run_until_complete(bot.process_pubmsg("p{}".format(i), "#a", "!join"))
+        bot.loop.run_until_complete(bot.process_pubmsg("p0", "#a", "!start"))
+        assert current_trace.get() is None
+        bot.outbound.bucket.burst = bot.outbound.bucket.tokens = 100
+        bot.outbound.release()
+        while bot.outbound.send_next() == 0:
+            pass
+    finally:
+        bot.close_files()
+        bot.loop.close()
+
+    spans = read_spans(trace_filename)
+    traces = collections.defaultdict(list)
+    for span in spans:
+        traces[span["trace"]].append(span)
+    assert len(traces) == 6
+
+    start = next(trace for trace in traces.values() if any(span.get("command") == "!start" for span in trace))
+    inbound = [span for span in start if span["span"] == "pubmsg"]
+    assert len(inbound) == 1
+    assert inbound[0]["nick"] == "p0" and inbound[0]["target"] == "#a"
+    assert inbound[0]["messages"] >= 6 # the roles and the announcement
+
+    handlers = {span["span"]: span for span in start if span["span"].startswith("handle_")}
+    assert set(handlers) == {"handle_pubmsg", "handle_start"}
+    assert handlers["handle_start"]["phases"] == ["assemble", "teamsel"]
+    assert "phases" not in spans[1] # handle_join does not change the phase
+
+    sends = [span for span in start if span["span"] == "send"]
+    assert {span["target"] for span in sends} == {"#a", "p0", "p1", "p2", "p3", "p4"}
+    assert len(sends) == inbound[0]["messages"]
+    assert all(span["duration"] >= 0 and span["bytes"] > 0 for span in sends)
+
+def test_timer_trace_finished_on_error(tmp_path):
+    trace_filename = str(tmp_path / "traces.jsonl")
+    bot = AvalonBot(["#a"], "Avalon", "localhost", highscore_filename=str(tmp_path / "highscore.db"),
+        game_log_dir=str(tmp_path / "games"), history_dir=str(tmp_path / "history"), trace_filename=trace_filename)
+    now = [0.0]
+    bot.timers = TimerWheel(clock=lambda: now[0])
+
+    def check_finish(game):
+        raise RuntimeError("check_finish failed")
+    bot.check_finish = check_finish
+    try:
+        bot.schedule_game_timer("#a", 1, lambda: None)
+        now[0] += 1
+        with pytest.raises(RuntimeError):
+            bot.timers.advance()
+        assert current_trace.get() is None
+    finally:
+        bot.close_files()
+        bot.loop.close()
+    assert [span["span"] for span in read_spans(trace_filename)] == ["timer"]
+
+def test_rotation(tmp_path):
+    filename = str(tmp_path / "traces.jsonl")
+    tracer = Tracer(filename, max_bytes=300, backup_count=2)
+    trace = tracer.start("pubmsg", nick="älice")
+    for i in range(30):
+        tracer.span(trace, "handle_join", 0.0, 0.001)
+    tracer.finish(trace)
+    tracer.close()
+
+    assert sorted(os.listdir(str(tmp_path))) == ["traces.jsonl", "traces.jsonl.1", "traces.jsonl.2"]
+    for name in os.listdir(str(tmp_path)):
+        assert os.path.getsize(str(tmp_path / name)) <= 300
+    assert read_spans(filename)[-1]["span"] == "pubmsg"
+    assert current_trace.get() is None
@@ -0,0 +1,77 @@
+from ..benchmark.bench_replay import Replay, synthetic_events
+from ..game import AvalonGame
+from .. import transcript
+from ..timers import TimerWheel
+from .test_bot import RecordingBot, pubmsg, privmsg
+
+
+def test_recorded_games_replay(tmp_path):
+    filename = str(tmp_path / "transcript.jsonl.gz")
+    bot = RecordingBot(["#a"], "Avalon", "localhost", highscore_filename=str(tmp_path / "highscore.db"),
+        game_log_dir=str(tmp_path / "games"), history_dir=str(tmp_path / "history"), transcript_filename=filename)
+    for i in range(5):
+        pubmsg(bot, "p{}".format(i), "#a", "!join")
+    pubmsg(bot, "p0", "#a", "!start percival morgana")
+    game = bot.games["#a"]
+    pubmsg(bot, game.get_teamsel_player(), "#a", "!team p0 p1")
+    for i in range(5):
+        privmsg(bot, "p{}".format(i), "accept")
+    bot.close_files()
+    bot.loop.close()
+
+    events = transcript.load(filename)
+    assert events[0][1] == "g" and len(events) == 1 + 5 + 1 + 1 + 5
+    replay = Replay()
+    for name, handler, args in replay.commands(events):
+        handler(*args)
+    replayed = replay.games["#a"]
+    assert replayed.phase == game.phase == AvalonGame.QuestVote
+    assert [r.short_name for r in replayed.roles] == [r.short_name for r in game.roles]
+    assert replayed.team == game.team
+
+def test_replay_with_deadline(tmp_path):
+    filename = str(tmp_path / "transcript.jsonl")
+    bot = RecordingBot(["#a"], "Avalon", "localhost", highscore_filename=str(tmp_path / "highscore.db"),
+        game_log_dir=str(tmp_path / "games"), history_dir=str(tmp_path / "history"), transcript_filename=filename,
+        phase_timeouts={AvalonGame.TeamSel: 10})
+    now = [0.0]
+    bot.timers = TimerWheel(clock=lambda: now[0])
+    for i in range(5):
+        pubmsg(bot, "p{}".format(i), "#a", "!join")
+    pubmsg(bot, "p0", "#a", "!start")
+    game = bot.games["#a"]
+    idle_leader = game.get_teamsel_player()
+    for i in range(10):
+        now[0] += 1
+        bot.timers.advance()
+    assert game.get_teamsel_player() != idle_leader and game.failed_votes == 1
+    pubmsg(bot, game.get_teamsel_player(), "#a", "!team p0 p1")
+    for i in range(5):
+        privmsg(bot, "p{}".format(i), "accept")
+    assert game.phase == AvalonGame.QuestVote
+    bot.highscore.close()
+    bot.close_files()
+    bot.loop.close()
+
+    events = transcript.load(filename)
+    assert [event[1:] for event in events if event[1] == "x"] == [["x", "#a", "handle_deadline"]]
+    replay = Replay()
+    for name, handler, args in replay.commands(events):
+        handler(*args)
+    replayed = replay.games["#a"]
+    assert (replayed.phase, replayed.failed_votes, replayed.teamsel_player_idx, replayed.team) == \
+        (game.phase, game.failed_votes, game.teamsel_player_idx, game.team)
+
+def test_synthetic_games_finish(tmp_path):
+    events = synthetic_events(games_per_config=1)
+    filename = str(tmp_path / "synthetic.jsonl")
+    transcript.save(filename, events)
+    events = transcript.load(filename)
+    replay = Replay()
+    games = set()
+    for name, handler, args in replay.commands(events):
+        game = handler.__self__
+        handler(*args)
+        games.add(game)
+    assert all(game.phase == AvalonGame.Finished for game in games)
+    assert len(games) == sum(1 for event in events if event[1] == "g")
@@ -0,0 +1,70 @@
+"""Hashed timer wheel for the phase deadlines of all games of a bot.
+
+Timers are kept in `size` slots of `tick` seconds each, a timer `delay`
+seconds ahead goes into the slot (now + delay) / tick modulo size. Adding
+and cancelling a timer are O(1) dict operations, and every tick only
+looks at the timers of one slot, so the cost of a tick does not grow with
+the number of games. Timers more than size ticks ahead stay in their slot
+for further rounds of the wheel.
+"""
+
+import math
+import time
+
+
+class Timer:
+    __slots__ = ("slot", "due_tick", "callback")
+
+    def __init__(self, slot, due_tick, callback):
+        self.slot = slot
+        self.due_tick = due_tick
+        self.callback = callback
+
+    @property
+    def active(self):
+        return self.slot is not None
+
+    def cancel(self):
+        if self.slot is not None:
+            del self.slot[self]
+            self.slot = None
+
+
+class TimerWheel:
+    def __init__(self, tick=1.0, size=512, clock=time.monotonic):
+        self.tick = tick
+        self.size = size
+        self.clock = clock
+        self.slots = [{} for i in range(size)] # dicts used as ordered sets of Timers
+        self.current_tick = self.tick_at(clock())
+
+    def tick_at(self, t):
+        return math.floor(t / self.tick)
+
+    def __len__(self):
+        return sum(len(slot) for slot in self.slots)
+
+    def schedule(self, delay, callback):
+        """Call callback after at least delay seconds. Return the Timer."""
+        due_tick = self.tick_at(self.clock() + delay)
+        if due_tick <= self.current_tick:
+            due_tick = self.current_tick + 1
+        slot = self.slots[due_tick % self.size]
+        timer = Timer(slot, due_tick, callback)
+        slot[timer] = None
+        return timer
+
+    def advance(self):
+        """Run the callbacks of all timers that are due."""
+        now_tick = self.tick_at(self.clock())
+        # After a long pause, one round of the wheel visits every slot.
+        end_tick = min(now_tick, self.current_tick + self.size)
+        while self.current_tick < end_tick:
+            self.current_tick += 1
+            slot = self.slots[self.current_tick % self.size]
+            due = [timer for timer in slot if timer.due_tick <= now_tick]
+            for timer in due:
+                if timer.slot is slot: # not cancelled by an earlier callback
+                    timer.cancel()
+                    timer.callback()
+        self.current_tick = now_tick
@@ -0,0 +1,197 @@
+"""Self-play tournaments over many game configurations on all CPU cores.
+
+    python3 -m avalon_irc.tournament --games 100000 --players 5 7 10 --results results.jsonl
+
+The games of every configuration (player count and game arguments) are
+split into shards of --shard-size games. Each shard is simulated by a
+worker process with its own seed, derived from --seed and the shard, so
+results do not depend on the number of workers. Workers send back one
+summary per shard, which is appended to the results file as one JSON
+line. Running the same command again skips the shards already in the
+results file.
+"""
+
+import collections
+import concurrent.futures
+import itertools
+import json
+import os
+import sys
+
+from .game import AvalonGame
+from .roles import roles_by_short_name
+from .simulator import Simulator, policy_classes
+
+
+Shard = collections.namedtuple("Shard", "player_count game_args index games")
+
+
+def shard_key(player_count, game_args, index):
+    return "{}:{}:{}".format(player_count, ",".join(game_args), index)
+
+
+def all_game_args():
+    """Return all combinations of valid game arguments, the empty one first."""
+    args = AvalonGame.valid_game_args
+    return [list(c) for n in range(len(args) + 1) for c in itertools.combinations(args, n)]
+
+
+def run_shard(shard, policy_name, seed):
+    """Simulate one shard. Returns the shard and a compact summary: number of
+    Good wins, and per role [games played, games won], or None if the
+    configuration cannot be started. Other errors of the simulation, bugs
+    found by the tournament, are raised."""
+    if AvalonGame.plan_roles(shard.player_count, shard.game_args).role_classes is None:
+        return shard, None
+    sim = Simulator(policy_classes[policy_name](), seed="{}:{}".format(seed, shard_key(*shard[:3])))
+    good_wins = 0
+    roles = collections.defaultdict(lambda: [0, 0])
+    for i in range(shard.games):
+        result = sim.play(shard.player_count, shard.game_args)
+        good_won = result.winner == AvalonGame.Good
+        good_wins += good_won
+        for short_name in result.roles:
+            stats = roles[short_name]
+            stats[0] += 1
+            stats[1] += good_won != roles_by_short_name[short_name].evil
+    return shard, {"good_wins": good_wins, "roles": dict(roles)}
+
+
+class TournamentStats:
+    """Aggregates shard summaries by player count, game arguments and role."""
+
+    def __init__(self):
+        self.by_player_count = collections.defaultdict(lambda: [0, 0]) # [games, Good wins]
+        self.by_game_args = collections.defaultdict(lambda: [0, 0])
+        self.by_role = collections.defaultdict(lambda: [0, 0]) # [games played, games won]
+        self.invalid = set()
+
+    def add(self, record):
+        if record["summary"] is None:
+            self.invalid.add((record["players"], tuple(record["game_args"])))
+            return
+        games = record["games"]
+        good_wins = record["summary"]["good_wins"]
+        for stats in (self.by_player_count[record["players"]], self.by_game_args[tuple(record["game_args"])]):
+            stats[0] += games
+            stats[1] += good_wins
+        for role, (played, won) in record["summary"]["roles"].items():
+            self.by_role[role][0] += played
+            self.by_role[role][1] += won
+
+    def report(self):
+        lines = []
+        lines.append("{:<40} {:>10} {:>10}".format("players", "games", "Good wins"))
+        for player_count, (games, good_wins) in sorted(self.by_player_count.items()):
+            lines.append("{:<40} {:>10} {:>10.1%}".format(player_count, games, good_wins / games))
+        lines.append("")
+        lines.append("{:<40} {:>10} {:>10}".format("game arguments", "games", "Good wins"))
+        for game_args, (games, good_wins) in sorted(self.by_game_args.items()):
+            lines.append("{:<40} {:>10} {:>10.1%}".format(" ".join(game_args) or "-", games, good_wins / games))
+        lines.append("")
+        lines.append("{:<40} {:>10} {:>10}".format("role", "played", "won"))
+        for role, (played, won) in sorted(self.by_role.items()):
+            lines.append("{:<40} {:>10} {:>10.1%}".format(roles_by_short_name[role].long_name, played, won / played))
+        for player_count, game_args in sorted(self.invalid):
+            lines.append("Invalid configuration: {} players, {}".format(player_count, " ".join(game_args) or "-"))
+        return "\n".join(lines)
+
+
+class Tournament:
+    def __init__(self, games, player_counts, game_args_list, policy_name="heuristic", seed=0, shard_size=1000):
+        self.params = {
+            "games": games,
+            "player_counts": list(player_counts),
+            "game_args_list": [list(a) for a in game_args_list],
+            "policy": policy_name,
+            "seed": seed,
+            "shard_size": shard_size,
+        }
+
+    def shards(self):
+        games = self.params["games"]
+        shard_size = self.params["shard_size"]
+        for player_count in self.params["player_counts"]:
+            for game_args in self.params["game_args_list"]:
+                for index, start in enumerate(range(0, games, shard_size)):
+                    yield Shard(player_count, game_args, index, min(shard_size, games - start))
+
+    def load_results(self, filename, stats):
+        """Add the shards in filename to stats. Return their keys and the
+        length of the file up to the last complete line."""
+        done = set()
+        length = 0
+        if not os.path.exists(filename):
+            return done, length
+        with open(filename, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break # Partial line from an interrupted run
+                record = json.loads(line)
+                if length == 0:
+                    if record != self.params:
+                        raise ValueError("{} was written with different parameters: {}".format(filename, record))
+                else:
+                    done.add(record["key"])
+                    stats.add(record)
+                length += len(line)
+        return done, length
+
+    def run(self, results_filename, workers=None):
+        stats = TournamentStats()
+        done, length = self.load_results(results_filename, stats)
+        pending = [shard for shard in self.shards() if not shard_key(*shard[:3]) in done]
+        print("{} shards done, {} to go.".format(len(done), len(pending)), file=sys.stderr)
+
+        with open(results_filename, "a") as f:
+            f.truncate(length)
+            if length == 0:
+                f.write(json.dumps(self.params) + "\n")
+            with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = [executor.submit(run_shard, shard, self.params["policy"], self.params["seed"]) for shard in pending]
+                for future in concurrent.futures.as_completed(futures):
+                    shard, summary = future.result()
+                    record = {
+                        "key": shard_key(*shard[:3]),
+                        "players": shard.player_count,
+                        "game_args": shard.game_args,
+                        "games": shard.games,
+                        "summary": summary,
+                    }
+                    f.write(json.dumps(record) + "\n")
+                    f.flush()
+                    stats.add(record)
+        return stats
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run a self-play tournament of Avalon games on all cores.")
+    parser.add_argument("--games", type=int, default=10000, help="games per configuration")
+    parser.add_argument("--players", type=int, nargs="+", default=sorted(AvalonGame.game_plans), choices=sorted(AvalonGame.game_plans))
+    parser.add_argument("--game-args", action="append", metavar="ARG,ARG,...",
+        help="comma-separated game arguments, can be repeated. Default: all combinations")
+    parser.add_argument("--policy", default="heuristic", choices=sorted(policy_classes))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--shard-size", type=int, default=1000)
+    parser.add_argument("--workers", type=int, default=None, help="default: number of CPUs")
+    parser.add_argument("--results", default="tournament.jsonl", help="results file, used to resume")
+    args = parser.parse_args()
+
+    if args.game_args:
+        game_args_list = [[a for a in s.split(",") if a] for s in args.game_args]
+    else:
+        game_args_list = all_game_args()
+
+    tournament = Tournament(args.games, args.players, game_args_list, args.policy, args.seed, args.shard_size)
+    try:
+        stats = tournament.run(args.results, args.workers)
+    except ValueError as e:
+        print("Error: {}".format(e))
+        sys.exit(1)
+    print(stats.report())
+
+
+if __name__ == "__main__":
+    main()
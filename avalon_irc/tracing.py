@@ -0,0 +1,173 @@
+"""Traces of inbound messages through the game to the lines sent.
+
+AvalonBot(trace_filename=...) starts a Trace for every pubmsg and privmsg
+it receives and every game timer that fires. While it is processed, the
+trace is the current_trace of the task, so the handlers of a game class
+made by traced_game_class() and OutboundQueue.put() find it without it
+being passed around. Every message queued under a trace carries it through
+the outbound queue until its line is written to the connection.
+
+Spans are collected in memory and written by flush(), which AvalonBot calls
+on its disk thread, as JSON lines to trace_filename. The file is rotated
+like a logging.handlers.RotatingFileHandler. All spans of a trace share its
+"trace" id:
+
+    {"trace": id, "span": "pubmsg", "start": t, "duration": s, "queued": s,
+        "messages": n, "nick": ..., "target": ..., "command": ...}
+    {"trace": id, "span": "handle_team", "start": t, "duration": s,
+        "phases": ["teamsel", "teamvote"]}
+    {"trace": id, "span": "send", "start": t, "duration": s, "target": ..., "bytes": n}
+
+start is the Unix time. The span of the inbound message covers its
+processing, queued is the time it waited for the loop before that, and
+messages counts the messages it queued. A send span lasts from queueing
+a message until its line was sent. phases is only there if the handler
+changed the phase of the game.
+"""
+
+import contextvars
+import functools
+import json
+import os
+import random
+import threading
+import time
+
+from .game import AvalonGame
+from .metrics import GAME_HANDLERS
+
+current_trace = contextvars.ContextVar("current_trace", default=None)
+
+
+class Trace:
+    __slots__ = ("id", "kind", "received", "started", "attrs", "messages", "token")
+
+    def __init__(self, id, kind, received, started, attrs):
+        self.id = id
+        self.kind = kind
+        self.received = received # perf_counter() when the event arrived
+        self.started = started # perf_counter() when its processing started
+        self.attrs = attrs
+        self.messages = 0 # messages queued while it was the current trace
+        self.token = None
+
+
+class Tracer:
+    def __init__(self, filename, max_bytes=16*1024*1024, backup_count=5):
+        self.filename = filename
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        # perf_counter() + wall_offset is the Unix time.
+        self.wall_offset = time.time() - time.perf_counter()
+        self.file = None
+        self.size = 0
+        self.pending = [] # records not written yet
+        self.lock = threading.Lock()
+        self.open()
+
+    def open(self):
+        directory = os.path.dirname(self.filename)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.file = open(self.filename, "a", encoding="utf-8")
+        self.size = self.file.tell()
+
+    def rotate(self):
+        """Rename filename to filename.1, filename.1 to filename.2 and so on,
+        dropping filename.<backup_count>, and start a new file."""
+        self.file.close()
+        for i in range(self.backup_count - 1, 0, -1):
+            source = "{}.{}".format(self.filename, i)
+            if os.path.exists(source):
+                os.replace(source, "{}.{}".format(self.filename, i + 1))
+        if self.backup_count > 0:
+            os.replace(self.filename, self.filename + ".1")
+        else:
+            os.remove(self.filename)
+        self.open()
+
+    def write(self, record):
+        with self.lock:
+            self.pending.append(record)
+
+    def span(self, trace, name, start, duration, **attrs):
+        """Write a span of trace that started at perf_counter() start."""
+        record = {"trace": trace.id, "span": name, "start": round(start + self.wall_offset, 6),
+            "duration": round(duration, 6)}
+        record.update(attrs)
+        self.write(record)
+
+    def start(self, kind, received=None, **attrs):
+        """Start a trace and make it the current trace until finish()."""
+        now = time.perf_counter()
+        trace = Trace("{:016x}".format(random.getrandbits(64)), kind, now if received is None else received, now, attrs)
+        trace.token = current_trace.set(trace)
+        return trace
+
+    def finish(self, trace):
+        """Write the span of the inbound event and restore the previous current trace."""
+        current_trace.reset(trace.token)
+        self.span(trace, trace.kind, trace.started, time.perf_counter() - trace.started,
+            queued=round(trace.started - trace.received, 6), messages=trace.messages, **trace.attrs)
+
+    @staticmethod
+    def current():
+        return current_trace.get()
+
+    def sent(self, target, line, traces):
+        """Called by OutboundQueue when line went out with the messages of
+        traces, a list of (trace, seconds the message waited)."""
+        now = time.perf_counter()
+        size = len(line.encode("utf-8"))
+        for trace, wait in traces:
+            self.span(trace, "send", now - wait, wait, target=target, bytes=size)
+
+    def flush(self):
+        """Write the pending spans. May run on another thread."""
+        with self.lock:
+            pending, self.pending = self.pending, []
+            for record in pending:
+                line = json.dumps(record, separators=(",", ":")) + "\n"
+                size = len(line.encode("utf-8"))
+                if self.size and self.size + size > self.max_bytes:
+                    self.rotate()
+                self.file.write(line)
+                self.size += size
+            self.file.flush()
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+
+def traced(func, tracer, name):
+    """Return the game method func wrapped to write a span of the current trace."""
+    perf_counter = time.perf_counter
+    phase_names = AvalonGame.phase_names
+
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        trace = current_trace.get()
+        if trace is None:
+            return func(self, *args, **kwargs)
+        phase = self.phase
+        start = perf_counter()
+        try:
+            return func(self, *args, **kwargs)
+        finally:
+            duration = perf_counter() - start
+            if self.phase != phase:
+                tracer.span(trace, name, start, duration, phases=[phase_names[phase], phase_names[self.phase]])
+            else:
+                tracer.span(trace, name, start, duration)
+    return wrapper
+
+
+def traced_game_class(game_class, tracer, handlers=GAME_HANDLERS):
+    """Return a subclass of game_class whose handlers write spans of the
+    current trace. Like metrics.instrumented_game_class() it adds no slots,
+    and the two can be stacked."""
+    namespace = {"__slots__": ()}
+    for name in handlers:
+        namespace[name] = traced(getattr(game_class, name), tracer, name)
+    return type("Traced" + game_class.__name__, (game_class,), namespace)
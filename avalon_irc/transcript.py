@@ -0,0 +1,87 @@
+"""Transcripts of the inbound traffic of AvalonBot, for replay benchmarks.
+
+A transcript has one compact JSON array per line (gzip-compressed if the
+filename ends with .gz). The first line is the header
+["avalon-transcript", version, start time]. Every following line starts
+with the seconds since the start:
+
+    [t, "g", channel, seed]         a new game with random.Random(seed)
+    [t, "p", channel, nick, msg]    public message
+    [t, "m", nick, msg]             private message
+    [t, "x", channel, handler]      game timer, e.g. "handle_deadline"
+
+Messages and timers are recorded in the order they are processed, so
+replaying them on games created with the recorded seeds reproduces the
+games. They are collected in memory and written by flush(), which AvalonBot
+calls on its disk thread.
+"""
+
+import gzip
+import json
+import threading
+import time
+
+VERSION = 1
+
+
+def open_transcript(filename, mode):
+    if filename.endswith(".gz"):
+        return gzip.open(filename, mode + "t", encoding="utf-8")
+    return open(filename, mode, encoding="utf-8")
+
+
+class TranscriptRecorder:
+    def __init__(self, filename, clock=time.time):
+        self.clock = clock
+        self.start = clock()
+        self.file = open_transcript(filename, "w")
+        self.pending = [] # events not written yet
+        self.lock = threading.Lock()
+        self.write(["avalon-transcript", VERSION, round(self.start, 3)])
+
+    def write(self, event):
+        with self.lock:
+            self.pending.append(event)
+
+    def elapsed(self):
+        return round(self.clock() - self.start, 3)
+
+    def new_game(self, channel, seed):
+        self.write([self.elapsed(), "g", channel, seed])
+
+    def pubmsg(self, channel, nick, msg):
+        self.write([self.elapsed(), "p", channel, nick, msg])
+
+    def privmsg(self, nick, msg):
+        self.write([self.elapsed(), "m", nick, msg])
+
+    def timer(self, channel, handler):
+        self.write([self.elapsed(), "x", channel, handler])
+
+    def flush(self):
+        """Write the pending events. May run on another thread."""
+        with self.lock:
+            pending, self.pending = self.pending, []
+            self.file.write("".join(json.dumps(event, separators=(",", ":")) + "\n" for event in pending))
+            self.file.flush()
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+
+def load(filename):
+    """Return the events of a transcript as lists, without the header."""
+    with open_transcript(filename, "r") as f:
+        header = json.loads(f.readline())
+        if header[:2] != ["avalon-transcript", VERSION]:
+            raise ValueError("{} is not a version {} transcript.".format(filename, VERSION))
+        return [json.loads(line) for line in f if line.endswith("\n")]
+
+
+def save(filename, events):
+    """Write events, e.g. synthetic ones, as a transcript."""
+    recorder = TranscriptRecorder(filename, clock=lambda: 0.0)
+    for event in events:
+        recorder.write(event)
+    recorder.close()
@@ -1,10 +1,15 @@
-from setuptools import setup
+from setuptools import setup, find_packages
 setup(name='avalon-irc',
 	version='0.1.0',
-	packages=['avalon_irc'],
+	packages=find_packages(),
+	extras_require={
+		'balance': ['numpy'],
+		'rerate': ['numpy'],
+	},
 	entry_points={
 		'console_scripts': [
-			'avalon-irc = avalon_irc.bot:main'
+			'avalon-irc = avalon_irc.cli:main',
+			'avalon-irc-supervisor = avalon_irc.supervisor:main',
 		]
 	},
 )
\ No newline at end of file